@@ -0,0 +1,208 @@
+# archive_stream.py
+# 这是一个目录归档流模块，使用tarfile模块的流模式，在传输过程中即时生成或解开tar归档，不产生临时文件
+# 归档数据被切分成带长度前缀的帧在socket上传输，接收方可以准确地知道归档流在哪里结束
+# 上传目录时，服务器解包完毕后回复OK 文件数，解包失败时也会先读完剩下的帧，再回复ERROR 原因
+import os
+import secrets
+import shutil
+import struct
+import tarfile
+
+# 定义一个常量，用于存储帧头的格式，4字节无符号整数表示本帧数据的长度
+FRAME_HEADER = struct.Struct('!I')
+# 定义一个常量，用于存储每一帧的最大长度
+CHUNK_SIZE = 64 * 1024
+# 定义一个常量，用于标记错误帧，后面跟着一个普通帧，内容是错误信息
+ERROR_MARK = 0xFFFFFFFF
+# 定义一个常量，用于存储接收解包结果时的缓冲区大小
+STATUS_SIZE = 1024
+
+
+# 定义一个分帧写入类，把tarfile写出的数据切分成帧，通过socket发送
+class ChunkedWriter:
+
+    # 初始化方法，接受socket对象和帧的大小作为参数，progress是一个可选的回调函数，每发送一帧就传入这一帧的长度
+    def __init__(self, sock, chunk_size=CHUNK_SIZE, progress=None):
+        self.sock = sock
+        self.chunk_size = chunk_size
+        self.progress = progress
+        # 创建一个字节缓冲区，用于攒够一帧再发送，减少系统调用的次数
+        self.buffer = bytearray()
+        # 增加一个属性，用于统计已发送的归档字节数
+        self.total = 0
+
+    # 供tarfile调用的写入方法
+    def write(self, data):
+        self.buffer += data
+        # 缓冲区攒够一帧，就发送出去
+        while len(self.buffer) >= self.chunk_size:
+            self.send_frame(self.chunk_size)
+        return len(data)
+
+    # 发送一帧数据的方法
+    def send_frame(self, size):
+        frame = bytes(self.buffer[:size])
+        del self.buffer[:size]
+        self.sock.sendall(FRAME_HEADER.pack(len(frame)) + frame)
+        self.total += len(frame)
+        if self.progress:
+            self.progress(len(frame))
+
+    # 结束归档流的方法，发送剩余的数据和一个长度为0的结束帧
+    def finish(self):
+        if self.buffer:
+            self.send_frame(len(self.buffer))
+        self.sock.sendall(FRAME_HEADER.pack(0))
+
+    # 中止归档流的方法，发送一个错误帧，告诉接收方归档不完整
+    def abort(self, message):
+        data = str(message).encode()
+        self.buffer.clear()
+        self.sock.sendall(FRAME_HEADER.pack(ERROR_MARK) + FRAME_HEADER.pack(len(data)) + data)
+
+
+# 定义一个分帧读取类，把socket上收到的帧还原成连续的字节流，供tarfile读取
+class ChunkedReader:
+
+    # 初始化方法，接受socket对象作为参数
+    def __init__(self, sock):
+        self.sock = sock
+        # 增加一个属性，用于存储当前帧还没有读取的字节数
+        self.remaining = 0
+        # 增加一个属性，用于标记是否已经收到结束帧
+        self.finished = False
+        # 增加一个属性，用于统计已接收的归档字节数
+        self.total = 0
+
+    # 从socket精确接收n个字节的方法
+    def recv_exact(self, n):
+        data = bytearray()
+        while len(data) < n:
+            chunk = self.sock.recv(n - len(data))
+            if not chunk:
+                raise ConnectionError('归档流意外中断')
+            data += chunk
+        return bytes(data)
+
+    # 读取下一个帧头的方法
+    def next_frame(self):
+        size, = FRAME_HEADER.unpack(self.recv_exact(FRAME_HEADER.size))
+        # 如果是错误帧，就读出错误信息并抛出异常
+        if size == ERROR_MARK:
+            length, = FRAME_HEADER.unpack(self.recv_exact(FRAME_HEADER.size))
+            self.finished = True
+            raise IOError(self.recv_exact(length).decode())
+        # 如果是结束帧，就标记归档流已结束
+        if size == 0:
+            self.finished = True
+        self.remaining = size
+
+    # 供tarfile调用的读取方法，返回空字节串表示归档流结束
+    def read(self, size=-1):
+        if self.remaining == 0 and not self.finished:
+            self.next_frame()
+        if self.finished:
+            return b''
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.sock.recv(size)
+        if not data:
+            raise ConnectionError('归档流意外中断')
+        self.remaining -= len(data)
+        self.total += len(data)
+        return data
+
+    # 丢弃剩余帧的方法，tarfile读到归档末尾后可能还有填充数据，必须读完才能继续收发命令
+    def drain(self):
+        while not self.finished:
+            if self.remaining == 0:
+                self.next_frame()
+            else:
+                self.read(self.remaining)
+
+
+# 把目录打包成tar归档流并发送的函数，返回发送的文件数和归档字节数
+# progress是一个可选的回调函数，每发送一帧就传入这一帧的长度
+def send_archive(sock, src_dir, compress=False, progress=None):
+    writer = ChunkedWriter(sock, progress=progress)
+    count = 0
+    try:
+        # 使用流模式打开tar归档，边打包边发送，不需要临时文件
+        with tarfile.open(fileobj=writer, mode='w|gz' if compress else 'w|') as tar:
+            # 遍历目录，逐个把文件加入归档，归档中的路径相对于被发送的目录
+            for root, dirs, files in os.walk(src_dir):
+                dirs.sort()
+                for name in sorted(files):
+                    filepath = os.path.join(root, name)
+                    tar.add(filepath, arcname=os.path.relpath(filepath, src_dir), recursive=False)
+                    count += 1
+    # 如果发生异常，就发送一个错误帧，让接收方及时停止
+    except Exception as e:
+        writer.abort(e)
+        raise
+    writer.finish()
+    return count, writer.total
+
+
+# 把归档中的一个文件写到目标位置的函数，先写入同目录下名字唯一的临时文件，写完后再替换目标文件
+# 已有的文件不会被截断后原地改写，正在从内存映射下载它的传输和与它共用数据的硬链接都不受影响，中途失败也不会留下写了一半的文件
+def extract_file(tar, member, target):
+    directory, name = os.path.split(target)
+    os.makedirs(directory, exist_ok=True)
+    temp = os.path.join(directory, f'.{name}.{secrets.token_hex(4)}.part')
+    # 用os.open创建临时文件，权限和普通的新文件一样受umask控制
+    fd = os.open(temp, os.O_WRONLY | os.O_CREAT | os.O_EXCL | getattr(os, 'O_BINARY', 0), 0o666)
+    try:
+        with open(fd, 'wb') as f:
+            shutil.copyfileobj(tar.extractfile(member), f, CHUNK_SIZE)
+        os.replace(temp, target)
+    except BaseException:
+        if os.path.lexists(temp):
+            os.remove(temp)
+        raise
+
+
+# 接收tar归档流并解包到目录的函数，返回解包的文件数和归档字节数
+# progress是一个可选的回调函数，每解包一个文件就传入该文件的大小
+# on_file是一个可选的回调函数，每写好一个文件就传入它的路径，服务器用它使这个文件旧的缓存失效
+def receive_archive(sock, dest_dir, progress=None, on_file=None):
+    reader = ChunkedReader(sock)
+    count = 0
+    try:
+        os.makedirs(dest_dir, exist_ok=True)
+        root = os.path.realpath(dest_dir)
+        # 使用r|*模式打开，自动识别归档流是否经过压缩
+        with tarfile.open(fileobj=reader, mode='r|*') as tar:
+            for member in tar:
+                # 只接受普通文件和目录，防止通过链接或设备文件破坏服务器或客户端的文件系统
+                if not (member.isfile() or member.isdir()):
+                    continue
+                # 检查成员路径，防止通过..或绝对路径写到目标目录之外
+                target = os.path.realpath(os.path.join(dest_dir, member.name))
+                if target == root or os.path.commonpath([target, root]) != root:
+                    continue
+                if member.isdir():
+                    os.makedirs(target, exist_ok=True)
+                    continue
+                extract_file(tar, member, target)
+                count += 1
+                if on_file:
+                    on_file(target)
+                if progress:
+                    progress(member.size)
+    # 解包中途出错时（归档损坏、磁盘已满、没有权限等），丢弃剩下的帧再抛出异常，socket上的下一条数据仍然是命令或响应
+    # 丢弃时连接中断会抛出ConnectionError，调用者只能关闭连接
+    except Exception:
+        reader.drain()
+        raise
+    # 读完归档末尾的填充数据和结束帧
+    reader.drain()
+    return count, reader.total
+
+
+# 读取服务器解包结果的函数，上传目录的一方发送完归档流后调用，结果不是OK时抛出IOError
+def read_status(sock):
+    status = sock.recv(STATUS_SIZE).decode('utf-8', 'replace')
+    if not status.startswith('OK'):
+        raise IOError(status or '服务器断开连接')
+    return status
@@ -0,0 +1,303 @@
+# async_client.py
+# 这是一个基于asyncio的FTP客户端库，不依赖图形界面，协议和client.py中的FTPClient、ftp_session.py中的FTPSession保持一致
+# 每个会话只占用一个socket和几个协程，不需要单独的线程，一个进程中可以同时运行几百个会话，适合自动化脚本和容量测试
+# 不带文件数据的命令使用流水线协议发送，响应带有长度，不需要像阻塞版本那样靠“暂时没有数据可读”来判断响应结束
+# 用法：
+#     async with await AsyncFTPSession.connect('127.0.0.1', 8888) as session:
+#         await session.login('user', 'password')
+#         await session.cd('data')
+#         await session.get('file.bin', 'file.bin')
+import asyncio
+import os
+import binary_listing
+import data_channel
+import file_meta
+import listing_cache
+import net_utils
+import pipeline
+import upload_store
+
+# 定义一些常量
+BUFFER_SIZE = 64 * 1024 # 缓冲区大小，用于接收和发送数据
+CONNECT_TIMEOUT = 10 # 连接服务器和接收欢迎消息的超时秒数
+CONNECT_CONCURRENCY = 4 # 同时进行中的连接数，要小于服务器的监听队列长度（server.LISTEN_BACKLOG），否则多出的连接会被丢弃，等几秒重传后才能建立
+
+
+# 定义一个异步FTP会话类，用connect类方法创建
+# 同一个会话上的命令按调用的顺序依次执行，多个协程可以共用一个会话；要并发执行命令，就使用多个会话
+class AsyncFTPSession:
+
+    # 初始化方法，接受已经建立连接的读写流对象作为参数
+    def __init__(self, reader, writer, welcome=''):
+        self.reader = reader
+        self.writer = writer
+        self.welcome = welcome
+        # 创建一个锁对象，一条命令的请求和响应完成之前，其他协程不能在这个连接上发送命令
+        self.lock = asyncio.Lock()
+        # 增加一些属性，用于存储会话令牌、当前目录和断点
+        self.token = ''
+        self.current_dir = ''
+        self.breakpoint = 0
+        # 增加一个属性，用于存储下一条流水线请求的编号
+        self.next_id = 1
+
+    # 连接服务器的类方法，返回一个会话对象
+    @classmethod
+    async def connect(cls, host, port, timeout=CONNECT_TIMEOUT):
+        reader, writer = await asyncio.wait_for(asyncio.open_connection(host, port, limit=BUFFER_SIZE), timeout)
+        # 接收服务器的欢迎消息
+        try:
+            welcome = await asyncio.wait_for(reader.read(BUFFER_SIZE), timeout)
+        except BaseException:
+            writer.close()
+            raise
+        return cls(reader, writer, welcome.decode())
+
+    # 支持async with语句的方法，退出时发送quit命令并关闭连接
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.quit()
+
+    # 读取一条流水线响应的方法，返回请求编号和响应内容
+    async def read_frame(self):
+        header = await self.reader.readline()
+        if not header:
+            raise ConnectionError('服务器断开连接')
+        request_id, length = header.decode()[1:].split(' ')
+        return request_id, await self.reader.readexactly(int(length))
+
+    # 用流水线模式发送多条命令的方法，一次发送所有命令，再读取所有响应，返回和命令顺序一致的响应列表
+    # 只能用于不带文件数据的命令；ls -b和lsv -b命令的响应是字节串，其他命令的响应是字符串
+    async def pipeline(self, commands):
+        async with self.lock:
+            ids, data = pipeline.encode_requests(commands, self.next_id)
+            self.next_id += len(commands)
+            self.writer.write(data)
+            await self.writer.drain()
+            # 只读命令可能在服务器的后台线程中执行，响应不一定按请求的顺序返回
+            responses = {}
+            while len(responses) < len(commands):
+                request_id, body = await self.read_frame()
+                responses[request_id] = body
+        results = [responses[request_id] if binary_listing.is_binary_command(command) else responses[request_id].decode()
+                   for command, request_id in zip(commands, ids)]
+        # 按响应更新会话的状态
+        for command, response in zip(commands, results):
+            if isinstance(response, bytes):
+                self.current_dir = binary_listing.response_directory(response) or self.current_dir
+            elif command == 'ls':
+                self.current_dir = response.split('\n', 1)[0]
+            elif command.startswith('lsv') and '\n' in response:
+                self.current_dir = response.split('\n', 2)[1]
+            elif command.startswith('cd') and response.startswith('OK'):
+                self.current_dir = response.split(' ', 1)[1]
+            elif command.startswith('restart') and response.isdigit():
+                self.breakpoint = int(response)
+        return results
+
+    # 发送一条不带文件数据的命令并返回响应的方法
+    async def send_command(self, command):
+        return (await self.pipeline([command]))[0]
+
+    # 登录的方法，返回一个布尔值，表示是否登录成功
+    async def login(self, username, password):
+        response = await self.send_command(f'login {username} {password}')
+        if response.startswith('OK') and len(response.split(' ')) > 2:
+            self.token = response.split(' ')[2]
+        return response.startswith('OK')
+
+    # 注册的方法，返回一个布尔值，表示是否注册成功
+    async def register(self, username, password):
+        return (await self.send_command(f'register {username} {password}')).startswith('OK')
+
+    # 凭会话令牌恢复断线前的会话的方法，返回一个布尔值，表示是否恢复成功
+    async def resume(self, token=None):
+        response = await self.send_command('resume ' + (token or self.token))
+        if not response.startswith('OK'):
+            return False
+        _, breakpoint, self.current_dir = response.split(' ', 2)
+        self.breakpoint = int(breakpoint)
+        return True
+
+    # 列出当前目录的方法，返回当前目录和文件列表的原始文本
+    async def ls(self):
+        return await self.send_command('ls')
+
+    # 用二进制格式列出当前目录的方法，返回当前目录和(类型, 大小, 修改时间, 名称)的列表
+    async def ls_binary(self):
+        response = await self.send_command('ls ' + binary_listing.BINARY_OPTION)
+        if not response.startswith(binary_listing.MAGIC):
+            raise IOError(response.decode('utf-8', 'replace'))
+        directory, entries, _ = binary_listing.decode(response)
+        return directory, entries
+
+    # 按缓存的版本号列出当前目录的方法，返回原始响应，可以交给listing_cache.ListingCache的apply方法处理
+    async def lsv(self, version=listing_cache.NO_VERSION, binary=False):
+        option = binary_listing.BINARY_OPTION + ' ' if binary else ''
+        return await self.send_command(f'lsv {option}{version}')
+
+    # 切换目录的方法，返回一个布尔值，表示是否切换成功
+    async def cd(self, path):
+        return (await self.send_command('cd ' + path)).startswith('OK')
+
+    # 设置断点的方法
+    async def restart(self, breakpoint):
+        await self.send_command(f'restart {breakpoint}')
+        return self.breakpoint
+
+    # 查询多个路径的元数据的方法，返回一个字典列表，包括类型、大小、修改时间、哈希值和路径
+    async def mstat(self, paths, compute=False):
+        option = '-h ' if compute else ''
+        response = await self.send_command(f'mstat {option}' + file_meta.SEPARATOR.join(paths))
+        if not response.startswith('OK'):
+            raise IOError(response)
+        return file_meta.parse_response(response)
+
+    # 查询一个路径的元数据的方法
+    async def stat(self, path, compute=False):
+        return (await self.mstat([path], compute))[0]
+
+    # 连接数据端口的方法，数据端口和控制连接在同一个地址上，连接后先发送密钥
+    async def open_data_connection(self, port, key):
+        host = self.writer.get_extra_info('peername')[0]
+        reader, writer = await asyncio.wait_for(asyncio.open_connection(host, port, limit=BUFFER_SIZE), CONNECT_TIMEOUT)
+        writer.write((key + '\n').encode())
+        return reader, writer
+
+    # 下载文件的方法，local_path为None时丢弃收到的数据，返回本次接收的字节数
+    # 响应的格式是OK 文件大小 文件名，文件数据紧跟在后面，按长度读取，不会把文件数据当成响应
+    # passive为True时通过单独的数据连接接收，只在发送命令时占用控制连接，传输期间其他协程可以在这个会话上执行命令
+    async def get(self, filename, local_path=None, passive=False):
+        if passive:
+            return await self.get_passive(filename, local_path)
+        async with self.lock:
+            self.writer.write(('get ' + filename).encode())
+            await self.writer.drain()
+            status = await self.reader.readexactly(3)
+            if status != b'OK ':
+                raise FileNotFoundError((status + await self.reader.read(BUFFER_SIZE)).decode('utf-8', 'replace'))
+            filesize = int(await self.reader.readuntil(b' '))
+            await self.reader.readexactly(len(filename.encode()))
+            remaining = filesize - self.breakpoint
+            f = net_utils.open_download(local_path, self.breakpoint) if local_path else None
+            try:
+                while remaining > 0:
+                    data = await self.reader.read(min(BUFFER_SIZE, remaining))
+                    if not data:
+                        raise ConnectionError('服务器断开')
+                    if f:
+                        f.write(data)
+                    remaining -= len(data)
+            finally:
+                if f:
+                    f.close()
+        return filesize - self.breakpoint
+
+    # 通过数据连接下载文件的方法，服务器把断点交给这次传输后清零，会话的断点也同步清零
+    async def get_passive(self, filename, local_path=None):
+        response = await self.send_command(f'get {data_channel.PASSIVE_OPTION} {filename}')
+        if not response.startswith('OK'):
+            raise FileNotFoundError(response)
+        filesize, port, key, _ = data_channel.parse_get_reply(response)
+        breakpoint, self.breakpoint = self.breakpoint, 0
+        reader, writer = await self.open_data_connection(port, key)
+        remaining = filesize - breakpoint
+        f = net_utils.open_download(local_path, breakpoint) if local_path else None
+        try:
+            while remaining > 0:
+                data = await reader.read(min(BUFFER_SIZE, remaining))
+                if not data:
+                    raise ConnectionError('数据连接断开')
+                if f:
+                    f.write(data)
+                remaining -= len(data)
+        finally:
+            if f:
+                f.close()
+            writer.close()
+        return filesize - breakpoint
+
+    # 上传文件的方法，返回本次发送的字节数，dedup为True时先发送文件的哈希值，服务器已有相同内容时不发送数据
+    # 计算哈希值在线程池中进行，文件数据用loop.sendfile发送，支持时由内核直接从文件复制到socket
+    # passive为True时通过单独的数据连接发送，只在发送命令时占用控制连接
+    async def put(self, local_path, dedup=False, passive=False):
+        loop = asyncio.get_running_loop()
+        if dedup:
+            digest = await loop.run_in_executor(None, upload_store.file_digest, local_path)
+            command = f'put -h {digest.hexdigest()} {local_path}'
+        else:
+            command = 'put ' + local_path
+        if passive:
+            return await self.put_passive(data_channel.make_passive(command), local_path)
+        async with self.lock:
+            self.writer.write(command.encode())
+            await self.writer.drain()
+            response = (await self.reader.read(BUFFER_SIZE)).decode()
+            if dedup and response.startswith('EXISTS'):
+                return 0
+            if not response.startswith('OK'):
+                raise IOError(response)
+            filesize = os.path.getsize(local_path)
+            # 发送文件大小，以换行符结尾，再发送文件数据
+            self.writer.write((str(filesize) + '\n').encode())
+            with open(local_path, 'rb') as f:
+                await loop.sendfile(self.writer.transport, f, self.breakpoint)
+            await self.writer.drain()
+        return filesize - self.breakpoint
+
+    # 通过数据连接上传文件的方法，发送完毕后关闭发送方向，等服务器保存好文件并回复OK才返回
+    async def put_passive(self, command, local_path):
+        response = await self.send_command(command)
+        if response.startswith('EXISTS'):
+            self.breakpoint = 0
+            return 0
+        if not response.startswith('OK'):
+            raise IOError(response)
+        port, key, _ = data_channel.parse_put_reply(response)
+        breakpoint, self.breakpoint = self.breakpoint, 0
+        filesize = os.path.getsize(local_path)
+        reader, writer = await self.open_data_connection(port, key)
+        try:
+            writer.write((str(filesize) + '\n').encode())
+            with open(local_path, 'rb') as f:
+                await asyncio.get_running_loop().sendfile(writer.transport, f, breakpoint)
+            writer.write_eof()
+            # 等服务器保存好文件并回复OK，失败时抛出IOError
+            data_channel.check_upload_status(await reader.read())
+        finally:
+            writer.close()
+        return filesize - breakpoint
+
+    # 退出的方法，发送quit命令并关闭连接
+    async def quit(self):
+        try:
+            self.writer.write('quit'.encode())
+            await self.writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            self.writer.close()
+            try:
+                await self.writer.wait_closed()
+            except ConnectionError:
+                pass
+
+
+# 同时打开多个会话的函数，返回会话列表，concurrency限制同时进行中的连接数
+# 有一个会话连接失败时，关闭已经打开的会话，再抛出异常
+async def open_sessions(host, port, count, concurrency=CONNECT_CONCURRENCY, timeout=CONNECT_TIMEOUT):
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def open_one():
+        async with semaphore:
+            return await AsyncFTPSession.connect(host, port, timeout)
+    results = await asyncio.gather(*(open_one() for _ in range(count)), return_exceptions=True)
+    errors = [result for result in results if isinstance(result, BaseException)]
+    if errors:
+        for result in results:
+            if isinstance(result, AsyncFTPSession):
+                result.writer.close()
+        raise errors[0]
+    return results
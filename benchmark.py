@@ -0,0 +1,375 @@
+# benchmark.py
+# 这是一个负载测试和吞吐量基准测试脚本，在本机回环地址上启动FTP服务器，用N个无界面客户端执行混合的命令负载
+# 报告吞吐量、每个命令的p50/p99延迟、服务器的CPU时间和峰值内存，结果以JSON输出，可以和之前的结果比较
+# 用法：python benchmark.py --clients 8 --duration 10 --sizes 1K,64K,1M --output result.json --compare base.json
+# 加上--client-mode async时，所有客户端作为协程运行在一个事件循环中，可以模拟几百个并发会话
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from ftp_session import FTPSession
+from async_client import AsyncFTPSession
+
+# 尝试导入resource模块，用于统计子进程的CPU时间和峰值内存，Windows上没有这个模块
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# 定义一些常量
+HOST = '127.0.0.1' # 基准测试只在本机回环地址上进行
+USERNAME = 'bench' # 基准测试使用的用户名
+PASSWORD = 'bench' # 基准测试使用的密码
+DEFAULT_MIX = 'login:1,ls:4,cd:2,get:4,put:1' # 默认的命令混合比例
+
+
+# 把带单位的大小字符串转换为字节数的函数，例如64K、1M
+def parse_size(text):
+    text = text.strip().upper()
+    units = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}
+    if text and text[-1] in units:
+        return int(float(text[:-1]) * units[text[-1]])
+    return int(text)
+
+
+# 解析命令混合比例的函数，返回命令列表和对应的权重列表
+def parse_mix(text):
+    verbs, weights = [], []
+    for item in text.split(','):
+        verb, weight = item.split(':')
+        verbs.append(verb.strip())
+        weights.append(float(weight))
+    return verbs, weights
+
+
+# 计算百分位数的函数，使用最近秩法，values必须已经排好序
+def percentile(values, p):
+    if not values:
+        return 0
+    index = max(0, min(len(values) - 1, int(round(p / 100 * len(values) + 0.5)) - 1))
+    return values[index]
+
+
+# 生成测试文件集的函数，返回一个字典，键是相对于数据目录的子目录名（''表示数据目录本身），值是该目录下的文件名列表
+# 文件内容由随机种子决定，相同的参数总是生成相同的文件集
+def generate_files(data_dir, sizes, files_per_dir, dirs, seed):
+    rng = random.Random(seed)
+    manifest = {}
+    for d in [''] + [f'dir_{i}' for i in range(dirs)]:
+        path = os.path.join(data_dir, d)
+        os.makedirs(path, exist_ok=True)
+        manifest[d] = []
+        for i in range(files_per_dir):
+            size = sizes[i % len(sizes)]
+            name = f'file_{i}_{size}.bin'
+            with open(os.path.join(path, name), 'wb') as f:
+                f.write(rng.randbytes(size))
+            manifest[d].append(name)
+    return manifest
+
+
+# 定义一个服务器进程类，在子进程中运行FTP服务器，使CPU时间和内存的统计不受客户端线程影响
+class ServerProcess:
+
+    # 初始化方法，接受服务器引擎名、根目录、工作目录和多进程模式的工作进程数作为参数
+    def __init__(self, engine, root, workdir, workers=1):
+        command = [sys.executable, os.path.abspath(__file__), '--serve', root, '--workdir', workdir, '--engine', engine,
+                   '--workers', str(workers)]
+        self.process = subprocess.Popen(command, stdout=subprocess.PIPE, text=True)
+        # 子进程启动后在标准输出的第一行打印实际监听的端口号
+        self.port = int(self.process.stdout.readline().split()[1])
+
+    # 停止服务器并返回它消耗的CPU时间（秒）和峰值内存（KB）的方法
+    # 多进程模式下主进程会等待工作进程退出，CPU时间包括所有工作进程，峰值内存是其中最大的一个进程
+    def stop(self):
+        self.process.terminate()
+        self.process.wait()
+        if resource is None:
+            return None, None
+        usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+        # macOS上ru_maxrss的单位是字节，Linux上是KB
+        maxrss = usage.ru_maxrss // 1024 if sys.platform == 'darwin' else usage.ru_maxrss
+        return usage.ru_utime + usage.ru_stime, maxrss
+
+
+# 在当前进程中运行服务器的函数，由--serve参数触发，供ServerProcess调用
+# engine为prefork时启动多个工作进程，workers是工作进程数
+def serve(root, workdir, engine, workers):
+    import db_manager
+    import ftp_logger
+    import server
+    # 数据库文件放在工作目录中，不影响正式的用户数据
+    # 工作进程按server.DB_NAME设置数据库，两处都要修改
+    server.DB_NAME = db_manager.DB_NAME = os.path.join(workdir, 'bench_users.db')
+    # 日志写到标准错误，只记录警告以上的级别，避免日志本身影响测试结果
+    ftp_logger.setup(stream=sys.stderr, level='WARNING')
+    server.BASE_DIR = root
+    server.PORT = 0
+    if engine == 'prefork':
+        import prefork
+        supervisor = prefork.Supervisor(server.run_worker, workers, server.HOST, server.PORT, server.LISTEN_BACKLOG,
+                                        args=(server.current_settings(),))
+        # 所有工作进程都开始监听后再打印端口号
+        supervisor.start()
+        print('PORT', supervisor.port, flush=True)
+        supervisor.run()
+        return
+    ftp_server = server.FTPServer()
+    print('PORT', ftp_server.server_sock.getsockname()[1], flush=True)
+    ftp_server.start()
+
+
+# 定义一个客户端工作线程类，按混合比例循环执行命令并记录每个命令的延迟
+class Worker(threading.Thread):
+
+    # 初始化方法
+    def __init__(self, index, port, args, manifest, upload_files, deadline):
+        super().__init__(daemon=True)
+        self.index = index
+        self.port = port
+        self.args = args
+        self.manifest = manifest
+        self.upload_files = upload_files
+        self.deadline = deadline
+        # 每个客户端使用独立的随机数生成器，种子由全局种子和客户端编号决定，保证负载可以重现
+        self.rng = random.Random(args.seed * 1000 + index)
+        self.verbs, self.weights = parse_mix(args.mix)
+        # 用一个字典存储每个命令的延迟列表
+        self.latencies = {verb: [] for verb in self.verbs}
+        self.bytes = 0
+        self.errors = 0
+        # 增加一个属性，用于存储客户端当前所在的子目录，''表示数据目录
+        self.subdir = ''
+
+    # 执行一个命令的方法
+    def run_command(self, session, verb):
+        if verb == 'login':
+            session.login(USERNAME, PASSWORD)
+        elif verb == 'ls':
+            session.ls()
+        elif verb == 'cd':
+            # 在数据目录和它的子目录之间来回切换
+            if self.subdir:
+                session.cd('..')
+                self.subdir = ''
+            else:
+                self.subdir = self.rng.choice([d for d in self.manifest if d]) if len(self.manifest) > 1 else ''
+                if self.subdir:
+                    session.cd(self.subdir)
+        elif verb == 'get':
+            self.bytes += session.get(self.rng.choice(self.manifest[self.subdir]))
+        elif verb == 'put':
+            self.bytes += session.put(self.rng.choice(self.upload_files))
+
+    # 线程的主方法
+    def run(self):
+        session = FTPSession(HOST, self.port)
+        session.login(USERNAME, PASSWORD)
+        session.cd('data')
+        while time.perf_counter() < self.deadline:
+            verb = self.rng.choices(self.verbs, self.weights)[0]
+            start = time.perf_counter()
+            try:
+                self.run_command(session, verb)
+            # 命令失败时计数，并重新建立连接，让测试继续进行
+            except Exception:
+                self.errors += 1
+                session.sock.close()
+                session = FTPSession(HOST, self.port)
+                session.login(USERNAME, PASSWORD)
+                session.cd('data')
+                self.subdir = ''
+                continue
+            self.latencies[verb].append(time.perf_counter() - start)
+        session.quit()
+
+
+# 定义一个异步客户端类，和Worker执行相同的负载，但作为协程运行，不占用线程
+class AsyncWorker(Worker):
+
+    # 执行一个命令的方法
+    async def run_command(self, session, verb):
+        if verb == 'login':
+            await session.login(USERNAME, PASSWORD)
+        elif verb == 'ls':
+            await session.ls()
+        elif verb == 'cd':
+            # 在数据目录和它的子目录之间来回切换
+            if self.subdir:
+                await session.cd('..')
+                self.subdir = ''
+            else:
+                self.subdir = self.rng.choice([d for d in self.manifest if d]) if len(self.manifest) > 1 else ''
+                if self.subdir:
+                    await session.cd(self.subdir)
+        elif verb == 'get':
+            self.bytes += await session.get(self.rng.choice(self.manifest[self.subdir]))
+        elif verb == 'put':
+            self.bytes += await session.put(self.rng.choice(self.upload_files))
+
+    # 连接服务器并进入数据目录的方法
+    async def open_session(self):
+        session = await AsyncFTPSession.connect(HOST, self.port)
+        await session.login(USERNAME, PASSWORD)
+        await session.cd('data')
+        return session
+
+    # 协程的主方法，semaphore限制同时建立的连接数
+    async def run_async(self, semaphore):
+        async with semaphore:
+            session = await self.open_session()
+        while time.perf_counter() < self.deadline:
+            verb = self.rng.choices(self.verbs, self.weights)[0]
+            start = time.perf_counter()
+            try:
+                await self.run_command(session, verb)
+            # 命令失败时计数，并重新建立连接，让测试继续进行
+            except Exception:
+                self.errors += 1
+                session.writer.close()
+                async with semaphore:
+                    session = await self.open_session()
+                self.subdir = ''
+                continue
+            self.latencies[verb].append(time.perf_counter() - start)
+        await session.quit()
+
+
+# 在一个事件循环中运行所有异步客户端的函数
+async def run_async_workers(workers):
+    import async_client
+    semaphore = asyncio.Semaphore(async_client.CONNECT_CONCURRENCY)
+    await asyncio.gather(*(worker.run_async(semaphore) for worker in workers))
+
+
+# 运行一次基准测试的函数，返回结果字典
+def run_benchmark(args):
+    sizes = [parse_size(size) for size in args.sizes.split(',')]
+    workdir = tempfile.mkdtemp(prefix='ftp_bench_')
+    try:
+        root = os.path.join(workdir, 'root')
+        manifest = generate_files(os.path.join(root, 'data'), sizes, args.files, args.dirs, args.seed)
+        # 为每个客户端生成独立的上传文件，避免多个客户端同时写同一个文件
+        upload_dir = os.path.join(workdir, 'upload')
+        uploads = []
+        for i in range(args.clients):
+            uploads.append([])
+            for size in sizes:
+                path = os.path.join(upload_dir, f'client_{i}', f'upload_{i}_{size}.bin')
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                with open(path, 'wb') as f:
+                    f.write(random.Random(args.seed + size).randbytes(size))
+                uploads[i].append(path)
+        server_process = ServerProcess(args.engine, root, workdir, args.workers)
+        try:
+            # 先注册基准测试用户，用户已存在时注册失败也没有关系
+            session = FTPSession(HOST, server_process.port)
+            session.register(USERNAME, PASSWORD)
+            session.quit()
+            start = time.perf_counter()
+            deadline = start + args.duration
+            worker_class = AsyncWorker if args.client_mode == 'async' else Worker
+            workers = [worker_class(i, server_process.port, args, manifest, uploads[i], deadline) for i in range(args.clients)]
+            if args.client_mode == 'async':
+                asyncio.run(run_async_workers(workers))
+            else:
+                for worker in workers:
+                    worker.start()
+                for worker in workers:
+                    worker.join()
+            elapsed = time.perf_counter() - start
+        finally:
+            cpu, maxrss = server_process.stop()
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    # 汇总所有客户端的延迟
+    commands = {}
+    total_ops = 0
+    for verb in parse_mix(args.mix)[0]:
+        values = sorted(v for worker in workers for v in worker.latencies[verb])
+        total_ops += len(values)
+        commands[verb] = {
+            'count': len(values),
+            'ops_per_sec': round(len(values) / elapsed, 2),
+            'p50_ms': round(percentile(values, 50) * 1000, 3),
+            'p99_ms': round(percentile(values, 99) * 1000, 3),
+            'mean_ms': round(sum(values) / len(values) * 1000, 3) if values else 0,
+        }
+    total_bytes = sum(worker.bytes for worker in workers)
+    return {
+        'config': {
+            'engine': args.engine, 'workers': args.workers if args.engine == 'prefork' else 1, 'clients': args.clients,
+            'client_mode': args.client_mode, 'duration': args.duration,
+            'sizes': args.sizes, 'files': args.files, 'dirs': args.dirs, 'mix': args.mix, 'seed': args.seed,
+        },
+        'environment': {'python': platform.python_version(), 'platform': platform.platform(), 'cpus': os.cpu_count()},
+        'elapsed_sec': round(elapsed, 3),
+        'ops_per_sec': round(total_ops / elapsed, 2),
+        'bytes_per_sec': round(total_bytes / elapsed, 1),
+        'errors': sum(worker.errors for worker in workers),
+        'server_cpu_sec': round(cpu, 3) if cpu is not None else None,
+        'server_peak_rss_kb': maxrss,
+        'commands': commands,
+    }
+
+
+# 比较两次结果的函数，打印每个指标的变化百分比，延迟增加或吞吐量下降都是退化
+def compare(result, baseline):
+    def change(new, old):
+        return f'{(new - old) / old * 100:+.1f}%' if old else 'n/a'
+    print(f"{'指标':<24}{'基线':>14}{'本次':>14}{'变化':>10}")
+    for key in ('ops_per_sec', 'bytes_per_sec', 'server_cpu_sec', 'server_peak_rss_kb'):
+        old, new = baseline.get(key) or 0, result.get(key) or 0
+        print(f'{key:<24}{old:>14}{new:>14}{change(new, old):>10}')
+    for verb, data in result['commands'].items():
+        old_data = baseline.get('commands', {}).get(verb)
+        if not old_data:
+            continue
+        for key in ('ops_per_sec', 'p50_ms', 'p99_ms'):
+            name = f'{verb}.{key}'
+            print(f'{name:<24}{old_data[key]:>14}{data[key]:>14}{change(data[key], old_data[key]):>10}')
+
+
+# 解析命令行参数的函数
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='FTP服务器负载测试和吞吐量基准测试')
+    parser.add_argument('--clients', type=int, default=4, help='并发客户端数')
+    parser.add_argument('--client-mode', default='thread', choices=['thread', 'async'], help='客户端的运行方式，async时所有客户端在一个事件循环中运行')
+    parser.add_argument('--duration', type=float, default=10, help='测试时长（秒）')
+    parser.add_argument('--sizes', default='1K,64K,1M', help='测试文件的大小列表，用逗号分隔')
+    parser.add_argument('--files', type=int, default=20, help='每个目录中的文件数')
+    parser.add_argument('--dirs', type=int, default=4, help='数据目录下的子目录数')
+    parser.add_argument('--mix', default=DEFAULT_MIX, help='命令混合比例，格式为命令:权重，用逗号分隔')
+    parser.add_argument('--seed', type=int, default=1, help='随机种子，相同的种子生成相同的文件集和命令序列')
+    parser.add_argument('--engine', default='threaded', choices=['threaded', 'prefork'], help='服务器引擎')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='prefork引擎的工作进程数')
+    parser.add_argument('--output', help='把结果保存为JSON文件')
+    parser.add_argument('--compare', help='和之前保存的JSON结果比较')
+    # 以下参数供子进程内部使用
+    parser.add_argument('--serve', help=argparse.SUPPRESS)
+    parser.add_argument('--workdir', help=argparse.SUPPRESS)
+    return parser.parse_args(argv)
+
+
+# 主函数
+if __name__ == '__main__':
+    args = parse_args()
+    if args.serve:
+        serve(args.serve, args.workdir, args.engine, args.workers)
+        sys.exit()
+    result = run_benchmark(args)
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            compare(result, json.load(f))
@@ -0,0 +1,124 @@
+# binary_listing.py
+# 这是一个二进制目录列表编码模块，用于ls -b和lsv -b命令，每个条目带有类型、大小、修改时间和名称
+# 文本格式的列表用空格和换行符分隔字段，名称中含有换行符时无法解析，每次还要用split逐行拆分
+# 二进制格式由一个定长的头、当前目录、定长的条目记录和用\0分隔的名称组成，文件名中不可能出现\0
+# 解析时用struct.iter_unpack一次解出所有记录，用一次split拆出所有名称，不需要逐个字段处理
+# 客户端在命令中加上-b选项才会收到二进制格式，不加时服务器仍然返回原来的文本格式
+import os
+import stat
+import struct
+
+# 定义一些常量
+MAGIC = b'LSB1' # 二进制列表的标识
+HEADER = struct.Struct('!4sIII') # 头的格式：标识、头之后的字节数、条目数、当前目录的字节数
+RECORD = struct.Struct('!BQI') # 每个条目的记录格式：类型、大小、修改时间（整数秒），每条13字节
+SEPARATOR = '\0' # 分隔名称的字符
+FILE = 0 # 文件类型
+DIR = 1 # 目录类型
+DRIVE = 2 # 磁盘类型，Windows上的磁盘列表使用
+REMOVED = 0x80 # 类型的最高位，表示增量中被删除的条目
+BINARY_OPTION = '-b' # 请求二进制格式的命令选项
+
+
+# 读取一个目录的函数，返回一个列表，每个元素是(类型, 大小, 修改时间, 名称)，目录的大小为0，修改时间精确到秒
+# 使用os.scandir，每个条目只需要一次stat，比先isdir再getsize少一次系统调用
+def scan(path):
+    entries = []
+    with os.scandir(path) as it:
+        for entry in it:
+            try:
+                info = entry.stat()
+            # 失效的符号链接等无法stat的条目当作空文件
+            except OSError:
+                entries.append((FILE, 0, 0, entry.name))
+                continue
+            if stat.S_ISDIR(info.st_mode):
+                entries.append((DIR, 0, int(info.st_mtime), entry.name))
+            else:
+                entries.append((FILE, info.st_size, int(info.st_mtime), entry.name))
+    return entries
+
+
+# 编码列表的函数，entries是(类型, 大小, 修改时间, 名称)的列表，removed是增量中被删除的条目
+def encode(directory, entries, removed=()):
+    directory = directory.encode('utf-8', 'surrogateescape')
+    records = [RECORD.pack(kind, size, mtime) for kind, size, mtime, _ in entries]
+    records += [RECORD.pack(kind | REMOVED, size, mtime) for kind, size, mtime, _ in removed]
+    names = SEPARATOR.join([entry[3] for entry in entries] + [entry[3] for entry in removed]).encode('utf-8', 'surrogateescape')
+    body = b''.join([directory] + records + [names])
+    return HEADER.pack(MAGIC, len(body), len(records), len(directory)) + body
+
+
+# 解码列表的函数，data从头开始，返回当前目录、条目列表和被删除的条目列表
+def decode(data):
+    if not data.startswith(MAGIC) or not is_complete(data):
+        raise ValueError('不是完整的二进制列表')
+    _, length, count, directory_size = HEADER.unpack_from(data)
+    start = HEADER.size
+    directory = data[start:start + directory_size].decode('utf-8', 'replace')
+    start += directory_size
+    end = start + count * RECORD.size
+    names = data[end:HEADER.size + length].decode('utf-8', 'replace').split(SEPARATOR) if count else []
+    entries, removed = [], []
+    for (kind, size, mtime), name in zip(RECORD.iter_unpack(data[start:end]), names):
+        if kind & REMOVED:
+            removed.append((kind & ~REMOVED, size, mtime, name))
+        else:
+            entries.append((kind, size, mtime, name))
+    return directory, entries, removed
+
+
+# 从二进制响应中取出当前目录的函数，不解码条目，响应可以带有文本状态行，不是完整的二进制列表时返回None
+def response_directory(data):
+    offset = 0 if data.startswith(MAGIC) else data.find(b'\n') + 1
+    if not data.startswith(MAGIC, offset) or not is_complete(data, offset):
+        return None
+    _, _, _, directory_size = HEADER.unpack_from(data, offset)
+    start = offset + HEADER.size
+    return data[start:start + directory_size].decode('utf-8', 'replace')
+
+
+# 检查数据是否已经包含一个完整的二进制列表的函数，offset是列表开始的位置
+def is_complete(data, offset=0):
+    if len(data) < offset + HEADER.size:
+        return False
+    return len(data) >= offset + HEADER.size + HEADER.unpack_from(data, offset)[1]
+
+
+# 检查lsv -b命令的响应是否接收完整的函数，响应是一行文本状态加上一个二进制列表
+# 服务器不支持二进制格式时会返回文本，文本响应不会以二进制列表结尾，只要收到了错误信息就认为完整
+def is_response_complete(data):
+    if data.startswith(MAGIC):
+        return is_complete(data)
+    line_end = data.find(b'\n')
+    if line_end == -1:
+        return data.startswith(b'ERROR') or data.startswith('错误'.encode())
+    if data[line_end + 1:line_end + 1 + len(MAGIC)] != MAGIC[:len(data) - line_end - 1]:
+        return True
+    return is_complete(data, line_end + 1)
+
+
+# 判断一条命令是否请求二进制列表的函数
+def is_binary_command(command):
+    parts = command.split(' ')
+    return parts[0] in ('ls', 'lsv') and len(parts) > 1 and parts[1] == BINARY_OPTION
+
+
+# 把文本格式的一个条目转换为(类型, 大小, 修改时间, 名称)的函数，文本格式中没有修改时间，用0表示
+def parse_text_entry(line, directory=''):
+    if directory == '\\':
+        return (DRIVE, 0, 0, line)
+    if line.endswith('\\'):
+        return (DIR, 0, 0, line[:-1])
+    size, name = line.split(' ', 1)
+    return (FILE, int(size), 0, name)
+
+
+# 生成二进制响应的简短描述的函数，用于在控制台显示，不是二进制列表时（例如错误信息）返回解码后的文本
+def describe(data):
+    if response_directory(data) is None:
+        return data.decode('utf-8', 'replace')
+    line_end = data.find(b'\n') if not data.startswith(MAGIC) else -1
+    status = data[:line_end].decode() + ' ' if line_end != -1 else ''
+    directory, entries, removed = decode(data[line_end + 1:])
+    return f'{status}{directory}：{len(entries)}个条目' + (f'，删除{len(removed)}个条目' if removed else '') + f'（{len(data)}字节）'
@@ -5,9 +5,19 @@ import socket
 import os
 import sys
 import threading
-import time
 import select
 import queue
+import archive_stream
+import binary_listing
+import data_channel
+import net_utils
+import file_index
+import file_meta
+import listing_cache
+import pipeline
+import prefetcher
+import transfer_stats
+import upload_store
 # 从gui模块导入FTPClientGUI类
 from gui import FTPClientGUI
 
@@ -15,7 +25,13 @@ from gui import FTPClientGUI
 HOST = "127.0.0.1"  # FTP服务器的IP地址，可以修改为其他值
 PORT = 8888  # FTP服务器的端口号，可以修改为其他值
 BUFFER_SIZE = 1024  # 缓冲区大小，用于接收和发送数据
-COMMANDS = ["ls", "cd", "get", "put", "restart", 'login', 'register', "quit"]  # 支持的FTP命令
+PIPELINE_COMMANDS = ["ls", "lsv", "cd", "restart", "limit", "stat", "mstat", "find"]  # 多行命令全部是这些命令时，用流水线模式一次发送
+DEDUP_UPLOAD = True  # 上传前是否计算文件的哈希值，服务器已有相同内容时跳过传输
+PREFETCH = True  # 是否在后台预取子目录的列表，进入子目录时可以立即显示
+BINARY_LISTING = True  # 是否用二进制格式请求目录列表，条目带有修改时间，解析更快，服务器不支持时改为False
+PASSIVE_TRANSFER = True  # 是否用单独的数据连接传输文件，传输期间可以继续执行其他命令，服务器不支持时改为False
+DATA_BUFFER_SIZE = 64 * 1024  # 数据连接上读取和发送文件的块大小
+COMMANDS = ["ls", "lsv", "cd", "get", "put", "getdir", "putdir", "restart", 'login', 'register', 'resume', 'limit', 'profile', 'stat', 'mstat', 'find', 'noop', "quit"]  # 支持的FTP命令
 
 
 # 定义一个FTP客户端类
@@ -30,11 +46,20 @@ class FTPClient():
         # 增加一个属性，用于存储FTP服务器的端口号
         self.port = port
         # 创建一个socket对象，用于和FTP服务器通信
-        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        # 设置socket的超时时间为10秒，如果超过10秒没有收到服务器的响应，就认为连接断开
-        self.sock.settimeout(10)
+        self.sock = self.new_socket()
+        # 增加一个属性，用于存储登录后服务器下发的会话令牌，断线重连时凭它恢复会话
+        self.token = ""
+        # 创建一个目录列表缓存对象，按目录路径缓存最近使用的列表，断线重连后仍然有效
+        self.listing_cache = listing_cache.ListingCache()
+        # 创建一个集合，用于存储正在传输文件的数据连接，有数据连接时同样暂停预取
+        self.data_socks = set()
         # 创建一个锁对象，用于同步多个线程的访问
         self.lock = threading.Lock()
+        # 创建一个预取对象，收到目录列表后在后台获取子目录的列表，只在没有传输文件时进行
+        # 判断是否空闲的函数用到上面的锁和数据连接集合，所以在它们之后创建
+        self.prefetcher = prefetcher.Prefetcher(host, port, self.listing_cache, lambda: not self.lock.locked() and not self.data_socks, binary=BINARY_LISTING) if PREFETCH else None
+        # 创建一个传输统计对象，记录本次会话中每次传输的字节数、用时、吞吐量时间线和停顿，状态栏的吞吐量曲线从这里读取
+        self.stats = transfer_stats.TransferStats()
         # 创建一个GUI对象，用于创建和布局控件，以及处理一些界面相关的事件
         self.gui = FTPClientGUI()
         # 增加一个属性，用于标记是否已经断开连接
@@ -44,8 +69,18 @@ class FTPClient():
         # 调用初始化数据的方法
         self.init_data()
 
+    # 创建socket对象的方法
+    def new_socket(self):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        # 设置socket的超时时间为10秒，如果超过10秒没有收到服务器的响应，就认为连接断开
+        sock.settimeout(10)
+        # 开启TCP保活探测，服务器掉线后能及时发现
+        net_utils.enable_keepalive(sock)
+        return sock
+
     # 连接服务器的方法，返回一个布尔值，表示是否连接成功
-    def connect_server(self):
+    # resume为True且持有会话令牌时，连接后凭令牌恢复会话，否则发送ls命令获取文件列表
+    def connect_server(self, resume=False):
         # 尝试连接到FTP服务器
         try:
             self.sock.connect((self.host, self.port))
@@ -53,8 +88,11 @@ class FTPClient():
             msg = self.sock.recv(BUFFER_SIZE).decode()
             # 在控制台打印欢迎消息
             self.gui.write_output(f"<font color='black'>{msg}</font>")
-            # 发送一个ls命令，获取当前目录和文件列表
-            self.send_command("ls")
+            # 如果需要恢复会话，就发送一个resume命令，带上已下载到本地的字节数
+            if resume and self.token:
+                return self.send_command(f"resume {self.token} {self.received}")
+            # 发送一个lsv命令，获取当前目录和文件列表
+            self.send_command(self.lsv_command(listing_cache.NO_VERSION))
             # 返回True，表示连接成功
             return True
         # 如果发生异常，抛出异常
@@ -77,15 +115,27 @@ class FTPClient():
         self.download_filename = ''
         # 创建一个队列对象，用于存储主线程发送的文件名
         self.file_queue = queue.Queue()
+        # 创建一个队列对象，用于存储主线程发送的目录名
+        self.dir_queue = queue.Queue()
         # 创建一个队列对象，用于存储注册登录的执行结果
         self.result_queue = queue.Queue()
-        # 清空进度条
+        # 清空进度条，不再显示上一次传输的曲线，已经结束的传输记录仍然保留在统计中
+        self.stats.current = None
         self.gui.progress_bar.setValue(0)
 
     # 发送命令的方法
     def send_command(self, command):
         # 尝试发送命令到服务器
         try:
+            # 如果是put命令并且开启了上传去重，就先计算文件的哈希值，加到命令中
+            # 大文件的哈希值要计算几秒甚至更久，所以在子线程中计算，算好后回到主线程发送带哈希值的命令，界面不会卡住
+            if DEDUP_UPLOAD and command.startswith("put ") and not command.startswith("put -h ") and os.path.isfile(command[4:]):
+                self.gui.write_output(f"<font color='blue'>正在计算哈希值：{command[4:]}</font>")
+                threading.Thread(target=self.digest_and_put, args=(command[4:],), daemon=True).start()
+                return
+            # 如果开启了数据连接传输，就给get和put命令加上-p选项，文件数据走单独的数据连接，不占用控制连接
+            if PASSIVE_TRANSFER and command.split(" ")[0] in ("get", "put") and " " in command:
+                command = data_channel.make_passive(command)
             # 把命令的内容拼接成一个字符串，用HTML标签设置字体颜色为蓝色
             text = f"<font color='blue'>发送命令：{command}</font>"
             # 调用GUI类的write_output方法，把字符串传递给它
@@ -108,6 +158,26 @@ class FTPClient():
                 else:
                     # 如果数据为空，说明接收完毕，跳出循环
                     break
+            # 二进制列表可能比一次收到的数据长，要一直接收到列表完整为止，不解码为字符串
+            if binary_listing.is_binary_command(command):
+                while not binary_listing.is_response_complete(response):
+                    data = self.sock.recv(BUFFER_SIZE)
+                    if not data:
+                        break
+                    response += data
+                self.gui.write_output(f"<font color='green'>接收响应：</font><pre>{binary_listing.describe(response)}</pre>")
+                if command.startswith("lsv"):
+                    self.update_listing(response)
+                else:
+                    self.update_binary_listing(response)
+                return
+            # find命令的结果是分批发送的，要一直接收到结束标记
+            if command.startswith("find"):
+                while not file_index.is_complete(response):
+                    data = self.sock.recv(BUFFER_SIZE)
+                    if not data:
+                        break
+                    response += data
             # 把响应解码为字符串
             response = response.decode()
             # 把响应的内容拼接成一个字符串，用HTML标签设置字体颜色为绿色
@@ -119,9 +189,22 @@ class FTPClient():
             if command == "ls":
                 # 如果是ls命令，就更新当前目录和文件列表
                 self.update_dir_and_file(response)
+            elif command.startswith("lsv"):
+                # 如果是lsv命令，就按响应更新缓存，列表有变化时更新当前目录和文件列表
+                self.update_listing(response)
             elif command.startswith("cd"):
                 # 如果是cd命令，就更新当前目录
                 self.update_dir(response)
+            elif data_channel.is_passive_command(command):
+                # 如果是get -p或put -p命令，就创建一个子线程，通过数据连接传输文件，控制连接可以继续执行其他命令
+                target = self.receive_file_passive if command.startswith("get") else self.send_file_passive
+                threading.Thread(target=target, args=(response,), daemon=True).start()
+            elif command.startswith("getdir"):
+                # 如果是getdir命令，就创建一个子线程，边接收归档流边解包到本地目录
+                threading.Thread(target=self.receive_dir, args=(response,)).start()
+            elif command.startswith("putdir"):
+                # 如果是putdir命令，就创建一个子线程，把本地目录打包成归档流发送，-z选项表示压缩
+                threading.Thread(target=self.send_dir, args=(response, command.startswith("putdir -z "))).start()
             elif command.startswith("get"):
                 # 如果是get命令，就创建一个子线程，把接收文件的方法作为目标函数，把服务器的响应作为参数
                 threading.Thread(target=self.receive_file, args=(response,)).start()
@@ -131,25 +214,115 @@ class FTPClient():
             elif command.startswith('restart'):
                 # 如果是restart命令，就设置断点
                 self.restart(response)
+            elif command.startswith('resume'):
+                # 如果是resume命令，就恢复会话，返回一个布尔值，表示是否恢复成功
+                return self.resume(response)
+            elif command.startswith('stat') or command.startswith('mstat'):
+                # 如果是stat或mstat命令，就返回解析后的元数据列表，失败时返回空列表
+                return file_meta.parse_response(response) if response.startswith('OK') else []
             # 如果是login或register命令，表示是登录或注册请求
             elif command.startswith('login') or command.startswith('register'):
+                # 登录成功时，响应的第三部分是会话令牌
+                if command.startswith('login') and response.startswith('OK') and len(response.split(' ')) > 2:
+                    self.token = response.split(' ')[2]
+                # 登录成功后，预取的连接也用同样的用户名和密码登录，需要登录才能访问的服务器不会拒绝预取
+                if command.startswith('login') and response.startswith('OK') and self.prefetcher and len(command.split(' ')) > 2:
+                    self.prefetcher.login(command.split(' ')[1], command.split(' ')[2])
                 # 返回一个布尔值，表示服务器的响应是否以OK开头，OK表示成功，ERROR表示失败
                 return response.startswith('OK')
             elif command == "quit":
-                # 如果是quit命令，就关闭socket，退出程序
+                # 如果是quit命令，就关闭socket和预取的连接，退出程序
                 self.sock.close()
+                if self.prefetcher:
+                    self.prefetcher.close()
                 sys.exit()
         # 如果发生异常，弹出错误提示框
         except Exception as e:
             self.gui.show_error(str(e))
 
+    # 在子线程中计算上传文件的哈希值的方法，算好后通过信号让主线程发送put -h命令
+    def digest_and_put(self, filename):
+        try:
+            digest = upload_store.file_digest(filename).hexdigest()
+        except OSError as e:
+            self.gui.error_signal.emit(str(e))
+            self.gui.result.emit(False)
+            return
+        self.gui.command_signal.emit(f"put -h {digest} {filename}")
+
+    # 判断多条命令能否用流水线模式发送的方法，只有多条命令并且都是不带文件数据的命令时才可以
+    # mstat命令的路径很多时会超过服务器一次接收的缓冲区，只有一条时也用流水线模式发送，服务器会一直接收到换行符为止
+    def can_pipeline(self, commands):
+        if len(commands) == 1:
+            return commands[0].startswith("mstat ")
+        return all(command.split(" ")[0] in PIPELINE_COMMANDS for command in commands)
+
+    # 用流水线模式发送多条命令的方法，一次发送所有命令，不等待每条命令的响应，适合网络延迟高的情况
+    # 和逐条发送不同，前面的命令失败时，后面的命令仍然会执行
+    def send_pipeline(self, commands):
+        try:
+            for command in commands:
+                self.gui.write_output(f"<font color='blue'>发送命令：{command}</font>")
+            ids, data = pipeline.encode_requests(commands)
+            self.sock.sendall(data)
+            responses = pipeline.read_responses(self.sock, len(commands))
+            # 按命令的顺序处理响应
+            for command, request_id in zip(commands, ids):
+                response = responses[request_id]
+                # 二进制列表的响应不解码为字符串，控制台只显示简短的描述
+                if binary_listing.is_binary_command(command):
+                    self.gui.write_output(f"<font color='green'>接收响应：</font><pre>{binary_listing.describe(response)}</pre>")
+                    if command.startswith("lsv"):
+                        self.update_listing(response, emit=False)
+                    else:
+                        self.update_binary_listing(response, emit=False)
+                    continue
+                response = response.decode()
+                self.gui.write_output(f"<font color='green'>接收响应：</font><pre>{response}</pre>")
+                if command == "ls":
+                    self.gui.update_dir_and_file(response)
+                elif command.startswith("lsv"):
+                    self.update_listing(response, emit=False)
+                elif command.startswith("cd") and response.startswith("OK"):
+                    self.current_dir = response.split(" ", 1)[1]
+                    self.gui.dir_edit.setText(self.current_dir)
+                elif command.startswith("restart") and response.isdigit():
+                    self.breakpoint = int(response)
+        # 如果发生异常，弹出错误提示框
+        except Exception as e:
+            self.gui.show_error(str(e))
+
     # 更新当前目录和文件列表的方法
     def update_dir_and_file(self, response):
         # 调用GUI类的update_dir_and_file方法
         self.gui.update_dir_and_file(response)
+        # 在后台预取子目录的列表
+        directory, _, lines = response.partition("\n")
+        self.prefetch(directory, [binary_listing.parse_text_entry(line, directory) for line in lines.split("\n") if line])
         # 调用GUI对象的result信号对象的emit方法，传递一个True值，表示当前命令执行成功
         self.gui.result.emit(True)
 
+    # 处理ls -b命令的响应的方法，emit为False时不发送命令执行结果的信号，用于流水线模式
+    def update_binary_listing(self, response, emit=True):
+        try:
+            directory, entries, _ = binary_listing.decode(response)
+        # 不是二进制列表，说明服务器返回了错误信息
+        except ValueError:
+            self.gui.show_error(response.decode("utf-8", "replace"))
+            if emit:
+                self.gui.result.emit(False)
+            return
+        self.gui.show_entries(directory, entries)
+        self.prefetch(directory, entries)
+        if emit:
+            self.gui.result.emit(True)
+
+    # 生成lsv命令的方法，version是缓存的版本号，BINARY_LISTING为True时请求二进制格式
+    def lsv_command(self, version):
+        if BINARY_LISTING:
+            return f"lsv {binary_listing.BINARY_OPTION} {version}"
+        return "lsv " + version
+
     # 更新当前目录的方法
     def update_dir(self, response):
         # 如果响应以OK开头，说明切换目录成功
@@ -158,8 +331,8 @@ class FTPClient():
             self.current_dir = response.split(" ", 1)[1]
             # 把当前目录显示在文本框中
             self.gui.dir_edit.setText(self.current_dir)
-            # 发送一个ls命令，更新文件列表
-            self.send_command("ls")
+            # 刷新文件列表，缓存中有这个目录的列表时先显示缓存，再确认是否有变化
+            self.refresh_listing()
             # 调用GUI对象的result信号对象的emit方法，传递一个True值，表示当前命令执行成功
             self.gui.result.emit(True)
         # 否则，说明切换目录失败，弹出错误提示框
@@ -168,6 +341,40 @@ class FTPClient():
             # 调用GUI对象的result信号对象的emit方法，传递一个False值，表示当前命令执行失败
             self.gui.result.emit(False)
 
+    # 刷新文件列表的方法，缓存中有当前目录的列表时立即显示，再带上缓存的版本号发送lsv命令
+    # 列表没有变化时服务器只回复NOTMODIFIED，来回切换目录几乎不占用带宽
+    def refresh_listing(self):
+        cached = self.listing_cache.get(self.current_dir)
+        if cached is not None:
+            self.gui.show_entries(self.current_dir, cached)
+        self.send_command(self.lsv_command(self.listing_cache.version(self.current_dir)))
+
+    # 处理lsv或lsv -b命令的响应的方法，emit为False时不发送命令执行结果的信号，用于流水线模式
+    def update_listing(self, response, emit=True):
+        try:
+            directory, entries, changed = self.listing_cache.apply(response)
+        # 响应和缓存对不上时，说明缓存已被淘汰或者响应有错误，不带版本号重新请求完整的列表
+        except ValueError:
+            if isinstance(response, bytes):
+                response = response.decode("utf-8", "replace")
+            if response.startswith(("NOTMODIFIED", "DELTA")):
+                self.send_command(self.lsv_command(listing_cache.NO_VERSION))
+            else:
+                self.gui.show_error(response)
+                if emit:
+                    self.gui.result.emit(False)
+            return
+        if changed:
+            self.gui.show_entries(directory, entries)
+        self.prefetch(directory, entries)
+        if emit:
+            self.gui.result.emit(True)
+
+    # 预取子目录列表的方法，entries是(类型, 大小, 修改时间, 名称)的列表
+    def prefetch(self, directory, entries):
+        if self.prefetcher:
+            self.prefetcher.schedule(directory, entries)
+
     # 处理restart命令的方法
     def restart(self, response):
         # 把响应转换为整数，并赋值给断点的位置
@@ -177,6 +384,20 @@ class FTPClient():
         # 调用GUI对象的result信号对象的emit方法，传递一个True值，表示当前命令执行成功
         self.gui.result.emit(True)
 
+    # 处理resume命令的方法，返回一个布尔值，表示会话是否恢复成功
+    def resume(self, response):
+        # 如果响应以OK开头，说明会话恢复成功，响应的第二部分是断点，第三部分是当前目录
+        if response.startswith("OK"):
+            _, breakpoint, self.current_dir = response.split(" ", 2)
+            # 服务器已经按会话设置好断点，客户端只需同步，不需要再发送restart命令
+            self.breakpoint = int(breakpoint)
+            self.gui.dir_edit.setText(self.current_dir)
+            self.gui.write_output(f"<font color='black'>会话恢复成功，断点：{self.breakpoint}</font>")
+            return True
+        # 否则，说明会话已失效，清除令牌
+        self.token = ""
+        return False
+
     # 切换目录的槽函数
     def change_dir(self):
         # 获取文本框中输入的目录
@@ -238,42 +459,23 @@ class FTPClient():
                     # 在开始下载前，把除connect_button外的所有控件设置为不可用
                     self.gui.set_enabled(False)
                     self.gui.connect_button.setEnabled(True)
-                    # 记录开始下载的时间
-                    start_time = time.time()
-                    # 记录开始下载的断点
-                    start_breakpoint = self.breakpoint
-                    # 以追加模式或写入模式打开文件
-                    with open(self.download_filename, 'ab' if self.breakpoint != 0 else 'wb') as f:
+                    # 开始一条传输记录，从断点处开始统计本次下载的数据量
+                    record = self.stats.start('get', self.filename, self.filesize, self.breakpoint)
+                    # 打开文件，续传时从断点处写入
+                    with net_utils.open_download(self.download_filename, self.breakpoint) as f:
                         # 从断点处开始累加已接收的字节数
                         self.received = self.breakpoint
-                        # 循环接收数据，直到文件接收完毕
-                        while self.received < self.filesize:
-                            # 接收数据
-                            data = self.sock.recv(BUFFER_SIZE)
-                            # 写入数据
-                            f.write(data)
-                            # 累加已接收的字节数
-                            self.received += len(data)
-                            # 计算传输进度百分比
-                            percent = int(self.received / self.filesize * 100)
-                            # 发送进度信号，更新进度条的值
-                            self.gui.progress_signal.emit(percent)
-                    # 记录结束下载的时间
-                    end_time = time.time()
-                    # 记录结束下载的断点
+                        # 每次接收后累加已接收的字节数，并更新传输记录，状态栏的吞吐量曲线会定时读取它
+                        def on_chunk(n):
+                            self.received += n
+                            record.add(n)
+                        # 用接收缓冲区接收数据，直到文件接收完毕
+                        net_utils.recv_buffer().recv_into_file(self.sock, f, self.filesize - self.received, self.received, on_chunk)
                     self.gui.output_signal.emit(self.received)
-                    end_breakpoint = self.received
-                    # 计算下载用时
-                    duration = end_time - start_time
-                    # 如果下载用时小于0.01秒，就把它设为0.01秒
-                    if duration < 0.01:
-                        duration = 0.01
-                    # 计算下载数据量
-                    received = end_breakpoint - start_breakpoint
-                    # 在控制台打印下载完成的消息，包括下载用时、下载数据量和下载速度
+                    # 结束传输记录，在控制台打印下载完成的消息和传输结果
+                    self.stats.finish(record, True)
                     self.gui.output_signal.emit(f"<font color='purple'>下载完成：{self.filename}</font>")
-                    self.gui.output_signal.emit(f"<font color='purple'>在{duration:.2f}秒内下载了{self.format_size(received)}数据</font>")
-                    self.gui.output_signal.emit(f"<font color='purple'>下载速度：{received / duration / 1024:.2f}KB/s</font>")
+                    self.report_transfer(record)
                     # 清除下载文件信息
                     self.filename = ''
                     self.download_filename = ''
@@ -293,41 +495,22 @@ class FTPClient():
                     self.gui.server_info_signal.emit('已断开连接，点击右下角按钮重连')
                     # 在控制台打印下载异常的内容
                     self.gui.output_signal.emit(f"<font color='red' face='bold'>下载异常：{e}</font>")
-                    # 记录结束下载的时间
-                    end_time = time.time()
-                    # 记录结束下载的断点
-                    end_breakpoint = self.received
-                    # 计算下载用时
-                    duration = end_time - start_time
-                    # 如果下载用时小于0.01秒，就把它设为0.01秒
-                    if duration < 0.01:
-                        duration = 0.01
-                    # 计算下载数据量
-                    received = end_breakpoint - start_breakpoint
-                    # 在控制台打印下载异常的消息，包括下载用时、下载数据量和下载速度
-                    self.gui.output_signal.emit(f"<font color='purple'>在{duration:.2f}秒内下载了{self.format_size(received)}数据</font>")
-                    self.gui.output_signal.emit(f"<font color='purple'>下载速度：{received / duration / 1024:.2f}KB/s</font>")
+                    # 结束传输记录，在控制台打印中断前的传输结果
+                    self.stats.finish(record, False, e)
+                    self.report_transfer(record)
                     # 调用GUI对象的result信号对象的emit方法，传递一个False值，表示当前命令执行失败
                     self.gui.result.emit(False)
                 # 在结束下载后，把所有控件恢复为可用
                 self.gui.set_enabled(True)
             # 否则，如果文件名为空，就丢弃服务器发送的文件内容
             else:
-                self.gui.write_output("<font color='black'>正在清空缓冲区...</font>")
+                self.gui.write_output("<font color='black'>正在中止下载并清空缓冲区...</font>")
                 # 在清空缓冲区前，把所有控件设置为不可用
                 self.gui.set_enabled(False)
-                # 循环接收数据，直到文件接收完毕
-                while self.received < self.filesize:
-                    # 接收数据
-                    data = self.sock.recv(BUFFER_SIZE)
-                    # 累加已接收的字节数
-                    self.received += len(data)
-                    # 计算清空进度百分比
-                    percent = int(self.received / self.filesize * 100)
-                    # 在GUI对象中，发射信号对象，并传递清空进度的百分比
-                    self.gui.clear_signal.emit(percent)
-                    # 输出清空进度，使用\r回到行首，覆盖之前的输出
-                    # print(f'\r清空进度：{percent}%', end='')
+                # 服务器从断点处开始发送，已接收的字节数也从断点处开始累加
+                self.received = self.breakpoint
+                # 请求服务器中止发送，只接收并丢弃已经在途中的数据
+                self.discard_download()
                 # 在控制台打印取消下载的消息
                 self.gui.write_output(f"<font color='red'>取消下载：{self.filename}</font>")
                 # 清除下载文件信息
@@ -351,19 +534,181 @@ class FTPClient():
         # 释放锁，让其他线程可以访问
         self.lock.release()
 
+    # 通过数据连接接收文件的方法，在子线程中执行，不使用控制连接，也不禁用界面，传输期间可以继续执行其他命令和开始其他传输
+    def receive_file_passive(self, response):
+        # 如果响应不以OK开头，说明文件不存在，弹出错误提示框
+        if not response.startswith("OK"):
+            self.gui.error_signal.emit(response)
+            self.gui.result.emit(False)
+            return
+        filesize, port, key, filename = data_channel.parse_get_reply(response)
+        # 服务器已经把断点交给这次传输并清零，客户端也同步清零
+        breakpoint, self.breakpoint = self.breakpoint, 0
+        # 取出下载位置，没有指定时弹出文件对话框，从队列中取出用户选择的文件名
+        download_filename, self.download_filename = self.download_filename, ''
+        if not download_filename:
+            self.gui.file_dialog_signal.emit(filename)
+            download_filename = self.file_queue.get()
+        try:
+            data_sock = data_channel.connect(self.host, port, key)
+        except OSError as e:
+            self.gui.output_signal.emit(f"<font color='red' face='bold'>连接数据端口失败：{e}</font>")
+            self.gui.result.emit(False)
+            return
+        # 命令已经处理完，界面可以继续执行下一条命令
+        self.gui.result.emit(True)
+        # 如果用户取消了下载，就直接关闭数据连接，服务器发送失败后停止，不需要接收剩余的数据
+        if not download_filename:
+            data_sock.close()
+            self.gui.output_signal.emit(f"<font color='red'>取消下载：{filename}</font>")
+            return
+        self.data_socks.add(data_sock)
+        # 开始一条传输记录，从断点处开始统计本次下载的数据量
+        record = self.stats.start('get', filename, filesize, breakpoint)
+        received = breakpoint
+        try:
+            with data_sock, net_utils.open_download(download_filename, breakpoint) as f:
+                # 每次接收后累加已接收的字节数，并更新传输记录
+                def on_chunk(n):
+                    nonlocal received
+                    received += n
+                    record.add(n)
+                net_utils.recv_buffer().recv_into_file(data_sock, f, filesize - breakpoint, breakpoint, on_chunk)
+            self.stats.finish(record, True)
+            self.gui.output_signal.emit(f"<font color='purple'>下载完成：{filename}</font>")
+            self.report_transfer(record)
+        # 数据连接断开不影响控制连接，提示用户可以从已接收的位置续传
+        except Exception as e:
+            self.gui.output_signal.emit(f"<font color='red' face='bold'>下载异常：{e}</font>")
+            self.stats.finish(record, False, e)
+            self.report_transfer(record)
+            self.gui.output_signal.emit(f"<font color='black'>已接收{received}字节，可以用restart {received}命令设置断点后重新下载</font>")
+        finally:
+            self.data_socks.discard(data_sock)
+
+    # 通过数据连接发送文件的方法，在子线程中执行，不使用控制连接，也不禁用界面
+    def send_file_passive(self, response):
+        # 如果响应以EXISTS开头，说明服务器已有相同内容的文件，不需要发送数据，服务器已经把断点清零
+        if response.startswith("EXISTS"):
+            self.breakpoint = 0
+            self.gui.output_signal.emit(f"<font color='purple'>秒传完成：{response.split(' ', 1)[1]}</font>")
+            self.gui.result.emit(True)
+            return
+        if not response.startswith("OK"):
+            self.gui.error_signal.emit(response)
+            self.gui.result.emit(False)
+            return
+        port, key, filename = data_channel.parse_put_reply(response)
+        # 服务器已经把断点交给这次传输并清零，客户端也同步清零
+        breakpoint, self.breakpoint = self.breakpoint, 0
+        try:
+            filesize = os.path.getsize(filename)
+            data_sock = data_channel.connect(self.host, port, key)
+        except OSError as e:
+            self.gui.output_signal.emit(f"<font color='red' face='bold'>连接数据端口失败：{e}</font>")
+            self.gui.result.emit(False)
+            return
+        # 命令已经处理完，界面可以继续执行下一条命令
+        self.gui.result.emit(True)
+        self.data_socks.add(data_sock)
+        # 开始一条传输记录，从断点处开始统计本次上传的数据量
+        record = self.stats.start('put', filename, filesize, breakpoint)
+        sent = breakpoint
+        try:
+            with data_sock, open(filename, 'rb') as f:
+                # 先发送文件大小，以换行符结尾，再从断点处开始发送文件数据
+                data_sock.sendall((str(filesize) + "\n").encode())
+                f.seek(breakpoint)
+                while sent < filesize:
+                    data = f.read(DATA_BUFFER_SIZE)
+                    if not data:
+                        break
+                    data_sock.sendall(data)
+                    sent += len(data)
+                    record.add(len(data))
+                # 发送完毕后关闭发送方向，等服务器保存好文件并回复OK，才算上传完成
+                data_sock.shutdown(socket.SHUT_WR)
+                data_channel.read_upload_status(data_sock)
+            self.stats.finish(record, True)
+            self.gui.output_signal.emit(f"<font color='purple'>上传完成：{filename}</font>")
+            self.report_transfer(record)
+        except Exception as e:
+            self.gui.output_signal.emit(f"<font color='red' face='bold'>上传异常：{e}</font>")
+            self.stats.finish(record, False, e)
+            self.report_transfer(record)
+            self.gui.output_signal.emit(f"<font color='black'>已发送{sent}字节，可以用restart命令设置断点后重新上传</font>")
+        finally:
+            self.data_socks.discard(data_sock)
+
+    # 请求服务器中止当前下载的方法，用一个新连接发送abort命令，返回这个连接，不能中止时返回None
+    # 原来的连接上正在接收文件数据，不能用来发送命令；没有登录时没有会话令牌，服务器无法找到要中止的下载
+    def request_abort(self):
+        if not self.token:
+            return None
+        try:
+            sock = socket.create_connection((self.host, self.port), 10)
+        except OSError:
+            return None
+        try:
+            # 接收服务器的欢迎消息，再发送abort命令
+            sock.recv(BUFFER_SIZE)
+            sock.send(f"abort {self.token}".encode())
+            return sock
+        except OSError:
+            sock.close()
+            return None
+
+    # 取消下载时丢弃服务器发送的数据的方法
+    # 等待中止的回复期间要继续接收数据，否则服务器可能阻塞在发送上，看不到中止请求
+    # 收到回复后只接收到服务器停下来的位置；不能中止时和原来一样接收并丢弃文件剩余的全部数据
+    def discard_download(self):
+        abort_sock = self.request_abort()
+        end = self.filesize
+        try:
+            while self.received < end:
+                readable, _, _ = select.select([self.sock, abort_sock] if abort_sock else [self.sock], [], [], 10)
+                if not readable:
+                    raise TimeoutError('接收数据超时')
+                # 收到中止的回复，以服务器停下来的位置作为终点
+                if abort_sock in readable:
+                    response = abort_sock.recv(BUFFER_SIZE).decode()
+                    abort_sock.close()
+                    abort_sock = None
+                    if response.startswith("OK"):
+                        end = int(response.split(" ")[1])
+                    continue
+                data = self.sock.recv(min(BUFFER_SIZE, end - self.received))
+                if not data:
+                    raise ConnectionError('服务器断开连接')
+                # 累加已接收的字节数
+                self.received += len(data)
+                # 在GUI对象中，发射信号对象，并传递清空进度的百分比
+                self.gui.clear_signal.emit(int(self.received / end * 100))
+        finally:
+            if abort_sock:
+                abort_sock.close()
+        # 服务器提前停下来时，在控制台打印少传输的数据量
+        if end < self.filesize:
+            self.gui.write_output(f"<font color='black'>服务器已中止发送，跳过了{self.format_size(self.filesize - end)}数据</font>")
+
     # 发送文件的方法
     def send_file(self, response):
         # 获取锁，防止多个线程同时访问
         self.lock.acquire()
+        # 如果响应以EXISTS开头，说明服务器已有相同内容的文件，不需要发送数据
+        if response.startswith("EXISTS"):
+            self.gui.output_signal.emit(f"<font color='purple'>秒传完成：{response.split(' ', 1)[1]}</font>")
+            self.clear_breakpoint()
+            self.gui.result.emit(True)
         # 如果响应以OK开头，说明文件可以上传
-        if response.startswith("OK"):
+        elif response.startswith("OK"):
             # 把响应分割为两部分，第一部分是OK，第二部分是文件名
             _, self.filename = response.split(" ", 1)
             # 获取文件的大小
             self.filesize = os.path.getsize(self.filename)
             self.gui.output_signal.emit(self.filesize)
-            # 发送文件大小
-            self.sock.send(str(self.filesize).encode())
+            # 发送文件大小，以换行符结尾，让服务器能把它和紧跟着的文件数据分开
+            self.sock.send((str(self.filesize) + "\n").encode())
             # 初始化已发送的字节数为0
             self.sent = 0
             # 打开文件，准备读取数据
@@ -373,10 +718,8 @@ class FTPClient():
                     # 在开始上传前，把除connect_button外的所有控件设置为不可用
                     self.gui.set_enabled(False)
                     self.gui.connect_button.setEnabled(True)
-                    # 记录开始上传的时间
-                    start_time = time.time()
-                    # 记录开始上传的断点
-                    start_breakpoint = self.breakpoint
+                    # 开始一条传输记录，从断点处开始统计本次上传的数据量
+                    record = self.stats.start('put', self.filename, self.filesize, self.breakpoint)
                     # 如果断点不为0，就从断点处开始读取数据
                     if self.breakpoint != 0:
                         # 移动文件指针到断点处
@@ -389,27 +732,13 @@ class FTPClient():
                         data = f.read(BUFFER_SIZE)
                         # 发送数据
                         self.sock.send(data)
-                        # 累加已发送的字节数
+                        # 累加已发送的字节数，并更新传输记录，状态栏的吞吐量曲线会定时读取它
                         self.sent += len(data)
-                        # 计算传输进度百分比
-                        percent = int(self.sent / self.filesize * 100)
-                        # 发送进度信号，更新进度条的值
-                        self.gui.progress_signal.emit(percent)
-                    # 记录结束上传的时间
-                    end_time = time.time()
-                    # 记录结束上传的断点
-                    end_breakpoint = self.sent
-                    # 计算上传用时
-                    duration = end_time - start_time
-                    # 如果上传用时小于0.01秒，就把它设为0.01秒
-                    if duration < 0.01:
-                        duration = 0.01
-                    # 计算上传数据量
-                    sent = end_breakpoint - start_breakpoint
-                    # 在控制台打印上传完成的消息，包括上传用时、上传数据量和上传速度
+                        record.add(len(data))
+                    # 结束传输记录，在控制台打印上传完成的消息和传输结果
+                    self.stats.finish(record, True)
                     self.gui.output_signal.emit(f"<font color='purple'>上传完成：{self.filename}</font>")
-                    self.gui.output_signal.emit(f"<font color='purple'>在{duration:.2f}秒内上传了{self.format_size(sent)}数据</font>")
-                    self.gui.output_signal.emit(f"<font color='purple'>上传速度：{sent / duration / 1024:.2f}KB/s</font>")
+                    self.report_transfer(record)
                     # 清除上传文件信息
                     self.filename = ''
                     self.filesize = 0
@@ -428,20 +757,9 @@ class FTPClient():
                     self.gui.server_info_signal.emit('已断开连接，点击右下角按钮重连')
                     # 在控制台打印上传异常的内容
                     self.gui.output_signal.emit(f"<font color='red' face='bold'>上传异常：{e}</font>")
-                    # 记录结束上传的时间
-                    end_time = time.time()
-                    # 记录结束上传的断点
-                    end_breakpoint = self.sent
-                    # 计算上传用时
-                    duration = end_time - start_time
-                    # 如果上传用时小于0.01秒，就把它设为0.01秒
-                    if duration < 0.01:
-                        duration = 0.01
-                    # 计算上传数据量
-                    sent = end_breakpoint - start_breakpoint
-                    # 在控制台打印上传异常的消息，包括上传用时、上传数据量和上传速度
-                    self.gui.output_signal.emit(f"<font color='purple'>在{duration:.2f}秒内上传了{self.format_size(sent)}数据</font>")
-                    self.gui.output_signal.emit(f"<font color='purple'>上传速度：{sent / duration / 1024:.2f}KB/s</font>")
+                    # 结束传输记录，在控制台打印中断前的传输结果
+                    self.stats.finish(record, False, e)
+                    self.report_transfer(record)
                     # 调用GUI对象的result信号对象的emit方法，传递一个False值，表示当前命令执行失败
                     self.gui.result.emit(False)
                 # 在结束上传后，把所有控件恢复为可用
@@ -454,6 +772,96 @@ class FTPClient():
         # 释放锁，让其他线程可以访问
         self.lock.release()
 
+    # 接收目录的方法，服务器把目录打包成归档流发送过来，边接收边解包
+    def receive_dir(self, response):
+        # 获取锁，防止多个线程同时访问
+        self.lock.acquire()
+        # 如果响应以OK开头，说明目录存在，可以下载
+        if response.startswith("OK"):
+            # 把响应分割为三部分，第一部分是OK，第二部分是目录中文件的总大小，第三部分是目录名
+            _, total, dirname = response.split(" ", 2)
+            total = int(total)
+            # 发送一个信号给主线程，让主线程弹出目录对话框，并从队列中取出保存的位置
+            self.gui.dir_dialog_signal.emit(dirname)
+            target = self.dir_queue.get()
+            # 如果用户选择了保存的位置，就通知服务器开始发送归档流
+            if target:
+                self.sock.send("READY".encode())
+                # 在开始下载前，把所有控件设置为不可用
+                self.gui.set_enabled(False)
+                # 开始一条传输记录，每解包一个文件就累加该文件的大小，进度按目录中文件的总大小计算
+                record = self.stats.start('getdir', dirname, total)
+                try:
+                    count, size = archive_stream.receive_archive(self.sock, os.path.join(target, dirname), record.add)
+                    self.stats.finish(record, True)
+                    self.gui.output_signal.emit(f"<font color='purple'>下载完成：{dirname}，共{count}个文件，归档数据{self.format_size(size)}</font>")
+                    self.report_transfer(record)
+                    self.gui.result.emit(True)
+                # 如果发生异常，就打印异常信息
+                except Exception as e:
+                    self.gui.output_signal.emit(f"<font color='red' face='bold'>下载异常：{e}</font>")
+                    self.stats.finish(record, False, e)
+                    self.report_transfer(record)
+                    self.gui.result.emit(False)
+                # 在结束下载后，把所有控件恢复为可用
+                self.gui.set_enabled(True)
+            # 否则，通知服务器取消，服务器不会发送任何归档数据，不需要清空缓冲区
+            else:
+                self.sock.send("CANCEL".encode())
+                self.gui.output_signal.emit(f"<font color='red'>取消下载：{dirname}</font>")
+                self.gui.result.emit(True)
+        # 否则，说明目录不存在，弹出错误提示框
+        else:
+            self.gui.error_signal.emit(response)
+            self.gui.result.emit(False)
+        # 释放锁，让其他线程可以访问
+        self.lock.release()
+
+    # 发送目录的方法，把本地目录打包成归档流，边打包边发送
+    def send_dir(self, response, compress):
+        # 获取锁，防止多个线程同时访问
+        self.lock.acquire()
+        # 如果响应以OK开头，说明服务器已准备好接收
+        if response.startswith("OK"):
+            # 把响应分割为两部分，第一部分是OK，第二部分是目录名
+            _, dirname = response.split(" ", 1)
+            # 在开始上传前，把所有控件设置为不可用
+            self.gui.set_enabled(False)
+            # 开始一条传输记录，归档的总大小事先不知道，每发送一帧就累加这一帧的字节数
+            record = self.stats.start('putdir', dirname)
+            try:
+                # 无论归档流是否发送完整，服务器都会回复解包的结果，先读出来，不会和下一条命令的响应混在一起
+                try:
+                    count, size = archive_stream.send_archive(self.sock, dirname, compress, record.add)
+                finally:
+                    archive_stream.read_status(self.sock)
+                self.stats.finish(record, True)
+                self.gui.output_signal.emit(f"<font color='purple'>上传完成：{dirname}，共{count}个文件</font>")
+                self.report_transfer(record, '归档数据')
+                self.gui.result.emit(True)
+            # 如果发生异常，就打印异常信息
+            except Exception as e:
+                self.gui.output_signal.emit(f"<font color='red' face='bold'>上传异常：{e}</font>")
+                self.stats.finish(record, False, e)
+                self.report_transfer(record, '归档数据')
+                self.gui.result.emit(False)
+            # 在结束上传后，把所有控件恢复为可用
+            self.gui.set_enabled(True)
+        # 否则，弹出错误提示框
+        else:
+            self.gui.error_signal.emit(response)
+            self.gui.result.emit(False)
+        # 释放锁，让其他线程可以访问
+        self.lock.release()
+
+    # 在控制台打印一次传输的结果的方法，包括用时、数据量、平均速度，有停顿时再打印停顿的次数和总时长
+    def report_transfer(self, record, unit='数据'):
+        action = '下载' if record.kind in ('get', 'getdir') else '上传'
+        self.gui.output_signal.emit(f"<font color='purple'>在{record.duration:.2f}秒内{action}了{self.format_size(record.bytes)}{unit}</font>")
+        self.gui.output_signal.emit(f"<font color='purple'>{action}速度：{record.throughput / 1024:.2f}KB/s</font>")
+        if record.stalls:
+            self.gui.output_signal.emit(f"<font color='purple'>传输停顿{len(record.stalls)}次，共{record.stall_time:.2f}秒</font>")
+
     # 定义一个函数，根据文件大小选择合适的单位，并返回一个格式化的字符串
     def format_size(self, size):
         # 定义一个列表，存储不同的单位
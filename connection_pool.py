@@ -0,0 +1,265 @@
+# connection_pool.py
+# 这是一个客户端连接池模块，保存已经连接并登录好的FTPSession，交给脚本和并行的传输任务使用，用完后放回池中
+# 批量任务不必为每个操作重新建立TCP连接和登录；空闲的连接由后台线程定时用noop命令检查，断开的连接会被丢弃
+# 同一个服务器的连接总数有上限，多个连接池（例如不同用户）共用这个上限，不会因为并发任务太多而占满服务器的线程
+import contextlib
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import ftp_logger
+from ftp_session import FTPSession
+
+# 定义一些常量
+MAX_SIZE = 8 # 每个连接池最多同时打开的连接数
+MIN_IDLE = 0 # 后台线程保持的最少空闲连接数，大于0时提前建立连接，第一次使用时不需要等待
+MAX_PER_SERVER = 16 # 同一个服务器最多同时打开的连接数，所有连接池共用
+IDLE_TIMEOUT = 300 # 空闲超过这么多秒的连接会被关闭
+CHECK_INTERVAL = 30 # 后台线程检查空闲连接的间隔秒数，空闲超过这个时间的连接在交给使用者之前也会先检查
+ACQUIRE_TIMEOUT = 30 # 连接都在使用中时，等待其他使用者放回连接的默认秒数
+
+# 创建一个结构化日志对象
+logger = ftp_logger.get_logger('pool')
+
+# 每个服务器的连接数上限，键是(地址, 端口号)，值是一个信号量
+server_slots = {}
+server_slots_lock = threading.Lock()
+# 由get_pool创建的共用连接池，键是(地址, 端口号, 用户名)
+pools = {}
+pools_lock = threading.Lock()
+
+
+# 获取某个服务器的连接数信号量的函数，第一次使用时按MAX_PER_SERVER创建
+def get_server_slots(host, port):
+    with server_slots_lock:
+        if (host, port) not in server_slots:
+            server_slots[(host, port)] = threading.BoundedSemaphore(MAX_PER_SERVER)
+        return server_slots[(host, port)]
+
+
+# 定义一个连接池超时的异常类，所有连接都在使用中，并且在超时前没有连接被放回时抛出
+class PoolTimeout(Exception):
+    pass
+
+
+# 定义一个连接池类
+class ConnectionPool:
+
+    # 初始化方法，username为None时连接不登录，只能执行不需要登录的命令
+    # reset_dir为True时，连接放回池中之前切换回登录后的目录，下一个使用者拿到的连接总是在同一个目录
+    def __init__(self, host, port, username=None, password=None, max_size=MAX_SIZE, min_idle=MIN_IDLE,
+                 idle_timeout=IDLE_TIMEOUT, check_interval=CHECK_INTERVAL, reset_dir=True):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.max_size = max_size
+        self.min_idle = min(min_idle, max_size)
+        self.idle_timeout = idle_timeout
+        self.check_interval = check_interval
+        self.reset_dir = reset_dir
+        self.slots = get_server_slots(host, port)
+        # 创建一个条件变量，连接被放回或关闭时通知等待的使用者
+        self.condition = threading.Condition()
+        # 空闲的连接和放回的时间，后放回的在后面，优先使用最近用过的连接
+        self.idle = []
+        # 当前打开的连接数，包括空闲的和正在使用的
+        self.size = 0
+        # 增加一个属性，用于标记连接池是否已经关闭
+        self.closed = False
+        # 启动后台线程，检查空闲的连接，关闭超时的连接，保持最少的空闲连接数
+        self.thread = threading.Thread(target=self.run, daemon=True, name=f'pool-{host}:{port}')
+        self.thread.start()
+
+    # 支持with语句的方法，退出时关闭连接池
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    # 建立一个新连接并登录的方法，调用者已经占用了一个连接数
+    def open_session(self):
+        session = FTPSession(self.host, self.port)
+        try:
+            if self.username is not None and not session.login(self.username, self.password):
+                raise PermissionError(f'用户{self.username}登录失败')
+            # 切换到当前目录，得到登录后的目录的完整路径
+            if self.reset_dir:
+                session.cd('.')
+        except BaseException:
+            session.sock.close()
+            raise
+        # 记录登录后的目录，放回连接时切换回这个目录
+        session.home_dir = session.current_dir
+        return session
+
+    # 检查一个连接是否可用的方法
+    @staticmethod
+    def check(session):
+        try:
+            return session.noop()
+        except (OSError, ValueError):
+            return False
+
+    # 关闭一个连接的方法，同时释放它占用的连接数
+    def discard(self, session):
+        try:
+            session.sock.close()
+        finally:
+            self.slots.release()
+            with self.condition:
+                self.size -= 1
+                self.condition.notify()
+
+    # 取出一个连接的方法，优先使用空闲的连接，没有空闲的连接时在上限以内建立新连接，否则等待其他使用者放回连接
+    def acquire(self, timeout=ACQUIRE_TIMEOUT):
+        deadline = time.monotonic() + timeout
+        while True:
+            with self.condition:
+                while True:
+                    if self.closed:
+                        raise RuntimeError('连接池已经关闭')
+                    if self.idle:
+                        session, released = self.idle.pop()
+                        break
+                    # 连接数没有达到上限，并且服务器的连接数也有剩余时，建立新连接
+                    if self.size < self.max_size and self.slots.acquire(blocking=False):
+                        self.size += 1
+                        session = None
+                        break
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise PoolTimeout(f'{timeout}秒内没有可用的连接')
+                    # 其他连接池放回连接时不会通知这里，所以最多等待一个检查间隔再重新尝试占用服务器的连接数
+                    self.condition.wait(min(remaining, 1))
+            if session is None:
+                try:
+                    return self.open_session()
+                except BaseException:
+                    self.slots.release()
+                    with self.condition:
+                        self.size -= 1
+                        self.condition.notify()
+                    raise
+            # 空闲了一段时间的连接可能已经被服务器或网络断开，先检查一下
+            if time.monotonic() - released < self.check_interval or self.check(session):
+                return session
+            logger.info('pool_discard', host=self.host, port=self.port, reason='check_failed')
+            self.discard(session)
+
+    # 放回一个连接的方法，broken为True时说明使用过程中出了错，连接的状态不确定，直接关闭
+    def release(self, session, broken=False):
+        if not broken and not self.closed:
+            try:
+                # 把断点和目录恢复到登录后的状态，下一个使用者不会受到影响
+                if session.breakpoint:
+                    session.restart(0)
+                if self.reset_dir and session.current_dir != session.home_dir:
+                    broken = not session.cd(session.home_dir)
+            except (OSError, ValueError):
+                broken = True
+        if broken or self.closed:
+            self.discard(session)
+            return
+        with self.condition:
+            self.idle.append((session, time.monotonic()))
+            self.condition.notify()
+
+    # 借用一个连接的方法，用于with语句，语句块中抛出异常时关闭这个连接
+    @contextlib.contextmanager
+    def session(self, timeout=ACQUIRE_TIMEOUT):
+        session = self.acquire(timeout)
+        try:
+            yield session
+        except BaseException:
+            self.release(session, broken=True)
+            raise
+        self.release(session)
+
+    # 用连接池中的连接并行执行任务的方法，func的调用方式为func(连接, 任务)，返回和任务顺序一致的结果列表
+    # 并行度等于连接池的上限，某个任务失败时抛出它的异常
+    def map(self, func, items, timeout=ACQUIRE_TIMEOUT):
+        def run(item):
+            with self.session(timeout) as session:
+                return func(session, item)
+        with ThreadPoolExecutor(max_workers=self.max_size, thread_name_prefix='pool-job') as executor:
+            return list(executor.map(run, items))
+
+    # 后台线程执行的方法
+    def run(self):
+        while True:
+            with self.condition:
+                self.condition.wait_for(lambda: self.closed, self.check_interval if self.min_idle == 0 else 1)
+                if self.closed:
+                    return
+            self.maintain()
+
+    # 维护空闲连接的方法，关闭空闲太久的连接，检查其余的空闲连接，再补足最少的空闲连接数
+    def maintain(self):
+        now = time.monotonic()
+        with self.condition:
+            # 取出需要处理的空闲连接，检查期间它们不会被交给使用者
+            expired = [session for session, released in self.idle if now - released >= self.idle_timeout]
+            stale = [(session, released) for session, released in self.idle
+                     if self.check_interval <= now - released < self.idle_timeout]
+            self.idle = [(session, released) for session, released in self.idle if now - released < self.check_interval]
+        for session in expired:
+            try:
+                session.quit()
+            except OSError:
+                pass
+            self.slots.release()
+            with self.condition:
+                self.size -= 1
+                self.condition.notify()
+        for session, released in stale:
+            if self.check(session):
+                with self.condition:
+                    # 检查通过的连接按原来的放回时间放回，空闲超时仍然从上次使用时算起
+                    self.idle.insert(0, (session, released))
+                    self.condition.notify()
+            else:
+                logger.info('pool_discard', host=self.host, port=self.port, reason='check_failed')
+                self.discard(session)
+        # 补足最少的空闲连接数
+        while not self.closed:
+            with self.condition:
+                if len(self.idle) >= self.min_idle or self.size >= self.max_size or not self.slots.acquire(blocking=False):
+                    return
+                self.size += 1
+            try:
+                session = self.open_session()
+            except Exception as e:
+                logger.warning('pool_connect_error', host=self.host, port=self.port, error=str(e))
+                self.slots.release()
+                with self.condition:
+                    self.size -= 1
+                return
+            with self.condition:
+                self.idle.append((session, time.monotonic()))
+                self.condition.notify()
+
+    # 关闭连接池的方法，关闭所有空闲的连接，正在使用的连接在放回时关闭
+    def close(self):
+        with self.condition:
+            self.closed = True
+            idle, self.idle = self.idle, []
+            self.condition.notify_all()
+        for session, _ in idle:
+            try:
+                session.quit()
+            except OSError:
+                pass
+            self.slots.release()
+            with self.condition:
+                self.size -= 1
+
+
+# 获取或创建一个连接池的函数，同一个服务器和同一个用户共用一个连接池
+def get_pool(host, port, username=None, password=None, **kwargs):
+    with pools_lock:
+        key = (host, port, username)
+        pool = pools.get(key)
+        if pool is None or pool.closed:
+            pool = pools[key] = ConnectionPool(host, port, username, password, **kwargs)
+        return pool
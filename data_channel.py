@@ -0,0 +1,115 @@
+# data_channel.py
+# 这是一个数据连接模块，实现类似FTP被动模式的数据通道，文件数据不再和命令的响应共用一个socket
+# get -p和put -p命令的响应带有一个临时监听的端口号和一次性的密钥，客户端连接这个端口并先发送密钥，再在这个连接上收发文件数据
+# 传输在服务器的后台线程中进行，控制连接可以继续执行ls、stat等命令，也可以同时开始其他传输
+# 取消下载时客户端直接关闭数据连接，服务器发送失败后停止，不需要接收剩余的数据
+# 上传时客户端发送完毕后关闭发送方向，服务器保存好文件后在数据连接上回复OK，失败时回复ERROR和原因，再关闭数据连接
+import secrets
+import socket
+import time
+
+# 定义一些常量
+PASSIVE_OPTION = '-p' # 使用数据连接传输的命令选项
+DATA_TIMEOUT = 30 # 服务器等待客户端连接数据端口的秒数，也是数据连接上收发数据的超时秒数
+STATUS_SIZE = 1024 # 客户端每次接收上传结果的字节数
+KEY_BYTES = 16 # 一次性密钥的字节数，用十六进制字符串发送
+
+
+# 判断一条命令是否使用数据连接的函数
+def is_passive_command(command):
+    parts = command.split(' ', 2)
+    return len(parts) > 2 and parts[0] in ('get', 'put') and parts[1] == PASSIVE_OPTION
+
+
+# 在命令中加上数据连接选项的函数，例如get 文件名变为get -p 文件名，已经带有选项时原样返回
+def make_passive(command):
+    if is_passive_command(command):
+        return command
+    verb, rest = command.split(' ', 1)
+    return f'{verb} {PASSIVE_OPTION} {rest}'
+
+
+# 服务器打开数据端口的函数，在和控制连接相同的地址上监听一个临时端口，返回监听socket、端口号和一次性密钥
+def open_listener(host):
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    try:
+        listener.bind((host, 0))
+        listener.listen(1)
+    except OSError:
+        listener.close()
+        raise
+    return listener, listener.getsockname()[1], secrets.token_hex(KEY_BYTES)
+
+
+# 服务器接受数据连接的函数，返回校验过密钥的数据连接，超时前没有客户端带着正确的密钥连接时抛出TimeoutError
+# 密钥不对的连接会被关闭，不会占用这个端口，无论结果如何监听socket都会被关闭
+def accept(listener, key, timeout=DATA_TIMEOUT):
+    deadline = time.monotonic() + timeout
+    expected = (key + '\n').encode()
+    try:
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise TimeoutError('等待数据连接超时')
+            listener.settimeout(remaining)
+            try:
+                sock, _ = listener.accept()
+            except socket.timeout:
+                raise TimeoutError('等待数据连接超时')
+            sock.settimeout(timeout)
+            try:
+                received = b''
+                while len(received) < len(expected):
+                    data = sock.recv(len(expected) - len(received))
+                    if not data:
+                        break
+                    received += data
+            except OSError:
+                received = b''
+            if secrets.compare_digest(received, expected):
+                return sock
+            sock.close()
+    finally:
+        listener.close()
+
+
+# 客户端连接数据端口的函数，连接后先发送密钥，返回数据连接
+def connect(host, port, key, timeout=DATA_TIMEOUT):
+    sock = socket.create_connection((host, port), timeout)
+    try:
+        sock.sendall((key + '\n').encode())
+    except OSError:
+        sock.close()
+        raise
+    return sock
+
+
+# 解析get -p命令的响应的函数，响应的格式是OK 文件大小 端口号 密钥 文件名，返回(文件大小, 端口号, 密钥, 文件名)
+def parse_get_reply(response):
+    _, size, port, key, filename = response.split(' ', 4)
+    return int(size), int(port), key, filename
+
+
+# 检查上传结果的函数，status是服务器关闭数据连接之前发送的全部数据，不是OK时抛出IOError
+# 服务器没有回复就关闭了数据连接，说明保存文件时出错，同样算作失败
+def check_upload_status(status):
+    status = status.decode('utf-8', 'replace')
+    if not status.startswith('OK'):
+        raise IOError(status or '服务器没有确认上传就关闭了数据连接')
+    return status
+
+
+# 客户端发送完上传的数据后读取上传结果的函数，一直接收到服务器关闭数据连接为止
+def read_upload_status(sock):
+    status = b''
+    while True:
+        data = sock.recv(STATUS_SIZE)
+        if not data:
+            return check_upload_status(status)
+        status += data
+
+
+# 解析put -p命令的响应的函数，响应的格式是OK 端口号 密钥 文件名，返回(端口号, 密钥, 文件名)
+def parse_put_reply(response):
+    _, port, key, filename = response.split(' ', 3)
+    return int(port), key, filename
@@ -11,6 +11,15 @@ TABLE_NAME = "users"
 # 定义一个常量，用于存储用户表的字段
 FIELDS = ["username", "password"]
 
+# 定义一个常量，用于存储会话表的名称
+SESSION_TABLE_NAME = "sessions"
+
+# 定义一个常量，用于存储会话表的字段
+SESSION_FIELDS = ["token", "username", "current_dir", "transfer_direction", "transfer_filename", "transfer_offset", "expires"]
+
+# 定义一个常量，用于存储中止请求表的名称，多进程模式下abort命令通过这个表转给正在发送文件的工作进程
+ABORT_TABLE_NAME = "aborts"
+
 # 定义一个管理数据库的类
 class DBManager:
 
@@ -22,6 +31,10 @@ class DBManager:
         self.cursor = self.conn.cursor()
         # 创建或检查用户表
         self.create_table()
+        # 创建或检查会话表
+        self.create_session_table()
+        # 创建或检查中止请求表
+        self.create_abort_table()
 
     # 创建或检查用户表的方法
     def create_table(self):
@@ -35,6 +48,21 @@ class DBManager:
         # 提交事务
         self.conn.commit()
 
+    # 创建或检查会话表的方法，会话表用于保存断线客户端的会话，供其凭令牌恢复
+    def create_session_table(self):
+        sql = f"CREATE TABLE IF NOT EXISTS {SESSION_TABLE_NAME} (token TEXT PRIMARY KEY, "
+        for field in SESSION_FIELDS[1:]:
+            sql += f"{field} TEXT NOT NULL, "
+        sql = sql[:-2] + ")"
+        self.cursor.execute(sql)
+        self.conn.commit()
+
+    # 创建或检查中止请求表的方法，offset为空表示请求还没有被处理，-1表示这个令牌没有正在进行的下载
+    def create_abort_table(self):
+        sql = f"CREATE TABLE IF NOT EXISTS {ABORT_TABLE_NAME} (token TEXT PRIMARY KEY, offset INTEGER, requested REAL NOT NULL)"
+        self.cursor.execute(sql)
+        self.conn.commit()
+
     # 关闭数据库连接的方法
     def close(self):
         # 关闭游标对象
@@ -88,4 +116,52 @@ class DBManager:
         except Exception as e:
             self.conn.rollback()
             # 返回False，表示插入失败
-            return False
\ No newline at end of file
+            return False
+
+    # 保存会话的方法，令牌已存在时覆盖原来的记录
+    def save_session(self, token, username, current_dir, transfer_direction, transfer_filename, transfer_offset, expires):
+        sql = f"INSERT OR REPLACE INTO {SESSION_TABLE_NAME} ({', '.join(SESSION_FIELDS)}) VALUES ({', '.join('?' * len(SESSION_FIELDS))})"
+        self.cursor.execute(sql, (token, username, current_dir, transfer_direction, transfer_filename, transfer_offset, expires))
+        self.conn.commit()
+
+    # 查询会话的方法，返回一个元组(username, current_dir, transfer_direction, transfer_filename, transfer_offset)，令牌不存在或已过期时返回None
+    def load_session(self, token, now):
+        sql = f"SELECT username, current_dir, transfer_direction, transfer_filename, transfer_offset FROM {SESSION_TABLE_NAME} WHERE token = ? AND CAST(expires AS REAL) > ?"
+        self.cursor.execute(sql, (token, now))
+        result = self.cursor.fetchone()
+        if result:
+            return result[0], result[1], result[2], result[3], int(result[4])
+        return None
+
+    # 删除会话的方法，同时清理所有已过期的会话
+    def delete_session(self, token, now):
+        sql = f"DELETE FROM {SESSION_TABLE_NAME} WHERE token = ? OR CAST(expires AS REAL) <= ?"
+        self.cursor.execute(sql, (token, now))
+        self.conn.commit()
+
+    # 请求中止某个令牌的下载的方法，同一个令牌已有的请求会被覆盖
+    def request_abort(self, token, now):
+        sql = f"INSERT OR REPLACE INTO {ABORT_TABLE_NAME} (token, offset, requested) VALUES (?, NULL, ?)"
+        self.cursor.execute(sql, (token, now))
+        self.conn.commit()
+
+    # 查询还没有被处理的中止请求的方法，返回令牌的列表
+    def pending_aborts(self):
+        self.cursor.execute(f"SELECT token FROM {ABORT_TABLE_NAME} WHERE offset IS NULL")
+        return [row[0] for row in self.cursor.fetchall()]
+
+    # 记录中止请求的处理结果的方法，offset是发送结束的位置，-1表示没有正在进行的下载
+    def finish_abort(self, token, offset):
+        self.cursor.execute(f"UPDATE {ABORT_TABLE_NAME} SET offset = ? WHERE token = ? AND offset IS NULL", (offset, token))
+        self.conn.commit()
+
+    # 查询中止请求的处理结果的方法，还没有被处理时返回None
+    def abort_result(self, token):
+        self.cursor.execute(f"SELECT offset FROM {ABORT_TABLE_NAME} WHERE token = ?", (token,))
+        result = self.cursor.fetchone()
+        return None if result is None or result[0] is None else int(result[0])
+
+    # 删除中止请求的方法
+    def delete_abort(self, token):
+        self.cursor.execute(f"DELETE FROM {ABORT_TABLE_NAME} WHERE token = ?", (token,))
+        self.conn.commit()
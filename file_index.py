@@ -0,0 +1,292 @@
+# file_index.py
+# 这是一个文件名索引模块，用于实现find命令，在服务器根目录下按通配符或正则表达式查找文件
+# 索引在内存中按目录保存每个目录的修改时间和其中的文件名，后台线程定时检查每个目录的修改时间，只重新读取有变化的目录
+# 上传文件后服务器会直接把新文件加入索引，不需要等下一次检查
+# 查询时把所有路径拼接成一个用换行符分隔的长字符串，用正则表达式一次扫描，比逐个路径匹配快得多
+# 新增的路径先放在一个小的追加列表中，查询时和长字符串分别扫描；只有删除了路径时才需要重新生成长字符串，由后台线程在检查完目录后进行
+# 正则表达式由客户端提供，长度有上限，扫描超过时间上限就停止，不会让一个查询长时间占用服务器
+import itertools
+import os
+import re
+import threading
+import time
+
+# 定义一些常量
+SCAN_INTERVAL = 30 # 后台线程检查目录修改时间的间隔秒数
+BATCH_SIZE = 1000 # 查找结果每凑够多少条发送一次
+END_MARK = 'END\t' # 查找结果结束的标记，后面跟着结果的条数，文件名中一般不会出现制表符
+MAX_REGEX_LENGTH = 200 # 正则表达式模式的最大长度
+REGEX_TIMEOUT = 5 # 按正则表达式查找的最长秒数，超过时只返回已经找到的结果
+
+
+# 把通配符转换为正则表达式的函数，*和?不匹配路径分隔符，**可以匹配多级目录
+def glob_to_regex(pattern):
+    result = []
+    i = 0
+    while i < len(pattern):
+        c = pattern[i]
+        if pattern.startswith('**', i):
+            result.append('[^\\n]*')
+            i += 2
+            continue
+        if c == '*':
+            result.append('[^/\\n]*')
+        elif c == '?':
+            result.append('[^/\\n]')
+        elif c == '[':
+            end = pattern.find(']', i + 2)
+            if end == -1:
+                result.append('\\[')
+            else:
+                body = pattern[i + 1:end]
+                if body.startswith('!'):
+                    body = '^' + body[1:]
+                result.append('[' + body.replace('\\', '\\\\') + ']')
+                i = end
+        else:
+            result.append(re.escape(c))
+        i += 1
+    return ''.join(result)
+
+
+# 定义一个文件名索引类
+class FileIndex:
+
+    # 初始化方法，接受要建立索引的根目录作为参数
+    def __init__(self, root, interval=SCAN_INTERVAL):
+        self.root = os.path.abspath(root)
+        self.interval = interval
+        # 创建一个锁对象，防止后台线程和上传线程同时修改索引
+        self.lock = threading.Lock()
+        # 每个目录的修改时间和其中的条目，键是相对于根目录的路径（根目录为空字符串），值是(修改时间, {名称: 是否为目录})
+        self.dirs = {}
+        # 所有路径拼接成的字符串和它是否需要重新生成的标记，有路径被删除时才需要重新生成
+        self.blob = '\n'
+        self.dirty = False
+        # 上次生成字符串之后新增的路径，格式和字符串中的行相同，以及它们拼接成的字符串的缓存
+        self.added = []
+        self.added_blob = None
+        # 创建一个事件对象，第一次建立索引完成后设置，在此之前的查询要等待
+        self.ready = threading.Event()
+
+    # 启动后台线程的方法，先建立完整的索引，再定时检查有变化的目录
+    def start(self):
+        threading.Thread(target=self.run, daemon=True, name='file-index').start()
+
+    # 后台线程执行的方法，每次检查完目录后把新增的路径合并到字符串中，查询时不需要重新生成
+    def run(self):
+        while True:
+            start_time = time.perf_counter()
+            self.scan()
+            self.rebuild()
+            self.ready.set()
+            time.sleep(max(self.interval, time.perf_counter() - start_time))
+
+    # 把相对路径转换为绝对路径的方法
+    def fullpath(self, rel):
+        return os.path.join(self.root, *rel.split('/')) if rel else self.root
+
+    # 把绝对路径转换为相对于根目录的路径的方法，不在根目录下时返回None
+    def relpath(self, path):
+        path = os.path.abspath(path)
+        if path == self.root:
+            return ''
+        if not path.startswith(self.root.rstrip(os.sep) + os.sep):
+            return None
+        return path[len(self.root.rstrip(os.sep)) + 1:].replace(os.sep, '/')
+
+    # 检查所有目录的方法，只重新读取修改时间有变化的目录，已删除的目录连同子目录一起从索引中去掉
+    def scan(self, rel=''):
+        stack = [rel]
+        while stack:
+            rel = stack.pop()
+            try:
+                mtime = os.stat(self.fullpath(rel)).st_mtime_ns
+            except OSError:
+                with self.lock:
+                    self.remove_tree(rel)
+                continue
+            entry = self.dirs.get(rel)
+            entries = self.read_dir(rel) if entry is None or entry[0] != mtime else None
+            with self.lock:
+                if entries is not None:
+                    old = entry[1] if entry is not None else {}
+                    for name, is_dir in old.items():
+                        # 原来的子目录已经不在了，就把它们从索引中去掉
+                        if is_dir and not entries.get(name):
+                            self.remove_tree(self.join(rel, name))
+                        # 有条目被删除或者类型变了，字符串中的行需要去掉，只能重新生成
+                        if entries.get(name) is not is_dir:
+                            self.dirty = True
+                    # 新增的条目只需要追加
+                    for name, is_dir in entries.items():
+                        if name not in old:
+                            self.append(rel, name, is_dir)
+                    self.dirs[rel] = (mtime, entries)
+                else:
+                    entries = entry[1]
+                # 上传线程可能同时往目录中加入新文件，所以在锁内取出子目录
+                stack.extend(self.join(rel, name) for name, is_dir in entries.items() if is_dir)
+
+    # 读取一个目录的方法，返回{名称: 是否为目录}，不跟随符号链接，避免循环
+    def read_dir(self, rel):
+        entries = {}
+        try:
+            with os.scandir(self.fullpath(rel)) as it:
+                for entry in it:
+                    try:
+                        entries[entry.name] = entry.is_dir(follow_symlinks=False)
+                    except OSError:
+                        entries[entry.name] = False
+        except OSError:
+            pass
+        return entries
+
+    # 把一个目录和其中的所有子目录从索引中去掉的方法，调用者需要持有锁
+    def remove_tree(self, rel):
+        prefix = rel + '/'
+        for key in [key for key in self.dirs if key == rel or key.startswith(prefix)]:
+            del self.dirs[key]
+        self.dirty = True
+
+    # 拼接相对路径的方法
+    @staticmethod
+    def join(rel, name):
+        return rel + '/' + name if rel else name
+
+    # 得到一个条目在字符串中的行的方法，每行是以/开头的相对路径，目录以/结尾
+    @staticmethod
+    def line(rel, name, is_dir):
+        return ('/' + rel + '/' if rel else '/') + name + ('/' if is_dir else '')
+
+    # 记录一个新增条目的方法，调用者需要持有锁
+    def append(self, rel, name, is_dir):
+        self.added.append(self.line(rel, name, is_dir))
+        self.added_blob = None
+
+    # 上传完成后调用的方法，把新文件或新目录加入索引，目录会被完整地读取一次
+    def add(self, path):
+        rel = self.relpath(path)
+        if not rel:
+            return
+        parent, _, name = rel.rpartition('/')
+        is_dir = os.path.isdir(path)
+        with self.lock:
+            entry = self.dirs.get(parent)
+            if entry is None:
+                return
+            # 覆盖已有的同名文件时索引不变，名称相同但类型变了时只能重新生成字符串
+            if name not in entry[1]:
+                self.append(parent, name, is_dir)
+            elif entry[1][name] != is_dir:
+                self.dirty = True
+            entry[1][name] = is_dir
+        if is_dir:
+            self.scan(rel)
+
+    # 重新生成所有路径拼接成的字符串的方法，由后台线程调用，有路径被删除或者有新增的路径时才生成
+    # 每行是以/开头的相对路径，目录以/结尾，这样按文件名查找的正则表达式以固定的字符开头，可以快速跳过不匹配的位置
+    def rebuild(self):
+        with self.lock:
+            if not self.dirty and not self.added:
+                return
+            lines = [self.line(rel, name, is_dir) for rel, (_, entries) in self.dirs.items() for name, is_dir in entries.items()]
+            self.blob = '\n' + '\n'.join(lines) + '\n'
+            self.dirty = False
+            self.added = []
+            self.added_blob = None
+
+    # 获取要扫描的字符串的方法，返回所有路径的字符串和新增路径的字符串，两者的格式相同
+    # 查询不重新生成长字符串，只拼接上次生成之后新增的少量路径；被删除的路径在后台线程重新生成之前仍然可能出现在结果中
+    def get_blobs(self):
+        with self.lock:
+            if self.added_blob is None:
+                self.added_blob = '\n' + '\n'.join(self.added) + '\n' if self.added else ''
+            return self.blob, self.added_blob
+
+    # 查找的方法，返回一个生成器，逐条产生相对于base的路径
+    # base是查找的起始目录，相对于根目录；regex为False时pattern是通配符，不含/时只匹配文件名，否则匹配相对于base的路径
+    def find(self, pattern, base='', regex=False, limit=0):
+        self.ready.wait()
+        blobs = self.get_blobs()
+        # 从子目录开始查找时，先取出这个目录下的路径，去掉目录前缀，后面的匹配都针对相对于base的路径
+        if base:
+            blobs = [''.join('\n' + match.group(1) for match in re.finditer(re.escape('\n/' + base) + '(/[^\n]+)', blob)) + '\n'
+                     for blob in blobs]
+        if regex:
+            return self.find_regex([blob.replace('\n/', '\n') for blob in blobs], pattern, limit)
+        pattern = pattern.strip('/')
+        body = glob_to_regex(pattern)
+        # 模式中有/时，从行首开始匹配整个相对路径
+        if '/' in pattern:
+            compiled = re.compile('\n/' + body + '/?(?=\n)')
+            def search(blob):
+                return (match.group(0)[2:] for match in compiled.finditer(blob))
+        # 否则只匹配最后一级的名称，再向前找到行首，得到完整的相对路径
+        else:
+            compiled = re.compile('/' + body + '/?(?=\n)')
+            def search(blob):
+                return (blob[blob.rfind('\n', 0, match.start()) + 2:match.end()] for match in compiled.finditer(blob))
+        return self.limited(itertools.chain.from_iterable(search(blob) for blob in blobs), limit)
+
+    # 按正则表达式查找的方法，先在整个字符串中搜索，再检查匹配所在的那一行，排除跨行的匹配
+    # 模式太长时抛出ValueError；查找超过REGEX_TIMEOUT秒时停止，只返回已经找到的结果
+    def find_regex(self, blobs, pattern, limit):
+        if len(pattern) > MAX_REGEX_LENGTH:
+            raise ValueError(f'正则表达式不能超过{MAX_REGEX_LENGTH}个字符')
+        scanner = re.compile(pattern, re.MULTILINE)
+        compiled = re.compile(pattern)
+        deadline = time.monotonic() + REGEX_TIMEOUT
+        def matches(blob):
+            pos = 0
+            while time.monotonic() < deadline:
+                match = scanner.search(blob, pos)
+                if match is None:
+                    return
+                begin = blob.rfind('\n', 0, match.start()) + 1
+                end = blob.find('\n', match.start())
+                if end == -1:
+                    return
+                line = blob[begin:end]
+                if line and compiled.search(line):
+                    yield line
+                pos = max(end, match.start()) + 1
+        return self.limited(itertools.chain.from_iterable(matches(blob) for blob in blobs), limit)
+
+    # 限制结果条数的方法，limit为0表示不限制
+    @staticmethod
+    def limited(results, limit):
+        for count, result in enumerate(results, 1):
+            yield result
+            if limit and count >= limit:
+                return
+
+
+# 解析find命令的函数，返回模式、是否为正则表达式和结果条数上限
+# 格式是find [-r] [-n 条数] 模式，-r表示模式是正则表达式，否则是通配符
+def parse_command(command):
+    args = command.split(' ', 1)[1] if ' ' in command else ''
+    regex = False
+    limit = 0
+    while args.startswith('-'):
+        option, _, args = args.partition(' ')
+        if option == '-r':
+            regex = True
+        elif option == '-n':
+            value, _, args = args.partition(' ')
+            limit = int(value)
+        else:
+            raise ValueError(option)
+    if not args:
+        raise ValueError('缺少模式')
+    return args, regex, limit
+
+
+# 检查find命令的响应是否已经接收完整的函数，以结束标记开头的最后一行表示结束
+def is_complete(data):
+    if data.startswith(b'ERROR'):
+        return True
+    if not data.endswith(b'\n'):
+        return False
+    last = data[:-1].rsplit(b'\n', 1)[-1]
+    return last.startswith(END_MARK.encode())
@@ -0,0 +1,82 @@
+# file_meta.py
+# 这是一个文件元数据模块，用于实现stat和mstat命令，查询文件的类型、大小、修改时间和哈希值
+# 哈希值的计算开销很大，所以放在缓存中，以(路径, 修改时间, 大小)为键，文件被修改后自动失效
+# 上传去重时服务器已经校验过的哈希值也会放入缓存，不需要重新计算
+import os
+import threading
+from collections import OrderedDict
+import metrics
+import upload_store
+
+# 定义一些常量
+HASH_CACHE_SIZE = 10000 # 哈希值缓存最多保存的条目数
+SEPARATOR = '\t' # mstat命令中分隔多个路径、响应中分隔各个字段的字符，文件名中一般不会出现
+
+
+# 定义一个哈希值缓存类，按最近使用的顺序淘汰
+class HashCache:
+
+    # 初始化方法，接受最多保存的条目数作为参数
+    def __init__(self, size=HASH_CACHE_SIZE):
+        self.size = size
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+
+    # 查询一个文件的哈希值的方法，没有缓存或者文件已被修改时返回None
+    def get(self, path, stat):
+        with self.lock:
+            entry = self.entries.get(path)
+            if entry is not None and entry[0] == (stat.st_mtime_ns, stat.st_size):
+                self.entries.move_to_end(path)
+                metrics.CACHE_REQUESTS.inc(1, ('hash', 'hit'))
+                return entry[1]
+        metrics.CACHE_REQUESTS.inc(1, ('hash', 'miss'))
+        return None
+
+    # 保存一个文件的哈希值的方法
+    def put(self, path, stat, digest):
+        with self.lock:
+            self.entries[path] = ((stat.st_mtime_ns, stat.st_size), digest)
+            self.entries.move_to_end(path)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+
+# 查询一个路径的元数据的函数，返回一行用制表符分隔的文本：类型、大小、修改时间、哈希值和路径
+# 类型是file、dir或none，none表示路径不存在；没有哈希值时用-表示，compute为True时计算缺少的哈希值
+def stat_line(current_dir, path, hash_cache, compute=False):
+    fullpath = os.path.join(current_dir, path)
+    try:
+        stat = os.stat(fullpath)
+    except OSError:
+        return SEPARATOR.join(('none', '0', '0', '-', path))
+    if os.path.isdir(fullpath):
+        return SEPARATOR.join(('dir', '0', f'{stat.st_mtime:.6f}', '-', path))
+    digest = hash_cache.get(fullpath, stat)
+    if digest is None and compute:
+        digest = upload_store.file_digest(fullpath).hexdigest()
+        hash_cache.put(fullpath, stat, digest)
+    return SEPARATOR.join(('file', str(stat.st_size), f'{stat.st_mtime:.6f}', digest or '-', path))
+
+
+# 解析stat和mstat命令的函数，返回路径列表和是否计算哈希值，-h选项表示计算缺少的哈希值
+# stat命令只有一个路径，mstat命令的多个路径用制表符分隔
+def parse_command(command):
+    verb, _, args = command.partition(' ')
+    compute = args.startswith('-h ')
+    if compute:
+        args = args[3:]
+    paths = args.split(SEPARATOR) if verb == 'mstat' else [args]
+    return [path for path in paths if path], compute
+
+
+# 解析stat和mstat命令的响应的函数，返回一个列表，每个元素是一个字典，包括类型、大小、修改时间、哈希值和路径
+def parse_response(response):
+    entries = []
+    for line in response.split('\n')[1:]:
+        if not line:
+            continue
+        kind, size, mtime, digest, path = line.split(SEPARATOR, 4)
+        entries.append({'type': kind, 'size': int(size), 'mtime': float(mtime),
+                        'hash': None if digest == '-' else digest, 'path': path})
+    return entries
@@ -0,0 +1,183 @@
+# ftp_logger.py
+# 这是一个结构化日志模块，基于logging模块，把日志格式化为JSON行
+# 日志记录先放入队列，由后台线程统一写出，传输线程不会因为写日志而阻塞
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import threading
+
+# 定义一个常量，用于存储日志队列的最大长度，队列满时丢弃新的日志，而不是阻塞调用者
+QUEUE_SIZE = 10000
+# 定义一个常量，用于存储根日志器的名称
+ROOT_NAME = 'ftp'
+# 定义一些常量，用于存储日志中要隐去参数的命令，登录和注册只保留用户名，带会话令牌的命令只保留命令名
+CREDENTIAL_VERBS = ('login', 'register')
+TOKEN_VERBS = ('resume', 'abort')
+
+# 定义一些模块级变量，用于存储后台写日志的监听器和每条命令日志的采样率
+listener = None
+sample_rate = 1.0
+# 定义一个模块级变量，用于存储日志的输出流，fork出的子进程沿用父进程的输出流
+output_stream = None
+inherited = False
+# 创建一个锁对象，防止多个线程同时初始化
+setup_lock = threading.Lock()
+
+
+# 定义一个JSON格式化类，把日志记录转换为一行JSON
+class JsonFormatter(logging.Formatter):
+
+    # 格式化日志记录的方法
+    def format(self, record):
+        data = {
+            'time': round(record.created, 6),
+            'level': record.levelname,
+            'logger': record.name,
+            'thread': record.threadName,
+            'event': record.getMessage(),
+        }
+        # 把调用者传入的结构化字段合并进来
+        data.update(getattr(record, 'fields', {}))
+        if record.exc_info:
+            data['exc'] = self.formatException(record.exc_info)
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+# 定义一个不阻塞的队列处理类，队列满时直接丢弃日志并计数
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+
+    # 初始化方法
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        # 增加一个属性，用于统计被丢弃的日志条数
+        self.dropped = 0
+
+    # 把日志记录放入队列的方法
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    # 预处理日志记录的方法，父类会把消息格式化为字符串，这里只合并参数，把JSON格式化留给后台线程
+    def prepare(self, record):
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+
+# 初始化日志系统的函数，可以重复调用，只有第一次生效
+# stream是日志的输出流，level是日志级别，rate是每条命令日志的采样率
+# fork出的子进程中第一次调用时沿用父进程的输出流、日志级别和采样率，只重新启动后台线程
+def setup(stream=None, level='INFO', rate=1.0):
+    global listener, output_stream, inherited
+    with setup_lock:
+        if listener is not None:
+            return
+        if inherited:
+            stream = output_stream
+            inherited = False
+        else:
+            set_level(level)
+            set_sample_rate(rate)
+        output_stream = stream or sys.stdout
+        # 创建一个输出到流的处理器，只在后台线程中使用
+        output = logging.StreamHandler(output_stream)
+        output.setFormatter(JsonFormatter())
+        # 创建一个有界队列，调用者只把日志放入队列，由监听器的后台线程写出
+        log_queue = queue.Queue(QUEUE_SIZE)
+        root = logging.getLogger(ROOT_NAME)
+        root.addHandler(DroppingQueueHandler(log_queue))
+        root.propagate = False
+        listener = logging.handlers.QueueListener(log_queue, output)
+        listener.start()
+
+
+# 停止后台线程并写出队列中剩余日志的函数
+def shutdown():
+    global listener
+    with setup_lock:
+        if listener is not None:
+            listener.stop()
+            listener = None
+
+
+# fork出的子进程中调用的函数，子进程中没有后台写日志的线程，去掉继承来的队列处理器，让子进程可以重新初始化日志系统
+def after_fork():
+    global listener, setup_lock, inherited
+    inherited = listener is not None
+    listener = None
+    setup_lock = threading.Lock()
+    root = logging.getLogger(ROOT_NAME)
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+
+
+# 在支持fork的系统上注册子进程的回调函数
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=after_fork)
+
+
+# 设置日志级别的函数，可以在运行时调用
+def set_level(level):
+    logging.getLogger(ROOT_NAME).setLevel(level.upper() if isinstance(level, str) else level)
+
+
+# 设置每条命令日志的采样率的函数，可以在运行时调用，1表示全部记录，0表示全部不记录
+def set_sample_rate(rate):
+    global sample_rate
+    sample_rate = float(rate)
+
+
+# 定义一个结构化日志类，事件名之外的信息都作为字段传入
+class StructuredLogger:
+
+    # 初始化方法，接受日志器的名称作为参数
+    def __init__(self, name):
+        self.logger = logging.getLogger(f'{ROOT_NAME}.{name}')
+
+    # 记录日志的方法
+    def log(self, level, event, **fields):
+        if self.logger.isEnabledFor(level):
+            self.logger.log(level, event, extra={'fields': fields})
+
+    # 记录各个级别日志的方法
+    def debug(self, event, **fields):
+        self.log(logging.DEBUG, event, **fields)
+
+    def info(self, event, **fields):
+        self.log(logging.INFO, event, **fields)
+
+    def warning(self, event, **fields):
+        self.log(logging.WARNING, event, **fields)
+
+    def error(self, event, **fields):
+        self.log(logging.ERROR, event, **fields)
+
+    # 记录一条客户端命令的方法，按采样率抽样，登录等命令只记录命令名和用户名，不记录密码
+    # resume和abort命令的参数是会话令牌，拿到令牌就能恢复会话，所以只记录命令名
+    def command(self, command, **fields):
+        if sample_rate < 1 and random.random() >= sample_rate:
+            return
+        verb = command.split(' ')[0]
+        if verb in CREDENTIAL_VERBS:
+            command = ' '.join(command.split(' ')[:2])
+        elif verb in TOKEN_VERBS:
+            command = verb
+        self.info('command', verb=verb, command=command, **fields)
+
+    # 记录一次传输的汇总的方法，包括字节数、用时和吞吐量
+    def transfer(self, direction, filename, size, duration, offset=0, ok=True, **fields):
+        duration = max(duration, 0.000001)
+        self.log(logging.INFO if ok else logging.WARNING, 'transfer', direction=direction, file=filename,
+                 bytes=size, offset=offset, duration=round(duration, 6),
+                 throughput=round(size / duration, 1), ok=ok, **fields)
+
+
+# 获取一个结构化日志对象的函数
+def get_logger(name):
+    return StructuredLogger(name)
@@ -0,0 +1,296 @@
+# ftp_session.py
+# 这是一个不依赖图形界面的FTP客户端会话类，使用阻塞socket和FTP服务器通信
+# 可以在脚本、基准测试和后台任务中使用，协议和client.py中的FTPClient保持一致
+import os
+import select
+import socket
+import binary_listing
+import data_channel
+import file_index
+import file_meta
+import listing_cache
+import net_utils
+import pipeline
+import upload_store
+
+# 定义一些常量
+BUFFER_SIZE = 64 * 1024 # 缓冲区大小，用于接收和发送数据
+
+
+# 定义一个FTP会话类
+class FTPSession:
+
+    # 初始化方法，接受IP地址、端口号和超时时间作为参数，创建后立即连接服务器
+    def __init__(self, host, port, timeout=10):
+        self.host = host
+        self.port = port
+        # 创建一个socket对象，连接到FTP服务器
+        self.sock = socket.create_connection((host, port), timeout)
+        # 开启TCP保活探测，服务器掉线后能及时发现
+        net_utils.enable_keepalive(self.sock)
+        # 接收服务器的欢迎消息
+        self.welcome = self.sock.recv(BUFFER_SIZE).decode()
+        # 增加一些属性，用于存储会话令牌、当前目录和断点
+        self.token = ''
+        self.current_dir = ''
+        self.breakpoint = 0
+        # 增加一个属性，用于存储下一条流水线请求的编号
+        self.next_id = 1
+
+    # 接收一条响应的方法，先阻塞接收一部分，再把已经到达的数据全部读完
+    def read_response(self):
+        response = self.sock.recv(BUFFER_SIZE)
+        while True:
+            readable, _, _ = select.select([self.sock], [], [], 0)
+            if not readable:
+                break
+            data = self.sock.recv(BUFFER_SIZE)
+            if not data:
+                break
+            response += data
+        return response.decode()
+
+    # 接收一条二进制列表响应的方法，一直接收到列表完整为止，返回字节串
+    def read_binary_response(self):
+        response = self.sock.recv(BUFFER_SIZE)
+        while response and not binary_listing.is_response_complete(response):
+            data = self.sock.recv(BUFFER_SIZE)
+            if not data:
+                break
+            response += data
+        return response
+
+    # 发送命令并返回响应的方法，不能用于get和put这类带文件数据的命令
+    def send_command(self, command):
+        self.sock.send(command.encode())
+        return self.read_response()
+
+    # 用流水线模式发送多条命令的方法，一次发送所有命令，再读取所有响应，返回和命令顺序一致的响应列表
+    # 只能用于不带文件数据的命令，如cd、ls、restart；ls -b和lsv -b命令的响应是字节串，其他命令的响应是字符串
+    def pipeline(self, commands):
+        ids, data = pipeline.encode_requests(commands, self.next_id)
+        self.next_id += len(commands)
+        self.sock.sendall(data)
+        responses = pipeline.read_responses(self.sock, len(commands))
+        results = [responses[request_id] if binary_listing.is_binary_command(command) else responses[request_id].decode()
+                   for command, request_id in zip(commands, ids)]
+        # 按响应更新会话的状态
+        for command, response in zip(commands, results):
+            if isinstance(response, bytes):
+                self.current_dir = binary_listing.response_directory(response) or self.current_dir
+            elif command == 'ls':
+                self.current_dir = response.split('\n', 1)[0]
+            elif command.startswith('lsv') and '\n' in response:
+                self.current_dir = response.split('\n', 2)[1]
+            elif command.startswith('cd') and response.startswith('OK'):
+                self.current_dir = response.split(' ', 1)[1]
+            elif command.startswith('restart') and response.isdigit():
+                self.breakpoint = int(response)
+        return results
+
+    # 登录的方法，返回一个布尔值，表示是否登录成功
+    def login(self, username, password):
+        response = self.send_command(f'login {username} {password}')
+        if response.startswith('OK') and len(response.split(' ')) > 2:
+            self.token = response.split(' ')[2]
+        return response.startswith('OK')
+
+    # 注册的方法，返回一个布尔值，表示是否注册成功
+    def register(self, username, password):
+        return self.send_command(f'register {username} {password}').startswith('OK')
+
+    # 列出当前目录的方法，返回当前目录和文件列表的原始文本
+    def ls(self):
+        response = self.send_command('ls')
+        self.current_dir = response.split('\n', 1)[0]
+        return response
+
+    # 按缓存的版本号列出当前目录的方法，返回原始响应，可以交给listing_cache.ListingCache的apply方法处理
+    def lsv(self, version=listing_cache.NO_VERSION):
+        response = self.send_command('lsv ' + version)
+        if '\n' in response:
+            self.current_dir = response.split('\n', 2)[1]
+        return response
+
+    # 用二进制格式列出当前目录的方法，返回当前目录和(类型, 大小, 修改时间, 名称)的列表
+    def ls_binary(self):
+        self.sock.send(('ls ' + binary_listing.BINARY_OPTION).encode())
+        response = self.read_binary_response()
+        if not response.startswith(binary_listing.MAGIC):
+            raise IOError(response.decode('utf-8', 'replace'))
+        self.current_dir, entries, _ = binary_listing.decode(response)
+        return self.current_dir, entries
+
+    # 按缓存的版本号用二进制格式列出当前目录的方法，返回原始响应，可以交给listing_cache.ListingCache的apply方法处理
+    def lsv_binary(self, version=listing_cache.NO_VERSION):
+        self.sock.send(f'lsv {binary_listing.BINARY_OPTION} {version}'.encode())
+        response = self.read_binary_response()
+        self.current_dir = binary_listing.response_directory(response) or self.current_dir
+        return response
+
+    # 切换目录的方法，返回一个布尔值，表示是否切换成功
+    def cd(self, path):
+        response = self.send_command('cd ' + path)
+        if response.startswith('OK'):
+            self.current_dir = response.split(' ', 1)[1]
+            return True
+        return False
+
+    # 查询多个路径的元数据的方法，返回一个字典列表，包括类型、大小、修改时间、哈希值和路径
+    # compute为True时，服务器会计算还没有缓存的哈希值，文件很大时比较慢
+    # 路径很多时命令会超过服务器一次接收的缓冲区，所以用流水线模式发送，服务器会一直接收到换行符为止
+    def mstat(self, paths, compute=False):
+        option = '-h ' if compute else ''
+        response = self.pipeline([f'mstat {option}' + file_meta.SEPARATOR.join(paths)])[0]
+        if not response.startswith('OK'):
+            raise IOError(response)
+        return file_meta.parse_response(response)
+
+    # 查询一个路径的元数据的方法
+    def stat(self, path, compute=False):
+        return self.mstat([path], compute)[0]
+
+    # 查找文件的方法，返回一个生成器，边接收边逐条产生相对于当前目录的路径，目录以/结尾
+    # regex为True时pattern是正则表达式，否则是通配符；limit为0表示不限制条数；必须把结果读完才能发送下一条命令
+    def find(self, pattern, regex=False, limit=0):
+        options = ('-r ' if regex else '') + (f'-n {limit} ' if limit else '')
+        self.sock.send(f'find {options}{pattern}'.encode())
+        buffer = b''
+        started = False
+        while True:
+            data = self.sock.recv(BUFFER_SIZE)
+            if not data:
+                raise ConnectionError('服务器断开')
+            buffer += data
+            if not started:
+                if buffer.startswith(b'ERROR'):
+                    raise IOError(buffer.decode())
+                if b'\n' not in buffer:
+                    continue
+                buffer = buffer.split(b'\n', 1)[1]
+                started = True
+            *lines, buffer = buffer.split(b'\n')
+            for line in lines:
+                if line.startswith(file_index.END_MARK.encode()):
+                    return
+                yield line.decode()
+
+    # 设置断点的方法
+    def restart(self, breakpoint):
+        self.breakpoint = int(self.send_command(f'restart {breakpoint}'))
+        return self.breakpoint
+
+    # 下载文件的方法，local_path为None时丢弃收到的数据，返回本次接收的字节数
+    # passive为True时通过单独的数据连接接收，控制连接在收到响应后就空闲了
+    def get(self, filename, local_path=None, passive=False):
+        if passive:
+            return self.get_passive(filename, local_path)
+        self.sock.send(('get ' + filename).encode())
+        data = self.sock.recv(BUFFER_SIZE)
+        # 响应的格式是OK 文件大小 文件名，文件数据紧跟在后面，可能和响应在同一次recv中到达
+        if not data.startswith(b'OK '):
+            raise FileNotFoundError(data.decode())
+        size_end = data.index(b' ', 3)
+        filesize = int(data[3:size_end])
+        header_end = size_end + 1 + len(filename.encode())
+        # 文件名还没有完整到达时，继续接收
+        while len(data) < header_end:
+            data += self.sock.recv(BUFFER_SIZE)
+        pending = data[header_end:]
+        remaining = filesize - self.breakpoint
+        f = net_utils.open_download(local_path, self.breakpoint) if local_path else None
+        try:
+            while remaining > 0:
+                if not pending:
+                    pending = self.sock.recv(min(BUFFER_SIZE, remaining))
+                    if not pending:
+                        raise ConnectionError('服务器断开')
+                if f:
+                    f.write(pending)
+                remaining -= len(pending)
+                pending = b''
+        finally:
+            if f:
+                f.close()
+        return filesize - self.breakpoint
+
+    # 通过数据连接下载文件的方法，服务器把断点交给这次传输后清零，会话的断点也同步清零
+    def get_passive(self, filename, local_path=None):
+        response = self.send_command(f'get {data_channel.PASSIVE_OPTION} {filename}')
+        if not response.startswith('OK'):
+            raise FileNotFoundError(response)
+        filesize, port, key, _ = data_channel.parse_get_reply(response)
+        breakpoint, self.breakpoint = self.breakpoint, 0
+        with data_channel.connect(self.host, port, key) as data_sock:
+            if local_path:
+                with net_utils.open_download(local_path, breakpoint) as f:
+                    net_utils.recv_buffer().recv_into_file(data_sock, f, filesize - breakpoint, breakpoint)
+            else:
+                remaining = filesize - breakpoint
+                while remaining > 0:
+                    data = data_sock.recv(min(BUFFER_SIZE, remaining))
+                    if not data:
+                        raise ConnectionError('数据连接断开')
+                    remaining -= len(data)
+        return filesize - breakpoint
+
+    # 上传文件的方法，返回本次发送的字节数，dedup为True时先发送文件的哈希值，服务器已有相同内容时不发送数据
+    # passive为True时通过单独的数据连接发送
+    def put(self, local_path, dedup=False, passive=False):
+        if passive:
+            return self.put_passive(local_path, dedup)
+        if dedup:
+            response = self.send_command(f'put -h {upload_store.file_digest(local_path).hexdigest()} {local_path}')
+            if response.startswith('EXISTS'):
+                return 0
+        else:
+            response = self.send_command('put ' + local_path)
+        if not response.startswith('OK'):
+            raise IOError(response)
+        filesize = os.path.getsize(local_path)
+        # 发送文件大小，以换行符结尾
+        self.sock.send((str(filesize) + '\n').encode())
+        with open(local_path, 'rb') as f:
+            f.seek(self.breakpoint)
+            while True:
+                data = f.read(BUFFER_SIZE)
+                if not data:
+                    break
+                self.sock.sendall(data)
+        return filesize - self.breakpoint
+
+    # 通过数据连接上传文件的方法，发送完毕后关闭发送方向，等服务器保存好文件并回复OK才返回，失败时抛出IOError
+    def put_passive(self, local_path, dedup=False):
+        option = f'-h {upload_store.file_digest(local_path).hexdigest()} ' if dedup else ''
+        response = self.send_command(f'put {data_channel.PASSIVE_OPTION} {option}{local_path}')
+        if response.startswith('EXISTS'):
+            self.breakpoint = 0
+            return 0
+        if not response.startswith('OK'):
+            raise IOError(response)
+        port, key, _ = data_channel.parse_put_reply(response)
+        breakpoint, self.breakpoint = self.breakpoint, 0
+        filesize = os.path.getsize(local_path)
+        with data_channel.connect(self.host, port, key) as data_sock, open(local_path, 'rb') as f:
+            data_sock.sendall((str(filesize) + '\n').encode())
+            f.seek(breakpoint)
+            while True:
+                data = f.read(BUFFER_SIZE)
+                if not data:
+                    break
+                data_sock.sendall(data)
+            data_sock.shutdown(socket.SHUT_WR)
+            # 等服务器保存好文件并回复OK，失败时抛出IOError
+            data_channel.read_upload_status(data_sock)
+        return filesize - breakpoint
+
+    # 检查连接是否可用的方法，服务器只回复OK，不改变会话的状态
+    def noop(self):
+        return self.send_command('noop') == 'OK'
+
+    # 退出的方法，发送quit命令并关闭socket
+    def quit(self):
+        try:
+            self.sock.send('quit'.encode())
+        finally:
+            self.sock.close()
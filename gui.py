@@ -4,6 +4,7 @@
 import socket
 import os
 import html
+import time
 from PySide6.QtWidgets import (
     QApplication,
     QWidget,
@@ -12,7 +13,6 @@ from PySide6.QtWidgets import (
     QLineEdit,
     QPushButton,
     QFileDialog,
-    QProgressBar,
     QMessageBox,
     QListWidget,  # 新增
     QListWidgetItem,  # 新增
@@ -34,10 +34,14 @@ from PySide6.QtWidgets import (
 from PySide6.QtCore import Qt, Signal, QSize
 # 导入QAction
 from PySide6.QtGui import QAction, QTextCursor, QFont
+# 导入二进制列表模块，用于把文本格式的列表条目转换为和二进制格式相同的元组
+import binary_listing
 # 导入UserInput类，这是一个自定义的输入框控件，用于接收用户的命令
 from user_input import UserInput
 # 导入ChangelogDialog类，这是一个自定义的对话框控件，用于显示各种信息
 from info_dialog import InfoDialog
+# 导入ThroughputGraph类，这是一个自定义的吞吐量曲线控件，用于在状态栏中显示传输的实时速度
+from throughput_graph import ThroughputGraph
 
 # 定义一个常量，用于存储Changelog的内容
 CHANGELOG = """
@@ -94,9 +98,9 @@ HELP = """
 本文档是FTP客户端的使用指南，介绍了它的主要功能和操作步骤：
 - 左侧文件列表显示当前目录的内容，双击文件夹可进入，双击文件可下载，双击返回项可回到上级目录。右键单击文件，即可弹出菜单，显示文件的大小
 - 右上控制台呈现FTP客户端的输出，如命令结果，传输信息，错误提示等
-- 右下输入框可输入FTP命令，如ls, cd, get, put等。Ctrl+Enter换行，Enter或发送按钮执行。发送按钮菜单可选Enter或Ctrl+Enter发送模式
-- 状态栏位于窗口的底部，用一个进度条展示文件传输的百分比。另外一个标签显示取消下载后释放缓冲区的状态。一个按钮可以切换传输的暂停或继续
-- 菜单栏提供了菜单选项，点击后可弹出Changelog或帮助对话框，分别展示程序的更新日志和功能说明
+- 右下输入框可输入FTP命令，如ls, cd, get, put等。getdir和putdir命令可以把整个目录作为一个归档流下载或上传，加上-z选项可以压缩传输。多行命令全部是ls、lsv、cd、restart、limit、stat、mstat、find时，会用流水线模式一次发送，不再逐条等待响应。stat和mstat命令查询文件的类型、大小、修改时间和哈希值，mstat的多个路径用制表符分隔，加上-h选项会计算还没有缓存的哈希值。find命令在当前目录下递归查找文件，例如find *.txt，加上-r选项按正则表达式查找，-n 条数限制结果的条数。客户端会缓存最近浏览过的目录列表，切换目录时先显示缓存，再用lsv命令带上缓存的版本号向服务器确认，列表没有变化时服务器只回复NOTMODIFIED，有少量变化时只发送增加和删除的条目。ls -b和lsv -b命令用二进制格式返回目录列表，条目带有修改时间，文件名中的空格和换行符不会影响解析。get和put命令默认通过单独的数据连接传输文件，传输期间可以继续浏览目录和执行其他命令，也可以同时开始其他传输。Ctrl+Enter换行，Enter或发送按钮执行。发送按钮菜单可选Enter或Ctrl+Enter发送模式
+- 状态栏位于窗口的底部，用一条吞吐量曲线展示正在进行的传输的实时速度，同时显示传输的百分比、当前速度和停顿次数。另外一个标签显示取消下载后释放缓冲区的状态，登录后取消下载时服务器会立即停止发送，只需要丢弃已经在途中的数据。一个按钮可以切换传输的暂停或继续
+- 菜单栏提供了菜单选项，点击后可弹出Changelog或帮助对话框，分别展示程序的更新日志和功能说明。导出传输统计可以把本次会话中每次传输的字节数、用时、续传起点、吞吐量时间线和停顿保存为CSV或JSON文件
 """
 
 # 定义一个常量字典，把图标的名字和对应的QStyle值映射起来
@@ -116,6 +120,8 @@ class FTPClientGUI(QMainWindow):
     icon_signal = Signal(str)
     # 定义一个信号，用于在主线程中弹出文件对话框，并传递文件名给子线程
     file_dialog_signal = Signal(str)
+    # 定义一个信号，用于在主线程中弹出目录对话框，并传递目录名给子线程
+    dir_dialog_signal = Signal(str)
     # 定义一个信号，用于在主线程中弹出错误提示框，并传递错误信息给子线程
     error_signal = Signal(str)
     # 定义一个信号，用于在子线程中发送命令的执行结果，True表示成功，False表示失败
@@ -126,6 +132,8 @@ class FTPClientGUI(QMainWindow):
     output_signal = Signal(str)
     # 定义一个信号，用于传递服务器信息的字符串
     server_info_signal = Signal(str)
+    # 定义一个信号，用于在子线程中准备好一条命令后，回到主线程发送
+    command_signal = Signal(str)
 
 
     # 初始化方法
@@ -161,11 +169,14 @@ class FTPClientGUI(QMainWindow):
         self.changelog_action = self.menu.addAction("Changelog", self.show_changelog)
         # 增加一个菜单项对象，在addAction方法里传入一个槽函数，用于显示帮助
         self.help_action = self.menu.addAction("帮助", self.show_help)
+        # 增加一个菜单项对象，用于把本次会话的传输统计导出为CSV或JSON文件
+        self.export_stats_action = self.menu.addAction("导出传输统计", self.export_stats)
         # 把菜单添加到菜单栏中
         self.menu_bar.addMenu(self.menu)
         # 设置菜单项的角色为应用程序特定的角色，以便在MacOS上显示
         self.changelog_action.setMenuRole(QAction.MenuRole.ApplicationSpecificRole)
         self.help_action.setMenuRole(QAction.MenuRole.ApplicationSpecificRole)
+        self.export_stats_action.setMenuRole(QAction.MenuRole.ApplicationSpecificRole)
 
         # 创建一个标签对象，用于显示当前的目录
         self.dir_label = QLabel("当前目录：")
@@ -197,8 +208,8 @@ class FTPClientGUI(QMainWindow):
 
         # 创建一个标签对象，用于显示进度条
         self.progress_label = QLabel("传输进度：")
-        # 创建一个进度条对象，用于显示传输进度
-        self.progress_bar = QProgressBar()
+        # 创建一个吞吐量曲线对象，用于显示传输进度和实时的传输速度
+        self.progress_bar = ThroughputGraph(ftp_client.stats)
         # 增加一个按钮对象，用于断开和重新连接
         self.connect_button = QPushButton()
         # 修改按钮对象的图标，用视频的暂停和继续的图标
@@ -325,7 +336,7 @@ class FTPClientGUI(QMainWindow):
         self.status_bar = QStatusBar()
         # 把清空进度标签对象添加到状态栏中
         self.status_bar.addWidget(self.clear_label)
-        # 把进度条添加到状态栏中，设置其比例为1，表示占据状态栏的大部分空间
+        # 把吞吐量曲线添加到状态栏中，设置其比例为1，表示占据状态栏的大部分空间
         self.status_bar.addWidget(self.progress_bar, 1)
         # 把连接按钮添加到状态栏中，设置其为永久部件，表示不会被其他部件替换
         self.status_bar.addPermanentWidget(self.connect_button)
@@ -424,9 +435,10 @@ class FTPClientGUI(QMainWindow):
         self.init_button.clicked.connect(self.init_data)
 
         # 绑定信号和槽函数
-        # 绑定进度信号到进度条的setValue方法，用于更新进度条的值
+        # 绑定进度信号到吞吐量曲线的setValue方法，用于更新没有传输记录时的进度
         self.progress_signal.connect(self.progress_bar.setValue)
         self.file_dialog_signal.connect(self.show_file_dialog)
+        self.dir_dialog_signal.connect(self.show_dir_dialog)
         self.error_signal.connect(self.show_error)
         self.icon_signal.connect(self.change_icon)
         # 把信号和一个槽函数连接起来，用于处理命令的执行结果
@@ -437,6 +449,8 @@ class FTPClientGUI(QMainWindow):
         self.output_signal.connect(self.write_output)
         # 把信号和一个槽函数连接起来，用于更新服务器信息标签的文本
         self.server_info_signal.connect(self.change_server_info)
+        # 把信号和一个槽函数连接起来，用于在主线程中发送子线程准备好的命令
+        self.command_signal.connect(self.send_prepared_command)
 
         # 绑定列表控件的双击事件到一个槽函数，用于处理双击文件或目录的操作
         self.file_list.itemDoubleClicked.connect(self.double_click_file)
@@ -482,6 +496,11 @@ class FTPClientGUI(QMainWindow):
             self.index = 0
             # 清空输入框中的内容
             self.input_edit.clear()
+            # 如果有多条命令，并且都是不带文件数据的命令，就用流水线模式一次发送，不再逐条等待响应
+            if self.ftp_client.can_pipeline(self.commands):
+                self.ftp_client.send_pipeline(self.commands)
+                self.commands = []
+                return
             # 调用一个方法，用于执行命令
             self.execute_command()
         else:
@@ -503,6 +522,10 @@ class FTPClientGUI(QMainWindow):
             # 把命令列表清空
             self.commands = []
 
+    # 发送子线程准备好的命令的方法，例如算好哈希值的put命令，命令的执行结果仍然由result信号通知
+    def send_prepared_command(self, command):
+        self.ftp_client.send_command(command)
+
     # 处理命令的执行结果的方法
     def handle_result(self, result):
         # 如果结果为True，说明命令执行成功
@@ -533,16 +556,20 @@ class FTPClientGUI(QMainWindow):
         # 调用父类的closeEvent方法，完成窗口关闭的操作
         super().closeEvent(event)
 
-    # 更新当前目录和文件列表的方法
+    # 更新当前目录和文件列表的方法，response是ls命令的文本响应
     def update_dir_and_file(self, response):
         # 把响应分割为两部分，第一部分是当前目录，第二部分是文件列表
         dir, file = response.split("\n", 1)
+        # 把文件列表用换行符分割成一个列表，空目录没有任何条目，再把每个条目转换为(类型, 大小, 修改时间, 名称)
+        files = file.split('\n') if file else []
+        self.show_entries(dir, [binary_listing.parse_text_entry(file, dir) for file in files])
+
+    # 显示当前目录和文件列表的方法，entries是(类型, 大小, 修改时间, 名称)的列表，文本和二进制格式的列表共用
+    def show_entries(self, dir, entries):
         # 把当前目录赋值给属性
         self.ftp_client.current_dir = dir
         # 把当前目录显示在文本框中
         self.dir_edit.setText(self.ftp_client.current_dir)
-        # 把文件列表显示在文本框中
-        # self.file_edit.setText(file)
         # 清空列表控件中的所有项目
         self.file_list.clear()
         # 创建一个列表项目对象，用于显示返回上级目录的选项
@@ -553,27 +580,25 @@ class FTPClientGUI(QMainWindow):
         back_item.setData(Qt.UserRole, 'back') 
         # 把项目添加到列表控件的最上边
         self.file_list.insertItem(0, back_item)
-        # 把文件列表用换行符分割成一个列表，赋值给files
-        files = file.split('\n')
         # 创建两个空列表，用于存储目录和文件
         dirs = []
         file_items = []
-        # 循环遍历文件列表
-        for file in files:
-            # 如果当前目录是\\，就说明是所有磁盘，就直接显示磁盘名
-            if self.ftp_client.current_dir == '\\':
+        # 循环遍历条目列表
+        for kind, size, mtime, name in entries:
+            # 如果是磁盘，就直接显示磁盘名
+            if kind == binary_listing.DRIVE:
                 # 创建一个列表项目对象，用于显示磁盘名
-                item = QListWidgetItem(file)
+                item = QListWidgetItem(name)
                 # 设置项目的图标为一个磁盘的图标
                 item.setIcon(self.style().standardIcon(QStyle.SP_DriveHDIcon))
                 # 设置项目的类型为磁盘
                 item.setData(Qt.UserRole, 'drive') 
                 # 把项目添加到目录列表中
                 dirs.append(item)
-            # 如果文件名以\结尾，说明是一个目录
-            elif file.endswith('\\'):
-                # 创建一个列表项目对象，用于显示目录名，去掉结尾的\
-                item = QListWidgetItem(file.rstrip('\\'))
+            # 如果是一个目录
+            elif kind == binary_listing.DIR:
+                # 创建一个列表项目对象，用于显示目录名
+                item = QListWidgetItem(name)
                 # 设置项目的图标为一个文件夹的图标
                 item.setIcon(self.style().standardIcon(QStyle.SP_DirIcon))
                 # 设置项目的类型为目录
@@ -582,22 +607,16 @@ class FTPClientGUI(QMainWindow):
                 dirs.append(item)
             # 否则，说明是一个文件
             else:
-                # 把文件名分割为两部分，第一部分是文件大小（字节），第二部分是文件名
-                size, filename = file.split(' ', 1)
-                # 把文件大小转换为整数
-                size = int(size)
-                # 调用一个函数，根据文件大小选择合适的单位，并返回一个格式化的字符串
-                size_str = self.ftp_client.format_size(size)
-                # 把文件名和文件大小拼接起来，用括号分隔
-                file = filename
-                # 创建一个列表项目对象，用于显示文件名和文件大小
-                item = QListWidgetItem(file)
+                # 创建一个列表项目对象，用于显示文件名
+                item = QListWidgetItem(name)
                 # 设置项目的图标为一个文件的图标
                 item.setIcon(self.style().standardIcon(QStyle.SP_FileIcon))
                 # 设置项目的类型为文件
                 item.setData(Qt.UserRole, 'file') 
                 # 设置项目的文件大小属性为字节单位的大小
                 item.setData(Qt.UserRole + 1, size)
+                # 设置项目的修改时间属性，文本格式的列表没有修改时间，为0
+                item.setData(Qt.UserRole + 2, mtime)
                 # 把项目添加到文件列表中
                 file_items.append(item)
         # 把目录列表和文件列表合并起来，赋值给items
@@ -660,6 +679,13 @@ class FTPClientGUI(QMainWindow):
         else:
             self.ftp_client.file_queue.put("")
 
+    # 定义一个槽函数，用于弹出目录对话框，让用户选择下载目录的保存位置，并把结果放入队列中
+    def show_dir_dialog(self, dirname):
+        # 弹出一个目录选择对话框，目录会被解包到所选位置下的同名目录中
+        target = QFileDialog.getExistingDirectory(self, f"选择{dirname}的保存位置", ".")
+        # 如果用户没有选择目录，就把一个空字符串放入队列中
+        self.ftp_client.dir_queue.put(target or "")
+
     # 定义一个槽函数，用于接收信号的参数，并弹出错误提示框
     def show_error(self, error):
         # 创建一个消息框对象，设置标题，图标，文本，按钮等属性
@@ -756,8 +782,9 @@ class FTPClientGUI(QMainWindow):
                 self.ftp_client.sock.close()
             # 否则，如果已经中断传输，就重新创建一个socket，重新连接服务器
             else:
-                self.ftp_client.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-                self.ftp_client.connect_server()
+                self.ftp_client.sock = self.ftp_client.new_socket()
+                # 重新连接服务器，如果持有会话令牌，就一次性恢复用户、目录和断点
+                resumed = self.ftp_client.connect_server(resume=True)
                 # 弹出一个消息框对象，询问用户是否要续传文件
                 msg_box = QMessageBox()
                 msg_box.setWindowTitle('续传文件')
@@ -768,7 +795,9 @@ class FTPClientGUI(QMainWindow):
                 choice = msg_box.exec_()
                 # 如果用户选择是，就继续上传或下载文件
                 if choice == QMessageBox.Yes:
-                    self.set_breakpoint()
+                    # 会话恢复成功时断点已经同步，否则需要重新设置断点
+                    if not resumed:
+                        self.set_breakpoint()
                     if self.ftp_client.sent > 0:
                         self.ftp_client.send_command("put " + self.ftp_client.filename)
                     elif self.ftp_client.received > 0:
@@ -809,6 +838,17 @@ class FTPClientGUI(QMainWindow):
         # 显示ChangelogDialog
         self.changelog_dialog.show()
 
+    # 定义一个槽函数，用于弹出文件对话框，把传输统计导出为CSV或JSON文件
+    def export_stats(self):
+        filename, _ = QFileDialog.getSaveFileName(self, "导出传输统计", "transfer_stats.json", "JSON文件 (*.json);;CSV文件 (*.csv)")
+        if not filename:
+            return
+        try:
+            self.ftp_client.stats.export(filename)
+            self.write_output(f"<font color='purple'>传输统计已导出到{filename}</font>")
+        except OSError as e:
+            self.show_error(f"导出传输统计失败：{e}")
+
     # 定义一个槽函数，用于显示帮助对话框
     def show_help(self):
         # 创建一个InfoDialog对象，把"帮助"和HELP作为参数传递给它
@@ -832,13 +872,18 @@ class FTPClientGUI(QMainWindow):
 
     # 定义一个槽函数，用于弹出文件大小的框
     def show_size(self, item):
-        # 获取项目的文件大小
+        # 获取项目的文件大小和修改时间，它们是列目录时得到的，不需要在界面线程中等待服务器的响应
+        # 列表已经由lsv命令确认过是最新的，需要实时的大小时可以在命令框中执行stat命令
         size = item.data(Qt.UserRole + 1)
+        mtime = item.data(Qt.UserRole + 2)
+        text = f'{item.text()}的大小为{size}字节'
+        if mtime:
+            text += f"，修改时间为{time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(mtime))}"
         # 创建一个消息框对象，设置标题，图标，文本，按钮等属性
         msg_box = QMessageBox()
         msg_box.setWindowTitle('文件大小')
         msg_box.setIcon(QMessageBox.Information)
-        msg_box.setText(f'{item.text()}的大小为{size}字节')
+        msg_box.setText(text)
         msg_box.setStandardButtons(QMessageBox.Ok)
         # 显示消息框
         msg_box.exec_()
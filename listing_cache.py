@@ -0,0 +1,160 @@
+# listing_cache.py
+# 这是一个目录列表缓存模块，用于实现lsv命令，客户端带上自己缓存的列表版本号请求当前目录的列表
+# 服务器对比版本号，列表没有变化时只回复NOTMODIFIED，变化不大时只发送增加和删除的条目，否则发送完整的列表
+# 客户端按目录路径缓存最近使用的列表，来回切换目录时可以立即显示缓存的列表，再用lsv命令确认是否有变化
+# lsv -b命令的响应在状态行之后是一个二进制列表，增量中被删除的条目带有删除标记
+import hashlib
+import threading
+from collections import OrderedDict
+import binary_listing
+import metrics
+
+# 定义一些常量
+HISTORY_SIZE = 256 # 服务器保存的历史列表数，客户端的版本号在其中时才能发送增量
+CACHE_SIZE = 128 # 客户端缓存的目录列表数
+NO_VERSION = '-' # 客户端没有缓存时发送的版本号
+
+
+# 计算列表版本号的函数，版本号是排序后的条目的哈希值，和os.listdir返回的顺序无关
+# 条目可以是文本格式的字符串，也可以是二进制格式的元组，都包括文件大小，文件被覆盖写入后大小变化，版本号也会变化
+def listing_version(entries):
+    return hashlib.blake2b('\n'.join(sorted(map(str, entries))).encode('utf-8', 'surrogateescape'), digest_size=8).hexdigest()
+
+
+# 计算两个列表之间的增量的函数，返回删除的条目和增加的条目，大小变化的文件两者都有
+def make_delta(old, new):
+    old_set, new_set = set(old), set(new)
+    return [entry for entry in old if entry not in new_set], [entry for entry in new if entry not in old_set]
+
+
+# 把增量应用到列表上的函数，返回新的列表
+def apply_delta(entries, removed, added):
+    removed = set(removed)
+    return [entry for entry in entries if entry not in removed] + list(added)
+
+
+# 定义一个历史列表类，在服务器上保存最近发送过的列表，用于计算增量
+class ListingHistory:
+
+    # 初始化方法，接受最多保存的列表数作为参数
+    def __init__(self, size=HISTORY_SIZE):
+        self.size = size
+        self.lock = threading.Lock()
+        # 键是(目录, 版本号)，值是条目的元组，按最近使用的顺序排列
+        self.listings = OrderedDict()
+
+    # 对比客户端缓存的版本的方法，entries是当前目录最新的条目列表，client_version是客户端缓存的版本号
+    # 返回(状态, 版本号, 内容)，状态是NOTMODIFIED、DELTA或FULL，DELTA的内容是(删除的条目, 增加的条目)，FULL的内容是完整的列表
+    def compare(self, directory, entries, client_version):
+        version = listing_version(entries)
+        with self.lock:
+            self.listings[(directory, version)] = tuple(entries)
+            self.listings.move_to_end((directory, version))
+            old = self.listings.get((directory, client_version))
+            while len(self.listings) > self.size:
+                self.listings.popitem(last=False)
+        if client_version == version:
+            metrics.CACHE_REQUESTS.inc(1, ('listing', 'hit'))
+            return 'NOTMODIFIED', version, None
+        # 增量的条数比完整列表少时才发送增量
+        if old is not None:
+            removed, added = make_delta(old, entries)
+            if len(removed) + len(added) < len(entries):
+                metrics.CACHE_REQUESTS.inc(1, ('listing', 'delta'))
+                return 'DELTA', version, (removed, added)
+        metrics.CACHE_REQUESTS.inc(1, ('listing', 'miss'))
+        return 'FULL', version, entries
+
+    # 生成lsv命令的文本响应的方法，entries是文本格式的条目
+    # 响应的第一行是NOTMODIFIED 版本号、DELTA 新版本号 旧版本号或FULL 版本号，第二行是当前目录，之后每行一个条目或增量
+    # 增量中-开头的是删除的条目，+开头的是增加的条目
+    def response(self, directory, entries, client_version):
+        status, version, content = self.compare(directory, entries, client_version)
+        if status == 'NOTMODIFIED':
+            return f'NOTMODIFIED {version}\n{directory}'
+        if status == 'DELTA':
+            removed, added = content
+            return f'DELTA {version} {client_version}\n{directory}\n' + '\n'.join(['-' + entry for entry in removed] + ['+' + entry for entry in added])
+        return f'FULL {version}\n{directory}\n' + '\n'.join(entries)
+
+    # 生成lsv -b命令的二进制响应的方法，entries是(类型, 大小, 修改时间, 名称)的列表
+    # 第一行和文本响应相同，之后是一个二进制列表，NOTMODIFIED时列表为空，只带有当前目录
+    def binary_response(self, directory, entries, client_version):
+        status, version, content = self.compare(directory, entries, client_version)
+        if status == 'NOTMODIFIED':
+            return f'NOTMODIFIED {version}\n'.encode() + binary_listing.encode(directory, [])
+        if status == 'DELTA':
+            removed, added = content
+            return f'DELTA {version} {client_version}\n'.encode() + binary_listing.encode(directory, added, removed)
+        return f'FULL {version}\n'.encode() + binary_listing.encode(directory, entries)
+
+
+# 定义一个列表缓存类，在客户端按目录路径缓存列表，按最近使用的顺序淘汰
+# 缓存的条目统一是(类型, 大小, 修改时间, 名称)的元组，文本格式的响应会先转换为元组
+class ListingCache:
+
+    # 初始化方法，接受最多缓存的列表数作为参数
+    def __init__(self, size=CACHE_SIZE):
+        self.size = size
+        self.lock = threading.Lock()
+        # 键是目录，值是(版本号, 条目列表)
+        self.listings = OrderedDict()
+
+    # 获取某个目录缓存的版本号的方法，没有缓存时返回NO_VERSION
+    def version(self, directory):
+        with self.lock:
+            entry = self.listings.get(directory)
+        return entry[0] if entry else NO_VERSION
+
+    # 获取某个目录缓存的条目列表的方法，没有缓存时返回None
+    def get(self, directory):
+        with self.lock:
+            entry = self.listings.get(directory)
+            if entry is None:
+                return None
+            self.listings.move_to_end(directory)
+            return entry[1]
+
+    # 保存一个目录的列表的方法
+    def put(self, directory, version, entries):
+        with self.lock:
+            self.listings[directory] = (version, entries)
+            self.listings.move_to_end(directory)
+            while len(self.listings) > self.size:
+                self.listings.popitem(last=False)
+
+    # 删除一个目录的缓存的方法，客户端自己修改了目录（例如上传文件）后调用
+    def forget(self, directory):
+        with self.lock:
+            self.listings.pop(directory, None)
+
+    # 处理lsv或lsv -b命令的响应的方法，文本响应是字符串，二进制响应是字节串
+    # 更新缓存，返回当前目录、条目列表以及列表是否有变化
+    # 响应和缓存对不上（例如缓存已被淘汰）时抛出ValueError，调用者应该不带版本号重新请求
+    def apply(self, response):
+        if isinstance(response, bytes):
+            header, _, data = response.partition(b'\n')
+            header = header.decode()
+            directory, added, removed = binary_listing.decode(data) if data else ('', [], [])
+        else:
+            header, _, body = response.partition('\n')
+            directory, _, lines = body.partition('\n')
+            lines = lines.split('\n') if lines else []
+            if header.startswith('DELTA'):
+                removed = [binary_listing.parse_text_entry(line[1:], directory) for line in lines if line.startswith('-')]
+                added = [binary_listing.parse_text_entry(line[1:], directory) for line in lines if line.startswith('+')]
+            else:
+                removed, added = [], [binary_listing.parse_text_entry(line, directory) for line in lines]
+        parts = header.split(' ')
+        with self.lock:
+            entry = self.listings.get(directory)
+        if parts[0] == 'NOTMODIFIED' and entry and entry[0] == parts[1]:
+            return directory, self.get(directory), False
+        if parts[0] == 'DELTA' and entry and entry[0] == parts[2]:
+            entries = apply_delta(entry[1], removed, added)
+        elif parts[0] == 'FULL':
+            entries = added
+        else:
+            raise ValueError(header)
+        self.put(directory, parts[1], entries)
+        return directory, entries, True
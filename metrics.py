@@ -0,0 +1,198 @@
+# metrics.py
+# 这是一个监控指标模块，提供计数器、仪表和直方图三种指标，并通过本地HTTP端口以Prometheus文本格式输出
+# 指标的更新只是在锁内做几次加法，热点路径上的开销很小
+import bisect
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# 定义一个常量，用于存储默认的耗时直方图分桶，单位是秒
+TIME_BUCKETS = (0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 60)
+# 定义一个常量，用于存储吞吐量直方图的分桶，单位是字节/秒
+THROUGHPUT_BUCKETS = (64 * 1024, 256 * 1024, 1024 ** 2, 4 * 1024 ** 2, 16 * 1024 ** 2, 64 * 1024 ** 2, 256 * 1024 ** 2, 1024 ** 3)
+# 定义一个常量，用于存储目录条目数直方图的分桶
+SIZE_BUCKETS = (10, 100, 1000, 10000, 100000, 1000000)
+
+
+# 把标签名和标签值拼接成文本格式的函数，例如{verb="ls"}
+def format_labels(names, values, extra=''):
+    pairs = [f'{name}="{value}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+# 定义一个指标基类，存放名称、说明和标签名
+class Metric:
+    # 指标的类型，由子类覆盖
+    kind = 'untyped'
+
+    # 初始化方法，接受名称、说明和标签名作为参数
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        # 创建一个锁对象，用于保护下面的字典
+        self.lock = threading.Lock()
+        # 用一个字典存储每组标签值对应的数据
+        self.values = {}
+
+    # 生成文本格式的方法
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} {self.kind}']
+        with self.lock:
+            lines += self.render_samples()
+        return '\n'.join(lines)
+
+    # 生成样本行的方法，由子类实现
+    def render_samples(self):
+        return []
+
+
+# 定义一个计数器类，只能增加
+class Counter(Metric):
+    kind = 'counter'
+
+    # 增加计数的方法，labels是和标签名一一对应的标签值元组
+    def inc(self, amount=1, labels=()):
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    # 生成样本行的方法
+    def render_samples(self):
+        return [f'{self.name}{format_labels(self.labelnames, labels)} {value}' for labels, value in self.values.items()]
+
+
+# 定义一个仪表类，可以增加、减少或直接设置
+class Gauge(Counter):
+    kind = 'gauge'
+
+    # 减少数值的方法
+    def dec(self, amount=1, labels=()):
+        self.inc(-amount, labels)
+
+    # 直接设置数值的方法
+    def set(self, value, labels=()):
+        with self.lock:
+            self.values[labels] = value
+
+
+# 定义一个直方图类，统计观测值落在各个分桶中的次数、总和和总次数
+class Histogram(Metric):
+    kind = 'histogram'
+
+    # 初始化方法，比基类多一个分桶参数
+    def __init__(self, name, help_text, labelnames=(), buckets=TIME_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(buckets)
+
+    # 记录一个观测值的方法
+    def observe(self, value, labels=()):
+        # 在锁外先找到观测值所在的分桶，缩短持锁时间
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            data = self.values.get(labels)
+            if data is None:
+                # 每组标签对应[各分桶计数..., 超出最大分桶的计数, 总和]
+                data = self.values[labels] = [0] * (len(self.buckets) + 1) + [0]
+            data[index] += 1
+            data[-1] += value
+
+    # 生成样本行的方法，分桶计数需要转换为累计值
+    def render_samples(self):
+        lines = []
+        for labels, data in self.values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), data[:-1]):
+                cumulative += count
+                le = 'le="%s"' % bound
+                lines.append(f'{self.name}_bucket{format_labels(self.labelnames, labels, le)} {cumulative}')
+            lines.append(f'{self.name}_sum{format_labels(self.labelnames, labels)} {data[-1]}')
+            lines.append(f'{self.name}_count{format_labels(self.labelnames, labels)} {cumulative}')
+        return lines
+
+
+# 定义一个注册表类，用于集中管理所有指标
+class Registry:
+
+    # 初始化方法
+    def __init__(self):
+        self.metrics = []
+
+    # 注册指标的方法，返回指标本身，方便在定义时直接赋值
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    # 生成所有指标的文本格式的方法
+    def render(self):
+        return '\n'.join(metric.render() for metric in self.metrics) + '\n'
+
+
+# 创建一个全局的注册表对象
+REGISTRY = Registry()
+
+# 定义FTP服务器的各项指标
+COMMAND_SECONDS = REGISTRY.register(Histogram('ftp_command_seconds', '每个命令的处理耗时', ['verb']))
+BYTES_SENT = REGISTRY.register(Counter('ftp_bytes_sent_total', '发送给客户端的文件字节数'))
+BYTES_RECEIVED = REGISTRY.register(Counter('ftp_bytes_received_total', '从客户端接收的文件字节数'))
+ACTIVE_SESSIONS = REGISTRY.register(Gauge('ftp_active_sessions', '当前连接的客户端数'))
+TRANSFER_THROUGHPUT = REGISTRY.register(Histogram('ftp_transfer_throughput_bytes_per_second', '每次传输的平均吞吐量', ['direction'], THROUGHPUT_BUCKETS))
+LISTING_ENTRIES = REGISTRY.register(Histogram('ftp_listing_entries', '每次列目录返回的条目数', buckets=SIZE_BUCKETS))
+AUTH_SECONDS = REGISTRY.register(Histogram('ftp_auth_seconds', '登录验证的耗时', ['result']))
+CACHE_REQUESTS = REGISTRY.register(Counter('ftp_cache_requests_total', '各个缓存的查询次数', ['cache', 'result']))
+
+
+# 记录一次传输的字节数和吞吐量的函数，direction是get或put
+def observe_transfer(direction, size, duration):
+    (BYTES_SENT if direction == 'get' else BYTES_RECEIVED).inc(size)
+    if size > 0:
+        TRANSFER_THROUGHPUT.observe(size / max(duration, 0.000001), (direction,))
+
+
+# 合并多个进程的指标文本的函数，多进程模式下由主进程调用
+# 同名同标签的样本直接相加，计数器、直方图的分桶和仪表（例如连接数）相加后都是整个服务器的值
+def merge_texts(texts):
+    # 按指标名分组，值是(HELP和TYPE行, {样本名和标签: 数值})，保证同一个指标的样本排在一起
+    families = {}
+    for text in texts:
+        family = families.setdefault('', ([], {}))
+        for line in text.splitlines():
+            if not line:
+                continue
+            if line.startswith('#'):
+                family = families.setdefault(line.split(' ')[2], ([], {}))
+                if line not in family[0]:
+                    family[0].append(line)
+                continue
+            key, _, value = line.rpartition(' ')
+            family[1][key] = family[1].get(key, 0) + float(value)
+    lines = []
+    for headers, samples in families.values():
+        lines += headers
+        lines += [f'{key} {int(value) if value.is_integer() else value}' for key, value in samples.items()]
+    return '\n'.join(lines) + '\n'
+
+
+# 定义一个HTTP请求处理类，用于输出指标
+class MetricsHandler(BaseHTTPRequestHandler):
+
+    # 处理GET请求的方法，指标文本由HTTP服务器的render函数生成
+    def do_GET(self):
+        body = self.server.render().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    # 重写日志方法，不在控制台打印每次抓取的请求
+    def log_message(self, format, *args):
+        pass
+
+
+# 在后台线程中启动指标HTTP服务的函数，返回HTTP服务器对象，render是生成指标文本的函数，默认输出本进程的指标
+def start_http_server(port, host='127.0.0.1', render=None):
+    httpd = ThreadingHTTPServer((host, port), MetricsHandler)
+    httpd.render = render or REGISTRY.render
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    return httpd
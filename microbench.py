@@ -0,0 +1,282 @@
+# microbench.py
+# 这是一个微基准测试脚本，单独测量几个热点函数的性能：
+# FTPServer.list_dir（文本和二进制格式）、目录列表的解析、DBManager.query_user/insert_user、文件发送的分块循环和内存映射发送、各持久化策略下的文件接收和FTPClientGUI.update_dir_and_file
+# 每项测试重复多次，取每秒操作数的中位数，结果可以保存为JSON，用于判断某次修改对这些函数的影响
+# 用法：python microbench.py --entries 1000,100000 --rows 1000,100000 --buffers 1K,64K --output micro.json
+import argparse
+import json
+import os
+import shutil
+import socket
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+# 定义一些常量
+REPEAT = 5 # 每项测试重复的次数
+MIN_TIME = 0.2 # 每次重复至少运行的秒数，运行时间太短的测试会自动增加循环次数
+
+
+# 定义一个空socket类，只统计发送的字节数，用于隔离网络开销
+class NullSocket:
+
+    # 初始化方法
+    def __init__(self):
+        self.sent = 0
+
+    # 模拟socket的send方法
+    def send(self, data):
+        self.sent += len(data)
+        return len(data)
+
+    # 模拟socket的sendall方法
+    def sendall(self, data):
+        self.sent += len(data)
+
+
+# 测量一个函数每秒能执行多少次的函数，返回一个字典，包括中位数、最小值和最大值
+# items是每次调用处理的条目数，用于额外计算每秒处理的条目数
+def measure(func, items=1, repeat=REPEAT, min_time=MIN_TIME):
+    # 先运行一次，预热缓存，同时估算需要的循环次数
+    start = time.perf_counter()
+    func()
+    elapsed = time.perf_counter() - start
+    loops = max(1, int(min_time / elapsed) if elapsed > 0 else 1000)
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(loops):
+            func()
+        samples.append(loops / (time.perf_counter() - start))
+    median = statistics.median(samples)
+    return {
+        'ops_per_sec': round(median, 2),
+        'items_per_sec': round(median * items, 1),
+        'min_ops_per_sec': round(min(samples), 2),
+        'max_ops_per_sec': round(max(samples), 2),
+        'loops': loops,
+    }
+
+
+# 把带单位的大小字符串转换为整数的函数，例如1K、64K、1M
+def parse_size(text):
+    text = text.strip().upper()
+    units = {'K': 1024, 'M': 1024 ** 2}
+    if text and text[-1] in units:
+        return int(float(text[:-1]) * units[text[-1]])
+    return int(text)
+
+
+# 把带k、m后缀的数量字符串转换为整数的函数，这里的k表示一千
+def parse_count(text):
+    text = text.strip().lower()
+    units = {'k': 1000, 'm': 1000000}
+    if text and text[-1] in units:
+        return int(float(text[:-1]) * units[text[-1]])
+    return int(text)
+
+
+# 创建一个不绑定端口的FTPServer对象的函数，微基准测试只调用它的方法
+# map_min_size是使用内存映射发送的最小文件大小，为None时使用默认值
+def make_server(map_min_size=None):
+    import mmap_cache
+    import rate_limiter
+    import server
+    ftp_server = server.FTPServer.__new__(server.FTPServer)
+    ftp_server.bandwidth = rate_limiter.BandwidthManager()
+    ftp_server.map_cache = mmap_cache.MapCache(mmap_cache.MIN_SIZE if map_min_size is None else map_min_size)
+    # 微基准测试不需要上传去重和文件名索引
+    ftp_server.content_store = None
+    ftp_server.file_index = None
+    return ftp_server
+
+
+# 测试列目录的函数，目录中90%是文件，10%是子目录，已生成的目录会被重复使用
+def bench_list_dir(workdir, entries):
+    path = os.path.join(workdir, f'list_{entries}')
+    if not os.path.isdir(path):
+        os.makedirs(path + '.tmp', exist_ok=True)
+        for i in range(entries):
+            if i % 10 == 0:
+                os.mkdir(os.path.join(path + '.tmp', f'dir_{i}'))
+            else:
+                open(os.path.join(path + '.tmp', f'file_{i}.txt'), 'wb').close()
+        os.rename(path + '.tmp', path)
+    ftp_server = make_server()
+    sock = NullSocket()
+    return {
+        'text': measure(lambda: ftp_server.list_dir(sock, path), entries),
+        'binary': measure(lambda: ftp_server.list_dir_binary(sock, 'ls -b', path), entries),
+    }
+
+
+# 测试客户端解析目录列表的函数，比较文本格式逐行拆分和二进制格式一次解出所有记录，不包括界面的开销
+def bench_parse_listing(entries):
+    import binary_listing
+    records = [(binary_listing.DIR, 0, 0, f'dir_{i}') if i % 10 == 0 else (binary_listing.FILE, i * 7, 0, f'file_{i}.txt') for i in range(entries)]
+    text = '/bench\n' + '\n'.join(name + '\\' if kind == binary_listing.DIR else f'{size} {name}' for kind, size, _, name in records)
+    data = binary_listing.encode('/bench', records)
+    def parse_text():
+        directory, _, lines = text.partition('\n')
+        return [binary_listing.parse_text_entry(line, directory) for line in lines.split('\n')]
+    return {
+        'text': measure(parse_text, entries),
+        'binary': measure(lambda: binary_listing.decode(data), entries),
+    }
+
+
+# 测试数据库查询和插入的函数，用户表中预先填充rows行数据
+def bench_db(workdir, rows):
+    import db_manager
+    db_manager.DB_NAME = os.path.join(workdir, f'users_{rows}.db')
+    if os.path.exists(db_manager.DB_NAME):
+        os.remove(db_manager.DB_NAME)
+    db = db_manager.DBManager()
+    db.cursor.executemany(f'INSERT INTO {db_manager.TABLE_NAME} VALUES (?, ?)', ((f'user{i}', 'pw') for i in range(rows)))
+    db.conn.commit()
+    results = {
+        'query_hit': measure(lambda: db.query_user(f'user{rows - 1}', 'pw')),
+        'query_miss': measure(lambda: db.query_user('nobody', 'pw')),
+    }
+    # 插入测试每次插入一个新用户名，表会随着测试略微增长
+    counter = [0]
+    def insert():
+        counter[0] += 1
+        db.insert_user(f'new{counter[0]}', 'pw')
+    results['insert'] = measure(insert)
+    db.close()
+    return results
+
+
+# 测试文件发送分块循环的函数，通过socketpair发送给一个后台线程，由它读出并丢弃
+# mapped为False时，内存映射的最小大小设为比文件大，发送走按BUFFER_SIZE读取的分块循环，缓冲区大小才会影响结果
+# mapped为True时走内存映射发送，每块的大小固定，和buffer_size无关
+def bench_chunk_loop(workdir, buffer_size, file_size, mapped=False):
+    import server
+    from session import Session
+    path = os.path.join(workdir, f'chunk_{file_size}.bin')
+    if not os.path.exists(path) or os.path.getsize(path) != file_size:
+        with open(path, 'wb') as f:
+            f.write(os.urandom(file_size))
+    server.BUFFER_SIZE = buffer_size
+    ftp_server = make_server(None if mapped else file_size + 1)
+    session = Session(workdir)
+    left, right = socket.socketpair()
+    # 后台线程不断读出数据，模拟一个足够快的客户端
+    def drain():
+        try:
+            while right.recv(1024 * 1024):
+                pass
+        # 测试结束关闭socket后，recv会抛出异常，直接结束线程
+        except OSError:
+            pass
+    threading.Thread(target=drain, daemon=True).start()
+    try:
+        return measure(lambda: ftp_server.send_file(left, 'get ' + os.path.basename(path), session), file_size)
+    finally:
+        left.close()
+        right.close()
+
+
+# 测试文件接收的函数，比较不同持久化策略下的吞吐量，每次调用由一个后台线程通过socketpair发送一个完整的文件
+def bench_upload(workdir, durability, file_size):
+    import server
+    from session import Session
+    server.DURABILITY = durability
+    ftp_server = make_server()
+    session = Session(workdir)
+    data = os.urandom(file_size)
+    left, right = socket.socketpair()
+    # 模拟客户端，发送文件大小和文件数据，再读出服务器的响应
+    def upload():
+        right.sendall(f'{file_size}\n'.encode() + data)
+        right.recv(1024)
+    def receive():
+        sender = threading.Thread(target=upload)
+        sender.start()
+        ftp_server.receive_file(left, 'put upload.bin', session)
+        sender.join()
+    try:
+        return measure(receive, file_size, min_time=0)
+    finally:
+        left.close()
+        right.close()
+
+
+# 测试客户端解析目录列表的函数，在offscreen模式下运行Qt，不需要显示器
+def bench_update_dir_and_file(entries):
+    os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+    from PySide6.QtWidgets import QApplication
+    app = QApplication.instance() or QApplication([])
+    from client import FTPClient
+    ftp_client = FTPClient('127.0.0.1', 0)
+    lines = [f'dir_{i}\\' if i % 10 == 0 else f'{i * 7} file_{i}.txt' for i in range(entries)]
+    response = '/bench\n' + '\n'.join(lines)
+    return measure(lambda: ftp_client.gui.update_dir_and_file(response), entries)
+
+
+# 解析命令行参数的函数
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='热点函数的微基准测试')
+    parser.add_argument('--entries', default='1k,100k', help='列目录测试的目录条目数列表，1m需要先创建一百万个文件')
+    parser.add_argument('--rows', default='1k,10k,100k', help='数据库测试的用户表行数列表')
+    parser.add_argument('--buffers', default='1K,8K,64K,256K', help='分块循环测试的缓冲区大小列表')
+    parser.add_argument('--file-size', default='16M', help='分块循环测试的文件大小')
+    parser.add_argument('--durability', default='none,end,periodic', help='文件接收测试的持久化策略列表')
+    parser.add_argument('--upload-size', default='64M', help='文件接收测试的文件大小')
+    parser.add_argument('--gui-entries', default='1k,10k', help='客户端解析测试的条目数列表，为空表示跳过')
+    parser.add_argument('--only', help='只运行指定的测试，可选list_dir、parse、db、chunk_loop、upload、gui，用逗号分隔')
+    parser.add_argument('--workdir', help='存放测试数据的目录，指定后测试数据会被保留并在下次重复使用')
+    parser.add_argument('--output', help='把结果保存为JSON文件')
+    return parser.parse_args(argv)
+
+
+# 运行所有微基准测试的函数，返回结果字典
+def run(args):
+    workdir = args.workdir or tempfile.mkdtemp(prefix='ftp_micro_')
+    os.makedirs(workdir, exist_ok=True)
+    only = set(args.only.split(',')) if args.only else {'list_dir', 'parse', 'db', 'chunk_loop', 'upload', 'gui'}
+    results = {}
+    try:
+        if 'list_dir' in only:
+            for entries in map(parse_count, args.entries.split(',')):
+                for name, result in bench_list_dir(workdir, entries).items():
+                    results[f'list_dir.{name}[{entries}]'] = result
+        if 'parse' in only:
+            for entries in map(parse_count, args.entries.split(',')):
+                for name, result in bench_parse_listing(entries).items():
+                    results[f'parse_listing.{name}[{entries}]'] = result
+        if 'db' in only:
+            for rows in map(parse_count, args.rows.split(',')):
+                for name, result in bench_db(workdir, rows).items():
+                    results[f'db.{name}[{rows}]'] = result
+        if 'chunk_loop' in only:
+            for buffer_size in map(parse_size, args.buffers.split(',')):
+                results[f'chunk_loop[{buffer_size}]'] = bench_chunk_loop(workdir, buffer_size, parse_size(args.file_size))
+            results['chunk_loop.mmap'] = bench_chunk_loop(workdir, parse_size(args.buffers.split(',')[0]), parse_size(args.file_size), mapped=True)
+        if 'upload' in only:
+            for durability in args.durability.split(','):
+                results[f'upload[{durability}]'] = bench_upload(workdir, durability, parse_size(args.upload_size))
+        if 'gui' in only and args.gui_entries:
+            for entries in map(parse_count, args.gui_entries.split(',')):
+                results[f'update_dir_and_file[{entries}]'] = bench_update_dir_and_file(entries)
+    finally:
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+    return results
+
+
+# 主函数
+if __name__ == '__main__':
+    args = parse_args()
+    # 把服务器的日志级别调高，避免日志输出干扰测试结果
+    import ftp_logger
+    ftp_logger.setup(stream=sys.stderr, level='WARNING')
+    results = run(args)
+    for name, result in results.items():
+        print(f"{name:<36}{result['ops_per_sec']:>14} ops/s{result['items_per_sec']:>16} items/s")
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
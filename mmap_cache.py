@@ -0,0 +1,139 @@
+# mmap_cache.py
+# 这是一个内存映射文件的缓存模块，多个客户端同时下载同一个文件时共用一份映射
+# 缓存以(inode号, 修改时间, 大小)为键，文件被修改或替换后自动使用新的映射，旧的映射在没有人使用后关闭
+# 发送时用memoryview切片，不需要为每个数据块创建新的bytes对象
+import mmap
+import os
+import threading
+from collections import OrderedDict
+import metrics
+
+# 定义一些常量
+CHUNK_SIZE = 64 * 1024 # 每次发送的切片大小
+MIN_SIZE = 64 * 1024 # 小于这个大小的文件不做映射，直接读取更快
+MAX_IDLE = 16 # 没有人使用的映射最多保留的个数，超过后关闭最久没有使用的
+
+
+# 由文件信息得到缓存的键的函数，同一个路径上替换后的文件inode号不同，大小和修改时间相同也不会用错映射
+def stat_key(stat):
+    return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+
+# 定义一个映射文件类，存储一个文件的映射和引用计数
+class MappedFile:
+
+    # 初始化方法，接受文件路径作为参数，键和大小取自打开后的文件本身，而不是调用者之前取得的文件信息
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self.key = stat_key(os.fstat(f.fileno()))
+            self.mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.size = len(self.mmap)
+        # 提示操作系统会顺序读取，让它提前预读并及时回收已读过的页
+        if hasattr(self.mmap, 'madvise') and hasattr(mmap, 'MADV_SEQUENTIAL'):
+            self.mmap.madvise(mmap.MADV_SEQUENTIAL)
+        self.view = memoryview(self.mmap)
+        # 增加一个属性，用于存储正在使用这个映射的传输数
+        self.refs = 0
+
+    # 关闭映射的方法，必须先释放memoryview，否则mmap无法关闭
+    def close(self):
+        self.view.release()
+        self.mmap.close()
+
+
+# 定义一个映射缓存类
+class MapCache:
+
+    # 初始化方法，接受最小映射大小和最多保留的空闲映射数作为参数
+    def __init__(self, min_size=MIN_SIZE, max_idle=MAX_IDLE):
+        self.min_size = min_size
+        self.max_idle = max_idle
+        self.lock = threading.Lock()
+        # 当前有效的映射，键是文件路径，值是映射文件对象
+        self.files = {}
+        # 没有人使用的映射，按最近使用的顺序排列，键是文件路径
+        self.idle = OrderedDict()
+
+    # 获取一个文件的映射的方法，stat是调用者从打开的文件上用fstat取得的文件信息，文件太小或无法映射时返回None
+    # 新建的映射和stat不一致时，说明文件在这期间被修改或替换了，不使用这个映射，调用者改为直接读取打开的文件
+    def acquire(self, path, stat):
+        if stat.st_size < self.min_size:
+            return None
+        key = stat_key(stat)
+        with self.lock:
+            mapped = self.files.get(path)
+            if mapped is not None and mapped.key == key:
+                metrics.CACHE_REQUESTS.inc(1, ('mmap', 'hit'))
+            else:
+                metrics.CACHE_REQUESTS.inc(1, ('mmap', 'miss'))
+                # 文件已经被修改，旧的映射不再放入缓存，等正在使用它的传输结束后关闭
+                if mapped is not None:
+                    self.forget(mapped)
+                try:
+                    mapped = MappedFile(path)
+                except (OSError, ValueError):
+                    return None
+                if mapped.key != key:
+                    mapped.close()
+                    return None
+                self.files[path] = mapped
+            mapped.refs += 1
+            self.idle.pop(path, None)
+            return mapped
+
+    # 归还一个映射的方法，最后一个使用者归还后，映射变为空闲，空闲映射太多时关闭最久没有使用的
+    def release(self, mapped):
+        with self.lock:
+            mapped.refs -= 1
+            if mapped.refs > 0:
+                return
+            if self.files.get(mapped.path) is not mapped:
+                mapped.close()
+                return
+            self.idle[mapped.path] = mapped
+            while len(self.idle) > self.max_idle:
+                _, oldest = self.idle.popitem(last=False)
+                del self.files[oldest.path]
+                oldest.close()
+
+    # 使某个文件的映射失效的方法，在覆盖写入文件之前调用，返回一个布尔值，表示映射是否还有传输在使用
+    def invalidate(self, path):
+        with self.lock:
+            mapped = self.files.get(path)
+            if mapped is None:
+                return False
+            self.forget(mapped)
+            return mapped.refs > 0
+
+    # 把一个映射从缓存中移除的方法，调用者需要持有锁，没有人使用时立即关闭
+    def forget(self, mapped):
+        del self.files[mapped.path]
+        self.idle.pop(mapped.path, None)
+        if mapped.refs == 0:
+            mapped.close()
+
+    # 清空缓存的方法，空闲映射立即关闭，正在使用的映射等传输结束后关闭
+    def clear(self):
+        with self.lock:
+            for mapped in list(self.files.values()):
+                self.forget(mapped)
+
+
+# 从映射中发送数据的函数，从offset处开始发送到文件末尾，每发送一块调用一次before_send(块大小)用于限速
+# on_sent(已发送的位置)在每块发送完成后调用，stop()返回True时提前停止，返回发送结束的位置
+# 最多发送到映射的末尾，映射比记录的大小短时提前返回，send没有发送任何数据时抛出异常，不会在原地空转
+def send_mapped(sock, mapped, offset, before_send=None, on_sent=None, stop=None):
+    end = min(mapped.size, len(mapped.view))
+    while offset < end and not (stop and stop()):
+        # 用with语句及时释放切片，否则映射关闭时会因为还有切片而失败
+        with mapped.view[offset:min(offset + CHUNK_SIZE, end)] as chunk:
+            if before_send:
+                before_send(len(chunk))
+            n = sock.send(chunk)
+            if not n:
+                raise ConnectionError('对端不再接收数据')
+            offset += n
+        if on_sent:
+            on_sent(offset)
+    return offset
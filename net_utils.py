@@ -0,0 +1,109 @@
+# net_utils.py
+# 这是一个网络工具模块，存放服务器和客户端共用的socket设置函数和接收数据的工具
+import os
+import socket
+import threading
+
+# 定义一些常量，用于设置TCP保活探测的参数
+KEEPALIVE_IDLE = 5 # 连接空闲多少秒后开始发送保活探测
+KEEPALIVE_INTERVAL = 2 # 两次保活探测之间的间隔秒数
+KEEPALIVE_COUNT = 3 # 连续多少次探测没有回应就认为对端已断开
+RECV_BUFFER_SIZE = 256 * 1024 # 接收文件数据时使用的缓冲区大小
+
+# 创建一个线程局部变量，每个线程各自使用一个接收缓冲区
+local = threading.local()
+
+
+# 开启TCP保活探测的函数，让对端掉线后能在十几秒内被发现，而不是一直阻塞在recv上
+def enable_keepalive(sock, idle=KEEPALIVE_IDLE, interval=KEEPALIVE_INTERVAL, count=KEEPALIVE_COUNT):
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+    # Linux等平台可以分别设置空闲时间、探测间隔和探测次数
+    if hasattr(socket, 'TCP_KEEPIDLE'):
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, idle)
+    # macOS使用TCP_KEEPALIVE表示空闲时间
+    elif hasattr(socket, 'TCP_KEEPALIVE'):
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPALIVE, idle)
+    if hasattr(socket, 'TCP_KEEPINTVL'):
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPINTVL, interval)
+    if hasattr(socket, 'TCP_KEEPCNT'):
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPCNT, count)
+    # Windows需要通过ioctl一次性设置空闲时间和探测间隔，单位是毫秒
+    if hasattr(socket, 'SIO_KEEPALIVE_VALS'):
+        sock.ioctl(socket.SIO_KEEPALIVE_VALS, (1, idle * 1000, interval * 1000))
+
+
+# 创建监听socket的函数，reuse_port为True时设置SO_REUSEPORT，多个进程可以各自绑定同一个端口，由内核把新连接分给它们
+# listen为False时只绑定不监听，用于预先占住端口，不监听的socket不会分到连接
+def create_listener(host, port, backlog, reuse_port=False, listen=True):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    # 允许重用地址，避免端口占用的问题
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if reuse_port:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind((host, port))
+    if listen:
+        sock.listen(backlog)
+    return sock
+
+
+# 检查系统是否支持SO_REUSEPORT的函数，Windows没有这个选项
+def reuse_port_supported():
+    return hasattr(socket, 'SO_REUSEPORT')
+
+
+# 打开下载的目标文件的函数，offset为0时创建或清空文件，否则打开已有的文件并移动到offset处，文件不存在时创建
+# 不使用追加模式打开，追加模式下写入总是落在文件末尾，os.pwrite在Linux上也会忽略指定的位置
+def open_download(path, offset):
+    if not offset:
+        return open(path, 'wb')
+    f = open(path, 'r+b' if os.path.exists(path) else 'wb')
+    f.seek(offset)
+    return f
+
+
+# 定义一个接收缓冲区类，反复使用同一块内存接收数据，不为每个数据块创建新的bytes对象
+class RecvBuffer:
+
+    # 初始化方法，接受缓冲区大小作为参数
+    def __init__(self, size=RECV_BUFFER_SIZE):
+        self.buffer = bytearray(size)
+        self.view = memoryview(self.buffer)
+
+    # 从socket接收count字节并写入文件的方法，on_chunk(字节数)在每次接收后、写入前调用，可以用于限速和更新进度
+    # position不为None且系统支持os.pwrite时，直接按位置写入文件描述符，跳过文件对象的缓冲区
+    # digest不为None时，用收到的数据更新这个哈希对象
+    def recv_into_file(self, sock, f, count, position=None, on_chunk=None, digest=None):
+        view = self.view
+        fd = None
+        if position is not None and hasattr(os, 'pwrite'):
+            # 先写出文件对象缓冲区中的数据，再直接写文件描述符
+            f.flush()
+            fd = f.fileno()
+        remaining = count
+        while remaining > 0:
+            # 最多只接收剩余的字节数，避免把对端紧接着发送的命令当成文件数据
+            n = sock.recv_into(view, min(len(view), remaining))
+            # 对端关闭连接时recv_into返回0，说明传输中断
+            if not n:
+                raise ConnectionError('对端断开连接')
+            if on_chunk:
+                on_chunk(n)
+            if digest is not None:
+                digest.update(view[:n])
+            if fd is None:
+                f.write(view[:n])
+            else:
+                # pwrite可能只写入一部分，循环写完为止
+                written = 0
+                while written < n:
+                    written += os.pwrite(fd, view[written:n], position + written)
+                position += n
+            remaining -= n
+        return count
+
+
+# 获取当前线程的接收缓冲区的函数，第一次调用时创建
+def recv_buffer():
+    if not hasattr(local, 'recv_buffer'):
+        local.recv_buffer = RecvBuffer()
+    return local.recv_buffer
@@ -0,0 +1,118 @@
+# pipeline.py
+# 这是一个流水线协议模块，客户端可以连续发送多条带请求编号的命令，不必等待上一条命令的响应
+# 请求的格式是“#编号 命令\n”，响应的格式是“#编号 长度\n”加上长度为该值的响应内容
+# 服务器按顺序处理会修改会话状态的命令，只读的命令可以在后台线程中并发执行，响应可能不按请求的顺序返回
+import socket
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# 定义一些常量
+WORKERS = 4 # 每个连接并发执行只读命令的线程数
+RECV_SIZE = 64 * 1024 # 读取流水线响应时每次接收的字节数
+
+
+# 定义一个响应缓冲区类，模拟socket的send和sendall方法，把处理命令时发送的数据收集起来，再加上请求编号一起发送
+class ResponseBuffer:
+
+    # 初始化方法
+    def __init__(self):
+        self.chunks = []
+
+    # 模拟socket的send方法
+    def send(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    # 模拟socket的sendall方法
+    def sendall(self, data):
+        self.chunks.append(bytes(data))
+
+    # 获取收集到的全部数据的方法
+    def getvalue(self):
+        return b''.join(self.chunks)
+
+
+# 给一条响应加上请求编号和长度的函数
+def frame(request_id, body):
+    return f'#{request_id} {len(body)}\n'.encode() + body
+
+
+# 解析一行请求的函数，返回请求编号和命令
+def parse_request(line):
+    request_id, _, command = line.decode()[1:].partition(' ')
+    return request_id, command
+
+
+# 定义一个流水线类，每个使用流水线模式的连接创建一个，负责发送带编号的响应和在后台执行只读命令
+class Pipeline:
+
+    # 初始化方法，接受客户端的socket作为参数
+    def __init__(self, sock, workers=WORKERS):
+        self.sock = sock
+        # 关闭Nagle算法，多条小响应连续发送时，不必等待对端确认前一条响应，否则会和对端的延迟确认叠加，每条响应多等几十毫秒
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        # 创建一个锁对象，防止多个线程的响应交错发送
+        self.send_lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='pipeline')
+        # 增加一个属性，用于存储还没有执行完的只读命令
+        self.pending = []
+
+    # 发送一条带编号的响应的方法
+    def reply(self, request_id, body):
+        with self.send_lock:
+            self.sock.sendall(frame(request_id, body))
+
+    # 执行一条命令并发送响应的方法，handler接受一个socket对象，把响应写入其中
+    def run(self, request_id, handler):
+        buffer = ResponseBuffer()
+        try:
+            handler(buffer)
+        except Exception as e:
+            buffer.sendall(f'ERROR {e}'.encode())
+        self.reply(request_id, buffer.getvalue())
+
+    # 在后台线程中执行一条只读命令的方法，完成后立即发送响应，不等待前面的命令
+    def submit(self, request_id, handler):
+        self.pending = [future for future in self.pending if not future.done()]
+        self.pending.append(self.executor.submit(self.run, request_id, handler))
+
+    # 等待所有只读命令执行完的方法，执行会修改会话状态的命令之前调用，保证它看到的是前面的命令执行后的状态
+    def wait(self):
+        for future in self.pending:
+            future.result()
+        self.pending = []
+
+    # 关闭流水线的方法
+    def close(self):
+        self.executor.shutdown(wait=True)
+
+
+# 读取多条流水线响应的函数，count是要读取的响应数，返回一个字典，键是请求编号，值是响应内容
+def read_responses(sock, count):
+    responses = {}
+    buffer = b''
+    while len(responses) < count:
+        # 读取响应头，格式是“#编号 长度\n”
+        while b'\n' not in buffer:
+            data = sock.recv(RECV_SIZE)
+            if not data:
+                raise ConnectionError('服务器断开连接')
+            buffer += data
+        header, buffer = buffer.split(b'\n', 1)
+        request_id, length = header.decode()[1:].split(' ')
+        length = int(length)
+        # 读取响应内容
+        while len(buffer) < length:
+            data = sock.recv(RECV_SIZE)
+            if not data:
+                raise ConnectionError('服务器断开连接')
+            buffer += data
+        responses[request_id] = buffer[:length]
+        buffer = buffer[length:]
+    return responses
+
+
+# 把多条命令编码为流水线请求的函数，返回请求编号的列表和要发送的数据
+def encode_requests(commands, first_id=1):
+    ids = [str(first_id + i) for i in range(len(commands))]
+    return ids, ''.join(f'#{request_id} {command}\n' for request_id, command in zip(ids, commands)).encode()
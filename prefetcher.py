@@ -0,0 +1,134 @@
+# prefetcher.py
+# 这是一个目录列表预取模块，客户端收到一个目录的列表后，在后台线程中预先获取其中各个子目录的列表，放入列表缓存
+# 用户双击进入子目录时，缓存中已经有它的列表，可以立即显示，再由lsv命令确认是否有变化
+# 预取使用自己的连接，不占用界面的连接；通过线程数限制并发，通过令牌桶限制带宽，只在客户端没有传输文件时进行
+import collections
+import threading
+import time
+import binary_listing
+import connection_pool
+import listing_cache
+import rate_limiter
+
+# 定义一些常量
+WORKERS = 2 # 预取线程数，每个线程使用一个连接
+RATE = 256 * 1024 # 预取占用的带宽上限，单位是字节/秒
+MAX_DIRS = 20 # 每个目录最多预取多少个子目录
+BATCH_SIZE = 4 # 每次用流水线模式一起请求的子目录数
+IDLE_WAIT = 0.5 # 客户端正在传输文件时，每隔多少秒检查一次
+REFRESH_INTERVAL = 30 # 同一个目录的子目录在多少秒内不重复预取
+
+
+# 定义一个预取类
+class Prefetcher:
+
+    # 初始化方法，cache是客户端的列表缓存，idle是一个函数，返回客户端当前是否空闲，只在空闲时预取
+    # binary为True时用二进制格式请求列表，和客户端界面的连接保持一致
+    def __init__(self, host, port, cache, idle=None, workers=WORKERS, rate=RATE, max_dirs=MAX_DIRS, binary=True):
+        self.host = host
+        self.port = port
+        self.cache = cache
+        self.idle = idle or (lambda: True)
+        self.max_dirs = max_dirs
+        self.binary = binary
+        # 创建一个令牌桶，所有预取线程共用，限制预取占用的带宽
+        self.bucket = rate_limiter.TokenBucket(rate)
+        # 创建一个条件变量和一个队列，队列中是等待预取的(父目录, 子目录名)
+        self.condition = threading.Condition()
+        self.pending = collections.deque()
+        # 增加一个属性，用于标记预取是否已经停止
+        self.closed = False
+        self.workers = workers
+        # 创建一个连接池，预取线程从中借用连接，不需要在用完后切换回原来的目录
+        # 客户端登录之前连接不登录，登录之后由login方法换成用同样的用户名和密码登录的连接池
+        self.pool = connection_pool.ConnectionPool(host, port, max_size=workers, reset_dir=False)
+        # 最近安排过预取的目录和安排的时间，来回切换目录时不重复预取
+        self.scheduled = {}
+        for index in range(workers):
+            threading.Thread(target=self.run, daemon=True, name=f'prefetch-{index}').start()
+
+    # 客户端登录成功后调用的方法，换成用同样的用户名和密码登录的连接池，关闭原来的连接
+    # 正在使用原来连接的预取线程用完后，连接会因为连接池已经关闭而被直接关闭
+    def login(self, username, password):
+        pool = connection_pool.ConnectionPool(self.host, self.port, username, password, max_size=self.workers, reset_dir=False)
+        with self.condition:
+            if self.closed:
+                pool.close()
+                return
+            old, self.pool = self.pool, pool
+        old.close()
+
+    # 安排预取一个目录的子目录的方法，entries是(类型, 大小, 修改时间, 名称)的列表
+    # 用户已经离开的目录不再需要预取，所以先清空还没有开始的预取，只保留最新的目录
+    def schedule(self, directory, entries):
+        # Windows的磁盘列表不是目录，不预取
+        if directory == '\\':
+            return
+        now = time.monotonic()
+        if now - self.scheduled.get(directory, -REFRESH_INTERVAL) < REFRESH_INTERVAL:
+            return
+        self.scheduled = {key: value for key, value in self.scheduled.items() if now - value < REFRESH_INTERVAL}
+        self.scheduled[directory] = now
+        children = [name for kind, _, _, name in entries if kind == binary_listing.DIR]
+        with self.condition:
+            self.pending.clear()
+            for name in children[:self.max_dirs]:
+                self.pending.append((directory, name))
+            self.condition.notify_all()
+
+    # 预取线程执行的方法，每次取出几个子目录，用流水线模式一次请求它们的列表
+    def run(self):
+        while True:
+            batch = self.next_batch()
+            if batch is None:
+                return
+            # 客户端正在传输文件时先等待，不和传输争抢带宽
+            while not self.idle() and not self.closed:
+                time.sleep(IDLE_WAIT)
+            try:
+                self.fetch(batch)
+            # 预取失败不影响客户端，连接池会关闭出错的连接，下次重新连接
+            except Exception:
+                pass
+
+    # 取出下一批要预取的子目录的方法，没有任务时等待，停止后返回None
+    def next_batch(self):
+        with self.condition:
+            while not self.pending and not self.closed:
+                self.condition.wait()
+            if self.closed:
+                return None
+            batch = []
+            while self.pending and len(batch) < BATCH_SIZE:
+                batch.append(self.pending.popleft())
+            return batch
+
+    # 预取一批子目录的方法，每个子目录依次发送cd 父目录、cd 子目录和lsv三条命令，所有命令在一次往返中完成
+    # 父目录是服务器返回的完整路径，所以cd到子目录后得到的路径和用户从父目录进入时相同，缓存的键一致
+    # 预取的连接是单独登录的，不会影响界面的连接保存在服务器上的会话
+    def fetch(self, batch):
+        lsv = f'lsv {binary_listing.BINARY_OPTION} ' if self.binary else 'lsv '
+        commands = []
+        for directory, name in batch:
+            commands += [f'cd {directory}', f'cd {name}', lsv + listing_cache.NO_VERSION]
+        with self.pool.session() as session:
+            responses = session.pipeline(commands)
+        for cd_response, response in zip(responses[1::3], responses[2::3]):
+            # 子目录已经不存在时，lsv列出的是父目录，不放入缓存
+            if not cd_response.startswith('OK'):
+                continue
+            try:
+                self.cache.apply(response)
+            except ValueError:
+                pass
+        # 按收到的字节数等待，限制预取占用的带宽
+        time.sleep(self.bucket.reserve(sum(len(response if isinstance(response, bytes) else response.encode()) for response in responses)))
+
+    # 停止预取的方法，关闭所有连接
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.pending.clear()
+            self.condition.notify_all()
+            pool = self.pool
+        pool.close()
@@ -0,0 +1,165 @@
+# prefork.py
+# 这是一个多进程服务器模块，启动多个工作进程，每个进程运行一个完整的FTP服务器，哈希计算、压缩等CPU密集的部分不再受GIL限制，可以使用多个核
+# 支持SO_REUSEPORT的系统上，每个工作进程各自绑定同一个端口，由内核把新连接分给它们；否则由主进程创建监听socket，工作进程共用
+# 主进程作为监督者，不处理客户端的连接，只负责重新启动退出的工作进程，并把各个工作进程的监控指标合并后输出
+# 用户和会话保存在共享的SQLite数据库中，登录和断线恢复可以落在任意一个工作进程上；各种缓存都按修改时间和大小校验，每个进程各自维护
+import multiprocessing
+import os
+import signal
+import time
+import urllib.request
+import ftp_logger
+import metrics
+import net_utils
+
+# 定义一些常量
+CHECK_INTERVAL = 0.5 # 检查工作进程是否存活的间隔秒数
+RESTART_DELAY = 1 # 工作进程启动后不到这么多秒就退出时，等待这么多秒再重新启动，避免反复崩溃占满CPU
+STOP_TIMEOUT = 5 # 停止时等待工作进程退出的秒数，超时后强制结束
+SCRAPE_TIMEOUT = 2 # 抓取工作进程监控指标的超时秒数
+
+# 创建一个结构化日志对象
+logger = ftp_logger.get_logger('prefork')
+
+# 创建主进程自己的指标注册表，和工作进程的指标分开，fork出的工作进程不会输出这些指标
+REGISTRY = metrics.Registry()
+WORKERS_ALIVE = REGISTRY.register(metrics.Gauge('ftp_workers_alive', '正在运行的工作进程数'))
+WORKER_RESTARTS = REGISTRY.register(metrics.Counter('ftp_worker_restarts_total', '工作进程退出后被重新启动的次数'))
+SCRAPE_ERRORS = REGISTRY.register(metrics.Counter('ftp_metrics_scrape_errors_total', '抓取工作进程监控指标失败的次数'))
+
+
+# 定义一个监督者类，在主进程中创建和管理工作进程
+class Supervisor:
+
+    # 初始化方法，target是工作进程执行的函数，调用方式为target(编号, 监听socket, 指标端口号, *args)，metrics_port为0表示不输出指标
+    def __init__(self, target, workers, host, port, backlog, metrics_port=0, args=(), reuse_port=None):
+        self.target = target
+        self.workers = workers
+        self.host = host
+        self.backlog = backlog
+        self.metrics_port = metrics_port
+        self.args = args
+        self.reuse_port = net_utils.reuse_port_supported() if reuse_port is None else reuse_port
+        # 使用SO_REUSEPORT时主进程只绑定不监听，占住端口，端口号为0时也能让所有工作进程绑定到同一个实际端口
+        # 否则主进程创建监听socket，所有工作进程共用，各自调用accept
+        self.sock = net_utils.create_listener(host, port, backlog, reuse_port=self.reuse_port, listen=not self.reuse_port)
+        self.port = self.sock.getsockname()[1]
+        # 优先用fork启动工作进程，不需要重新导入模块；Windows上只能用spawn
+        self.context = multiprocessing.get_context('fork' if 'fork' in multiprocessing.get_all_start_methods() else 'spawn')
+        # 每个编号的工作进程对象和启动时间
+        self.processes = [None] * workers
+        self.started = [0] * workers
+        # 增加一个属性，用于标记监督者是否在运行，收到终止信号后设为False
+        self.running = False
+
+    # 获取某个工作进程的指标端口号的方法，依次使用主进程指标端口之后的端口
+    def worker_metrics_port(self, index):
+        return self.metrics_port + 1 + index if self.metrics_port else 0
+
+    # 启动一个工作进程的方法
+    # 使用SO_REUSEPORT时由主进程为工作进程创建监听socket再交给它，进程启动前到达的连接在监听队列中等待，不会被拒绝
+    # 工作进程退出时，已经分给它的监听队列中还没有accept的连接会被内核重置
+    def spawn(self, index):
+        if self.reuse_port:
+            sock = net_utils.create_listener(self.host, self.port, self.backlog, reuse_port=True)
+        else:
+            sock = self.sock
+        process = self.context.Process(target=self.target, name=f'ftp-worker-{index}', daemon=True,
+                                       args=(index, sock, self.worker_metrics_port(index)) + tuple(self.args))
+        process.start()
+        # 主进程不使用工作进程的监听socket，关闭自己的副本
+        if self.reuse_port:
+            sock.close()
+        self.processes[index] = process
+        self.started[index] = time.monotonic()
+        logger.info('worker_start', index=index, pid=process.pid)
+
+    # 启动所有工作进程的方法，返回后所有监听socket都已经在监听，客户端可以开始连接
+    def start(self):
+        if self.running:
+            return
+        self.running = True
+        signal.signal(signal.SIGTERM, self.handle_stop)
+        signal.signal(signal.SIGINT, self.handle_stop)
+        # 收到SIGUSR1信号时转发给所有工作进程，让它们各自采样
+        if hasattr(signal, 'SIGUSR1'):
+            signal.signal(signal.SIGUSR1, self.forward_signal)
+        # 收到SIGHUP信号时也转发给所有工作进程，让它们各自重新加载配置，已经连接的客户端不受影响
+        if hasattr(signal, 'SIGHUP'):
+            signal.signal(signal.SIGHUP, self.forward_signal)
+        for index in range(self.workers):
+            self.spawn(index)
+        WORKERS_ALIVE.set(self.workers)
+        if self.metrics_port:
+            metrics.start_http_server(self.metrics_port, render=self.render_metrics)
+        logger.info('prefork_start', port=self.port, workers=self.workers, reuse_port=self.reuse_port)
+
+    # 运行监督者的方法，还没有启动工作进程时先启动，然后定时检查，退出的工作进程会被重新启动，直到收到终止信号
+    def run(self):
+        self.start()
+        try:
+            while self.running:
+                time.sleep(CHECK_INTERVAL)
+                self.check()
+        finally:
+            self.stop()
+
+    # 检查工作进程是否存活的方法，重新启动已经退出的工作进程
+    def check(self):
+        alive = 0
+        for index, process in enumerate(self.processes):
+            if process.is_alive():
+                alive += 1
+                continue
+            if not self.running:
+                break
+            process.join()
+            logger.warning('worker_exit', index=index, pid=process.pid, exitcode=process.exitcode)
+            WORKER_RESTARTS.inc()
+            # 启动后很快就退出，可能是配置错误或者端口冲突，等一会儿再重新启动
+            if time.monotonic() - self.started[index] < RESTART_DELAY:
+                time.sleep(RESTART_DELAY)
+            self.spawn(index)
+            alive += 1
+        WORKERS_ALIVE.set(alive)
+
+    # 处理终止信号的方法，只设置标记，由主循环停止工作进程
+    def handle_stop(self, signum, frame):
+        self.running = False
+
+    # 把信号转发给所有工作进程的方法
+    def forward_signal(self, signum, frame):
+        for process in self.processes:
+            if process is not None and process.is_alive():
+                os.kill(process.pid, signum)
+
+    # 停止所有工作进程的方法，先发送终止信号，超时后强制结束
+    # 等待工作进程退出后，它们的CPU时间才会计入主进程的子进程资源统计
+    def stop(self):
+        self.running = False
+        for process in self.processes:
+            if process is not None and process.is_alive():
+                process.terminate()
+        deadline = time.monotonic() + STOP_TIMEOUT
+        for process in self.processes:
+            if process is None:
+                continue
+            process.join(max(0, deadline - time.monotonic()))
+            if process.is_alive():
+                process.kill()
+                process.join()
+        self.sock.close()
+        logger.info('prefork_stop', port=self.port)
+
+    # 生成合并后的指标文本的方法，抓取每个工作进程的指标，加上主进程自己的指标
+    # 某个工作进程刚好在重新启动时抓取会失败，这一次就缺少它的数据
+    def render_metrics(self):
+        texts = [REGISTRY.render()]
+        for index in range(self.workers):
+            try:
+                url = f'http://127.0.0.1:{self.worker_metrics_port(index)}/metrics'
+                with urllib.request.urlopen(url, timeout=SCRAPE_TIMEOUT) as response:
+                    texts.append(response.read().decode())
+            except OSError:
+                SCRAPE_ERRORS.inc()
+        return metrics.merge_texts(texts)
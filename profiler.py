@@ -0,0 +1,125 @@
+# profiler.py
+# 这是一个性能分析模块，提供两种分析方式：
+# 采样分析器定时抓取所有线程的调用栈，输出折叠栈格式的文件，可以直接交给flamegraph.pl或speedscope生成火焰图
+# 会话分析器在某一个客户端会话的线程中启用cProfile，输出可以用pstats或snakeviz查看的统计文件
+import cProfile
+import os
+import sys
+import threading
+import time
+from collections import Counter
+import ftp_logger
+
+# 定义一个常量，用于存储默认的采样间隔，单位是秒
+SAMPLE_INTERVAL = 0.005
+# 定义一个常量，用于标记能否同时分析多个会话，3.12及以后的版本中同一时间只能启用一个cProfile
+CONCURRENT_PROFILES = sys.version_info < (3, 12)
+
+# 创建一个结构化日志对象
+logger = ftp_logger.get_logger('profiler')
+
+
+# 定义一个采样分析器类
+class SamplingProfiler:
+
+    # 初始化方法，接受采样间隔作为参数
+    def __init__(self, interval=SAMPLE_INTERVAL):
+        self.interval = interval
+        # 增加一个属性，用于标记是否正在采样，同一时间只允许一次采样
+        self.running = False
+        self.lock = threading.Lock()
+
+    # 开始采样的方法，在后台线程中采样seconds秒，结果写入path，返回一个布尔值，表示是否成功开始
+    def start(self, seconds, path, interval=None):
+        with self.lock:
+            if self.running:
+                return False
+            self.running = True
+        threading.Thread(target=self.run, args=(seconds, path, interval or self.interval), daemon=True).start()
+        return True
+
+    # 采样的方法，每隔interval秒抓取一次所有线程的调用栈，相同的调用栈只计数
+    def run(self, seconds, path, interval):
+        counts = Counter()
+        me = threading.get_ident()
+        deadline = time.monotonic() + seconds
+        try:
+            while time.monotonic() < deadline:
+                for ident, frame in sys._current_frames().items():
+                    # 跳过采样线程自己
+                    if ident == me:
+                        continue
+                    stack = []
+                    while frame is not None:
+                        code = frame.f_code
+                        stack.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+                        frame = frame.f_back
+                    # 折叠栈格式要求从最外层到最内层，用分号分隔
+                    counts[';'.join(reversed(stack))] += 1
+                time.sleep(interval)
+            write_collapsed(counts, path)
+        finally:
+            self.running = False
+
+
+# 把调用栈计数写成折叠栈格式文件的函数，每行是“调用栈 次数”
+def write_collapsed(counts, path):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as f:
+        for stack, count in counts.most_common():
+            f.write(f'{stack} {count}\n')
+
+
+# 定义一个会话分析器类，cProfile只能分析调用enable的线程，所以由会话线程自己在处理命令前检查是否需要开启
+class SessionProfiler:
+
+    # 初始化方法
+    def __init__(self):
+        self.lock = threading.Lock()
+        # 等待开始的分析请求，键是会话编号，值是(秒数, 输出文件路径)
+        self.requests = {}
+        # 正在进行的分析，键是会话编号，值是(cProfile对象, 结束时间, 输出文件路径)
+        self.active = {}
+
+    # 请求分析某个会话的方法，会话在处理下一条命令时开始分析，返回一个布尔值，表示是否接受了这个请求
+    # 不能同时分析多个会话的Python版本上，已经有其他会话在分析或等待分析时拒绝
+    def request(self, session_id, seconds, path):
+        with self.lock:
+            if not CONCURRENT_PROFILES and (self.active or any(key != session_id for key in self.requests)):
+                return False
+            self.requests[session_id] = (seconds, path)
+            return True
+
+    # 由会话线程在处理每条命令前调用的方法，按需开始或结束分析
+    # 检查和启用都在锁中进行，两个会话同时开始分析时不会互相覆盖；启用失败时只记录警告，不影响命令的处理
+    def check(self, session):
+        # 没有任何分析请求时直接返回，不影响正常的命令处理
+        if not self.requests and not self.active:
+            return
+        with self.lock:
+            pending = self.requests.pop(session.id, None)
+            if pending:
+                seconds, path = pending
+                profile = cProfile.Profile()
+                try:
+                    profile.enable()
+                except ValueError as e:
+                    logger.warning('profile_error', session=session.id, error=str(e))
+                    return
+                self.active[session.id] = (profile, time.monotonic() + seconds, path)
+                return
+            entry = self.active.get(session.id)
+            expired = entry is not None and time.monotonic() >= entry[1]
+        if expired:
+            self.stop(session)
+
+    # 结束某个会话的分析并写出统计文件的方法，会话断开时也要调用
+    def stop(self, session):
+        with self.lock:
+            self.requests.pop(session.id, None)
+            entry = self.active.pop(session.id, None)
+        if entry:
+            profile, _, path = entry
+            profile.disable()
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            profile.dump_stats(path)
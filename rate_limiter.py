@@ -0,0 +1,143 @@
+# rate_limiter.py
+# 这是一个带宽限速模块，使用令牌桶算法，在服务器的发送和接收循环中限制传输速率
+# 支持全局、每用户和每会话三级限速，以及在所有正在进行的传输之间平分带宽的公平共享模式
+import threading
+import time
+
+# 定义一个常量，用于存储令牌桶的突发时长，桶的容量等于速率乘以这个秒数
+BURST_TIME = 0.5
+
+
+# 把带单位的速率字符串转换为字节/秒的函数，例如512K、2M，0表示不限速
+def parse_rate(text):
+    text = text.strip().upper()
+    units = {'K': 1024, 'M': 1024 * 1024, 'G': 1024 * 1024 * 1024}
+    if text and text[-1] in units:
+        return int(float(text[:-1]) * units[text[-1]])
+    return int(text)
+
+
+# 定义一个令牌桶类
+class TokenBucket:
+
+    # 初始化方法，接受速率（字节/秒）作为参数，0表示不限速
+    def __init__(self, rate=0):
+        # 创建一个锁对象，令牌桶可能被多个传输线程同时使用
+        self.lock = threading.Lock()
+        self.rate = 0
+        self.capacity = 0
+        self.tokens = 0
+        self.timestamp = time.monotonic()
+        self.set_rate(rate)
+
+    # 设置速率的方法，可以在运行时随时调用
+    # 先按原来的速率补充到现在为止的令牌，空闲的桶修改速率后不会被清空
+    def set_rate(self, rate):
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.timestamp) * self.rate)
+            self.rate = rate
+            self.capacity = rate * BURST_TIME
+            self.tokens = min(self.tokens, self.capacity)
+            self.timestamp = now
+
+    # 预订n个字节的方法，返回调用者需要等待的秒数
+    # 令牌允许透支，透支的部分由等待时间偿还，这样可以在锁外睡眠，不阻塞其他线程
+    def reserve(self, n):
+        if self.rate <= 0:
+            return 0
+        with self.lock:
+            now = time.monotonic()
+            # 按流逝的时间补充令牌，不超过桶的容量
+            self.tokens = min(self.capacity, self.tokens + (now - self.timestamp) * self.rate)
+            self.timestamp = now
+            self.tokens -= n
+            if self.tokens >= 0:
+                return 0
+            return -self.tokens / self.rate
+
+
+# 定义一个带宽管理类，统一管理全局、每用户和每会话的令牌桶
+class BandwidthManager:
+
+    # 初始化方法，接受全局速率作为参数
+    def __init__(self, global_rate=0):
+        # 创建一个锁对象，用于保护下面的字典
+        self.lock = threading.Lock()
+        # 全局令牌桶，所有传输共用
+        self.global_bucket = TokenBucket(global_rate)
+        # 每用户的速率和令牌桶，同一用户的多个会话共用一个桶
+        self.user_rates = {}
+        self.user_buckets = {}
+        # 正在传输的会话和它的令牌桶
+        self.session_buckets = {}
+        # 增加一个属性，用于标记是否启用公平共享模式
+        self.fair_share = False
+
+    # 设置全局速率的方法
+    def set_global_rate(self, rate):
+        self.global_bucket.set_rate(rate)
+        self.rebalance()
+
+    # 设置某个用户速率的方法
+    def set_user_rate(self, username, rate):
+        with self.lock:
+            self.user_rates[username] = rate
+            if username in self.user_buckets:
+                self.user_buckets[username].set_rate(rate)
+
+    # 设置某个会话速率的方法
+    def set_session_rate(self, session, rate):
+        session.rate_limit = rate
+        self.rebalance()
+
+    # 开启或关闭公平共享模式的方法
+    def set_fair_share(self, enabled):
+        self.fair_share = enabled
+        self.rebalance()
+
+    # 开始一次传输的方法，为会话创建令牌桶
+    def begin_transfer(self, session):
+        with self.lock:
+            self.session_buckets[session] = TokenBucket()
+            if session.username and session.username not in self.user_buckets:
+                self.user_buckets[session.username] = TokenBucket(self.user_rates.get(session.username, 0))
+        self.rebalance()
+
+    # 结束一次传输的方法，回收会话的令牌桶，把带宽让给其他传输
+    def end_transfer(self, session):
+        with self.lock:
+            self.session_buckets.pop(session, None)
+        self.rebalance()
+
+    # 重新计算每个会话速率的方法
+    # 公平共享模式下，每个会话最多分到全局速率除以正在传输的会话数
+    def rebalance(self):
+        with self.lock:
+            share = 0
+            if self.fair_share and self.global_bucket.rate > 0 and self.session_buckets:
+                share = self.global_bucket.rate / len(self.session_buckets)
+            for session, bucket in self.session_buckets.items():
+                rate = session.rate_limit
+                if share:
+                    rate = min(rate, share) if rate else share
+                bucket.set_rate(rate)
+
+    # 限速的方法，在发送或接收n个字节后调用，必要时睡眠，使速率不超过三级限速中最严格的一级
+    def throttle(self, session, n):
+        wait = self.global_bucket.reserve(n)
+        user_bucket = self.user_buckets.get(session.username)
+        if user_bucket:
+            wait = max(wait, user_bucket.reserve(n))
+        session_bucket = self.session_buckets.get(session)
+        if session_bucket:
+            wait = max(wait, session_bucket.reserve(n))
+        if wait > 0:
+            time.sleep(wait)
+
+    # 返回当前限速设置的描述的方法
+    def describe(self):
+        with self.lock:
+            users = ', '.join(f'{name}={rate}' for name, rate in self.user_rates.items())
+            return (f'全局={self.global_bucket.rate} 公平共享={"开" if self.fair_share else "关"} '
+                    f'正在传输={len(self.session_buckets)} 用户=[{users}]')
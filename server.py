@@ -1,45 +1,109 @@
 # ftp_server.py
 # 这是一个FTP服务器，使用socket方式编程，从创建socket、监听端口开始，实现FTP协议的功能
 # 导入所需的模块
-import socket
+import argparse
+import configparser
 import os
+import re
+import hashlib
 import sys
+import signal
 import threading
 import time
 import db_manager
+import archive_stream
+import binary_listing
+import data_channel
+import net_utils
+import rate_limiter
+import metrics
+import mmap_cache
+import ftp_logger
+import file_index
+import file_meta
+import listing_cache
+import pipeline
+import prefork
+import profiler
+import server_config
+import upload_store
+from session import Session, ABORT_TIMEOUT, ABORT_POLL_INTERVAL
 
 # 定义一些常量
 HOST = '127.0.0.1' # FTP服务器的IP地址，可以修改为其他值
 PORT = 8888 # FTP服务器的端口号，可以修改为其他值
 BUFFER_SIZE = 1024 # 缓冲区大小，用于接收和发送数据
-COMMANDS = ['ls', 'cd', 'get', 'put', 'restart', 'login', 'register', 'quit'] # 支持的FTP命令
+COMMANDS = ['ls', 'lsv', 'cd', 'get', 'put', 'getdir', 'putdir', 'restart', 'login', 'register', 'resume', 'limit', 'profile', 'stat', 'mstat', 'find', 'noop', 'abort', 'quit'] # 支持的FTP命令
 BASE_DIR = os.path.dirname(os.path.abspath(__file__)) # FTP服务器的根目录，可以修改为其他值
+RATE_LIMIT = 0 # 全局带宽上限，单位是字节/秒，0表示不限速
+PIPELINE_COMMANDS = ['ls', 'lsv', 'cd', 'restart', 'login', 'register', 'resume', 'limit', 'profile', 'stat', 'mstat', 'find', 'noop'] # 可以在流水线模式中使用的命令，不能包含带有数据传输的命令
+READ_ONLY_COMMANDS = ['ls', 'lsv', 'stat', 'mstat', 'find', 'noop'] # 不修改会话状态的命令，在流水线模式中可以并发执行
+ADMIN_USERS = ['admin'] # 管理员用户名列表，只有管理员可以调整全局和其他用户的限速
+METRICS_PORT = 0 # 监控指标HTTP服务的端口号，只监听本机，默认为0表示不启动，需要时在配置文件或命令行中指定，例如9100
+LOG_LEVEL = 'INFO' # 日志级别，可选DEBUG、INFO、WARNING、ERROR
+LOG_SAMPLE_RATE = 1.0 # 每条命令日志的采样率，负载高时可以调低，传输汇总日志不受影响
+DURABILITY = 'end' # 上传文件的持久化策略，可选none、end、periodic
+SYNC_INTERVAL = 8 * 1024 * 1024 # periodic策略下每接收多少字节刷盘一次
+CONTENT_STORE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'store') # 上传去重的内容寻址存储目录，需要和BASE_DIR在同一个文件系统上，为空表示不启用
+INDEX_SCAN_INTERVAL = 30 # 文件名索引检查目录变化的间隔秒数，0表示不建立索引，find命令不可用
+PROFILE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'profiles') # 性能分析结果的保存目录
+PROFILE_SECONDS = 10 # 收到SIGUSR1信号时采样的秒数
+LISTEN_BACKLOG = 5 # 监听队列的长度
+PREFORK_WORKERS = 0 # 工作进程数，大于0时使用多进程模式，每个进程运行一个服务器，0表示单进程多线程
+DB_NAME = db_manager.DB_NAME # 用户和会话数据库的文件名
+LISTING_HISTORY_SIZE = listing_cache.HISTORY_SIZE # lsv命令保存的历史列表数
+HASH_CACHE_SIZE = file_meta.HASH_CACHE_SIZE # 哈希值缓存最多保存的条目数
+MAP_CACHE_IDLE = mmap_cache.MAX_IDLE # 没有人使用的内存映射最多保留的个数
+CONFIG_FILE = server_config.DEFAULT_PATH # 配置文件的路径，收到SIGHUP信号时重新读取
+CONFIG_OVERRIDES = {} # 命令行参数给出的配置项，重新加载配置文件时仍然优先于配置文件
+
+# 创建一个结构化日志对象，日志由后台线程写出，不会阻塞处理客户端的线程
+logger = ftp_logger.get_logger('server')
 
 # 定义一个FTP服务器类
 class FTPServer:
-    # 初始化方法
-    def __init__(self):
-        # 增加一个属性，用于存储断点的位置
-        self.breakpoint = 0
-        # 创建一个socket对象，用于监听客户端的连接
-        self.server_sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        # 设置socket的选项，允许重用地址，避免端口占用的问题
-        self.server_sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        # 绑定IP地址和端口号
-        self.server_sock.bind((HOST, PORT))
-        # 开始监听，设置最大连接数为5
-        self.server_sock.listen(5)
+    # 初始化方法，server_sock是已经创建好的监听socket，多进程模式下由工作进程传入，为None时自己创建
+    def __init__(self, server_sock=None):
+        # 初始化日志系统，启动后台写日志的线程
+        ftp_logger.setup(level=LOG_LEVEL, rate=LOG_SAMPLE_RATE)
+        # 创建一个带宽管理对象，用于在发送和接收文件时限速
+        self.bandwidth = rate_limiter.BandwidthManager(RATE_LIMIT)
+        # 创建一个内存映射缓存，多个客户端同时下载同一个大文件时共用一份映射
+        self.map_cache = mmap_cache.MapCache(max_idle=MAP_CACHE_IDLE)
+        # 创建一个哈希值缓存，用于stat和mstat命令返回文件的哈希值
+        self.hash_cache = file_meta.HashCache(HASH_CACHE_SIZE)
+        # 创建一个历史列表对象，用于lsv命令对比客户端缓存的列表版本，只发送没有变化的标记或增量
+        self.listing_history = listing_cache.ListingHistory(LISTING_HISTORY_SIZE)
+        # 创建一个文件名索引，用于find命令，在start方法中启动后台线程建立索引
+        self.file_index = file_index.FileIndex(BASE_DIR, INDEX_SCAN_INTERVAL) if INDEX_SCAN_INTERVAL else None
+        # 创建一个内容寻址存储对象，用于上传去重
+        self.content_store = upload_store.ContentStore(CONTENT_STORE_DIR) if CONTENT_STORE_DIR else None
+        # 创建采样分析器和会话分析器，用于在运行中的服务器上定位性能问题
+        self.sampler = profiler.SamplingProfiler()
+        self.session_profiler = profiler.SessionProfiler()
+        # 创建一个字典，用于存储当前连接的所有会话，键是会话编号
+        self.sessions = {}
+        # 创建一个socket对象，绑定IP地址和端口号并开始监听客户端的连接
+        self.server_sock = server_sock or net_utils.create_listener(HOST, PORT, LISTEN_BACKLOG)
         # 打印服务器启动的消息
-        print('FTP服务器启动，监听地址：', HOST, ':', PORT)
+        logger.info('server_start', host=HOST, port=self.server_sock.getsockname()[1], pid=os.getpid())
 
     # 启动服务器的方法
     def start(self):
+        # 启动文件名索引的后台线程
+        if self.file_index:
+            self.file_index.start()
+        # 多进程模式下启动处理其他工作进程转来的中止请求的后台线程
+        if PREFORK_WORKERS:
+            threading.Thread(target=self.watch_remote_aborts, daemon=True, name='abort-watch').start()
         # 循环接受客户端的连接
         while True:
             # 接受客户端的连接，返回一个客户端的socket对象和地址
             client_sock, client_addr = self.server_sock.accept()
             # 打印客户端连接的消息
-            print('客户端连接：', client_addr)
+            logger.info('client_connect', client=client_addr)
+            # 开启TCP保活探测，客户端掉线后能及时发现并释放处理线程
+            net_utils.enable_keepalive(client_sock)
             # 创建一个子线程，用于处理客户端的请求
             threading.Thread(target=self.handle_client, args=(client_sock, client_addr)).start()
 
@@ -49,88 +113,290 @@ class FTPServer:
         db = db_manager.DBManager()
         # 发送一个欢迎消息给客户端
         client_sock.send('欢迎使用FTP服务器'.encode())
-        # 初始化客户端的当前目录为服务器的根目录
-        current_dir = BASE_DIR
+        # 创建一个会话对象，保存该客户端的用户名、当前目录和断点，初始目录为服务器的根目录
+        session = Session(BASE_DIR)
+        self.sessions[session.id] = session
+        # 当前连接的客户端数加一
+        metrics.ACTIVE_SESSIONS.inc()
+        # 增加一个变量，用于存储流水线对象，客户端第一次使用流水线模式时创建
+        pipe = None
         # 循环接收客户端的命令
         while True:
             # 尝试接收客户端的命令
             try:
-                # 接收客户端的命令
-                command = client_sock.recv(BUFFER_SIZE).decode()
-                # 在控制台打印客户端的命令
-                print('接收命令：', command)
-                # 如果命令为空，就跳过本次循环
+                # 接收客户端的命令，上一次上传时多收到的命令数据先处理
+                if session.pending_input:
+                    data, session.pending_input = session.pending_input, b''
+                else:
+                    data = client_sock.recv(BUFFER_SIZE)
+                # 如果命令以#开头，说明客户端使用带请求编号的流水线模式，处理完所有完整的请求后，
+                # 如果后面紧跟着普通命令，就继续按普通命令处理
+                if data.startswith(b'#'):
+                    pipe = pipe or pipeline.Pipeline(client_sock)
+                    data = self.handle_pipeline(client_sock, data, pipe, session, db, client_addr)
+                    if data is None:
+                        continue
+                # 执行普通命令之前，等待流水线中的只读命令执行完，避免响应交错
+                if pipe:
+                    pipe.wait()
+                command = data.decode()
+                # 记录客户端的命令，按采样率抽样
+                logger.command(command, client=client_addr, user=session.username)
+                # 如果命令为空，说明客户端已关闭连接，就交给异常处理，保存会话并退出循环
                 if not command:
-                    continue
+                    raise ConnectionError('客户端关闭连接')
                 # 如果命令不是支持的FTP命令，就发送一个错误消息给客户端
                 if command.split(' ')[0] not in COMMANDS:
                     client_sock.send('错误的命令'.encode())
                     continue
-                # 根据不同的命令，执行不同的操作
-                if command == 'ls':
-                    # 如果是ls命令，就发送当前目录和文件列表给客户端
-                    self.list_dir(client_sock, current_dir)
-                elif command.startswith('cd'):
-                    # 如果是cd命令，就切换当前目录，并发送结果给客户端
-                    current_dir = self.change_dir(client_sock, command, current_dir)
-                elif command.startswith('get'):
-                    # 如果是get命令，就发送文件给客户端
-                    self.send_file(client_sock, command, current_dir)
-                elif command.startswith('put'):
-                    # 如果是put命令，就接收文件并保存
-                    self.receive_file(client_sock, command, current_dir)
-                elif command.startswith('restart'):
-                    # 如果是restart命令，就设置断点
-                    self.set_breakpoint(client_sock, command)
-                elif command.startswith('login'):
-                    # 如果是login命令，就处理登录请求
-                    self.verify_user_credentials(client_sock, command, db)
-                elif command.startswith('register'):
-                    # 如果是register命令，就处理注册请求
-                    self.add_user_to_database(client_sock, command, db)
-                elif command == 'quit':
-                    # 如果是quit命令，就关闭客户端的socket，退出循环
+                if command == 'quit':
+                    # 如果是quit命令，客户端正常退出，会话不再需要恢复，就删除会话令牌
+                    if session.token:
+                        db.delete_session(session.token, time.time())
+                    # 关闭客户端的socket，退出循环
                     client_sock.close()
                     break
-            # 如果发生异常，就关闭客户端的socket，退出循环
+                # 执行命令
+                self.dispatch_command(client_sock, command, session, db)
+            # 如果发生异常，就保存会话，关闭客户端的socket，退出循环
             except Exception as e:
-                print('客户端断开：', client_addr)
+                logger.info('client_disconnect', client=client_addr, user=session.username, reason=str(e))
+                self.save_session(db, session)
                 client_sock.close()
                 break
+        # 关闭流水线的后台线程
+        if pipe:
+            pipe.close()
+        # 会话结束时，如果还在分析，就写出分析结果
+        self.session_profiler.stop(session)
+        self.sessions.pop(session.id, None)
+        # 当前连接的客户端数减一
+        metrics.ACTIVE_SESSIONS.dec()
+
+    # 执行一条命令的方法，普通模式和流水线模式共用，client_sock可以是真正的socket，也可以是流水线的响应缓冲区
+    def dispatch_command(self, client_sock, command, session, db):
+        # 记录命令开始处理的时间，用于统计每个命令的耗时
+        verb = command.split(' ')[0]
+        start_time = time.perf_counter()
+        # 如果管理员要求分析这个会话，就在处理命令前开始或结束分析
+        self.session_profiler.check(session)
+        # 根据不同的命令，执行不同的操作
+        if command == 'ls':
+            # 如果是ls命令，就发送当前目录和文件列表给客户端
+            self.list_dir(client_sock, session.current_dir)
+        elif binary_listing.is_binary_command(command):
+            # 如果是ls -b或lsv -b命令，就用二进制格式发送文件列表
+            self.list_dir_binary(client_sock, command, session.current_dir)
+        elif command.startswith('lsv'):
+            # 如果是lsv命令，就对比客户端缓存的列表版本，发送没有变化的标记、增量或完整的列表
+            self.list_dir_versioned(client_sock, command, session.current_dir)
+        elif command.startswith('cd'):
+            # 如果是cd命令，就切换当前目录，并发送结果给客户端
+            session.current_dir = self.change_dir(client_sock, command, session.current_dir)
+        elif data_channel.is_passive_command(command):
+            # 如果是get -p或put -p命令，就打开一个数据端口，在后台线程中通过数据连接传输文件
+            self.start_passive_transfer(client_sock, command, session)
+        elif command.startswith('getdir'):
+            # 如果是getdir命令，就把目录打包成归档流发送给客户端
+            self.send_dir(client_sock, command, session.current_dir)
+        elif command.startswith('putdir'):
+            # 如果是putdir命令，就接收归档流并解包到当前目录
+            self.receive_dir(client_sock, command, session.current_dir)
+        elif command.startswith('get'):
+            # 如果是get命令，就发送文件给客户端
+            self.send_file(client_sock, command, session)
+        elif command.startswith('put'):
+            # 如果是put命令，就接收文件并保存
+            self.receive_file(client_sock, command, session)
+        elif command.startswith('restart'):
+            # 如果是restart命令，就设置断点
+            self.set_breakpoint(client_sock, command, session)
+        elif command.startswith('login'):
+            # 如果是login命令，就处理登录请求
+            self.verify_user_credentials(client_sock, command, db, session)
+        elif command.startswith('register'):
+            # 如果是register命令，就处理注册请求
+            self.add_user_to_database(client_sock, command, db)
+        elif command.startswith('limit'):
+            # 如果是limit命令，就查看或调整限速
+            self.set_rate_limit(client_sock, command, session)
+        elif command.startswith('profile'):
+            # 如果是profile命令，就开始性能分析
+            self.start_profile(client_sock, command, session)
+        elif command.startswith('resume'):
+            # 如果是resume命令，就凭令牌恢复断线前的会话
+            self.resume_session(client_sock, command, db, session)
+        elif command.startswith('stat') or command.startswith('mstat'):
+            # 如果是stat或mstat命令，就发送文件的元数据给客户端
+            self.stat_paths(client_sock, command, session.current_dir)
+        elif command.startswith('find'):
+            # 如果是find命令，就在文件名索引中查找，分批发送结果给客户端
+            self.find_files(client_sock, command, session.current_dir)
+        elif command == 'noop':
+            # 如果是noop命令，就只回复OK，客户端的连接池用它检查空闲的连接是否还可用
+            client_sock.send('OK'.encode())
+        elif command.startswith('abort'):
+            # 如果是abort命令，就中止另一个连接上正在进行的下载
+            self.abort_transfer(client_sock, command, session, db)
+        # 记录命令的处理耗时
+        metrics.COMMAND_SECONDS.observe(time.perf_counter() - start_time, (verb,))
+
+    # 执行一条只读命令的方法，current_dir是提交命令时会话的当前目录，命令在后台线程中执行，不能访问会话和数据库
+    def dispatch_read_only(self, client_sock, command, current_dir):
+        verb = command.split(' ')[0]
+        start_time = time.perf_counter()
+        if command == 'ls':
+            self.list_dir(client_sock, current_dir)
+        elif binary_listing.is_binary_command(command):
+            self.list_dir_binary(client_sock, command, current_dir)
+        elif command.startswith('lsv'):
+            self.list_dir_versioned(client_sock, command, current_dir)
+        elif command.startswith('stat') or command.startswith('mstat'):
+            self.stat_paths(client_sock, command, current_dir)
+        elif command.startswith('find'):
+            self.find_files(client_sock, command, current_dir)
+        elif command == 'noop':
+            client_sock.send('OK'.encode())
+        metrics.COMMAND_SECONDS.observe(time.perf_counter() - start_time, (verb,))
+
+    # 处理流水线请求的方法，data是已经收到的数据，每行是一条“#编号 命令”形式的请求
+    # 数据不完整时继续接收，所有完整的请求都处理完后返回None；如果后面紧跟着普通命令，就把它返回给调用者
+    def handle_pipeline(self, client_sock, data, pipe, session, db, client_addr):
+        while True:
+            # 处理所有完整的请求
+            while b'\n' in data:
+                line, data = data.split(b'\n', 1)
+                request_id, command = pipeline.parse_request(line)
+                logger.command(command, client=client_addr, user=session.username, request_id=request_id)
+                verb = command.split(' ')[0]
+                # 带有数据传输的命令不能在流水线模式中使用，get -p和put -p的文件数据走数据连接，可以使用
+                if verb not in PIPELINE_COMMANDS and not data_channel.is_passive_command(command):
+                    pipe.reply(request_id, '错误的命令'.encode())
+                # 只读命令在后台线程中执行，使用提交时的当前目录，响应可能先于前面的命令返回
+                # 命令和当前目录都用默认参数绑定提交时的值，之后的命令修改了这两个变量也不会影响排队中的命令
+                elif verb in READ_ONLY_COMMANDS:
+                    pipe.submit(request_id, lambda sock, command=command, current_dir=session.current_dir: self.dispatch_read_only(sock, command, current_dir))
+                # 会修改会话状态的命令要等前面的只读命令都执行完，再按顺序执行
+                else:
+                    pipe.wait()
+                    pipe.run(request_id, lambda sock: self.dispatch_command(sock, command, session, db))
+            # 所有请求都处理完了，回到普通模式
+            if not data:
+                return None
+            # 剩下的数据不是流水线请求，说明是紧跟着的普通命令
+            if not data.startswith(b'#'):
+                return data
+            # 最后一个请求还不完整，继续接收
+            more = client_sock.recv(BUFFER_SIZE)
+            if not more:
+                raise ConnectionError('客户端关闭连接')
+            data += more
 
     # 发送当前目录和文件列表给客户端的方法
     def list_dir(self, client_sock, current_dir):
+        # 把当前目录和文件列表拼接成一个字符串，用换行符分隔
+        response = current_dir + '\n' + '\n'.join(self.list_entries(current_dir))
+        # 发送响应给客户端
+        client_sock.send(response.encode())
+
+    # 按客户端缓存的列表版本发送文件列表的方法，命令格式为lsv 版本号，客户端没有缓存时版本号为-
+    def list_dir_versioned(self, client_sock, command, current_dir):
+        _, _, version = command.partition(' ')
+        entries = self.list_entries(current_dir)
+        client_sock.send(self.listing_history.response(current_dir, entries, version.strip() or listing_cache.NO_VERSION).encode())
+
+    # 用二进制格式发送文件列表的方法，命令格式为ls -b或lsv -b 版本号，每个条目带有类型、大小和修改时间
+    def list_dir_binary(self, client_sock, command, current_dir):
+        parts = command.split(' ')
+        entries = self.scan_entries(current_dir)
+        if parts[0] == 'ls':
+            client_sock.sendall(binary_listing.encode(current_dir, entries))
+        else:
+            version = parts[2] if len(parts) > 2 and parts[2] else listing_cache.NO_VERSION
+            client_sock.sendall(self.listing_history.binary_response(current_dir, entries, version))
+
+    # 获取当前目录的二进制格式的文件列表的方法，返回(类型, 大小, 修改时间, 名称)的列表
+    def scan_entries(self, current_dir):
+        if current_dir == '\\':
+            return [(binary_listing.DRIVE, 0, 0, drive) for drive in self.list_entries(current_dir)]
+        entries = binary_listing.scan(current_dir)
+        metrics.LISTING_ENTRIES.observe(len(entries))
+        return entries
+
+    # 获取当前目录的文件列表的方法，ls和lsv命令共用，返回一个列表，目录名后面加上\，文件名前面加上文件大小
+    def list_entries(self, current_dir):
         # 如果当前目录是\\，就列出所有磁盘
         if current_dir == '\\':
             # 获取所有磁盘的名称
             drives = os.popen('wmic logicaldisk get name').read().split()
             # 去掉列表中的第一个元素，它是一个标题
             drives.pop(0)
-            # 把当前目录和磁盘列表拼接成一个字符串，用换行符分隔
-            response = current_dir + '\n' + '\n'.join(drives)
+            return drives
         # 否则，就列出当前目录下的所有文件和文件夹
-        else:
-            # 获取当前目录下的所有文件和文件夹
-            files = os.listdir(current_dir)
-            # 创建一个空列表，用于存储加上\的目录名和文件大小
-            dir_files = []
-            # 循环遍历文件列表
-            for file in files:
-                # 拼接当前目录和文件名，得到文件的完整路径
-                filepath = os.path.join(current_dir, file)
-                # 如果文件是一个目录，就在文件名后面加上\
-                if os.path.isdir(filepath):
-                    file += '\\'
-                # 否则，就获取文件的大小，以字节为单位
-                else:
-                    size = os.path.getsize(filepath)
-                    file = str(size) + ' ' + file
-                # 把文件名添加到列表中
-                dir_files.append(file)
-            # 把当前目录和文件列表拼接成一个字符串，用换行符分隔
-            response = current_dir + '\n' + '\n'.join(dir_files)
-        # 发送响应给客户端
-        client_sock.send(response.encode())
+        # 获取当前目录下的所有文件和文件夹
+        files = os.listdir(current_dir)
+        # 创建一个空列表，用于存储加上\的目录名和文件大小
+        dir_files = []
+        # 循环遍历文件列表
+        for file in files:
+            # 拼接当前目录和文件名，得到文件的完整路径
+            filepath = os.path.join(current_dir, file)
+            # 如果文件是一个目录，就在文件名后面加上\
+            if os.path.isdir(filepath):
+                file += '\\'
+            # 否则，就获取文件的大小，以字节为单位
+            else:
+                size = os.path.getsize(filepath)
+                file = str(size) + ' ' + file
+            # 把文件名添加到列表中
+            dir_files.append(file)
+        # 记录本次列目录返回的条目数
+        metrics.LISTING_ENTRIES.observe(len(dir_files))
+        return dir_files
+
+    # 发送文件元数据的方法，响应的第一行是OK，之后每行是一个路径的类型、大小、修改时间、哈希值和路径，用制表符分隔
+    def stat_paths(self, client_sock, command, current_dir):
+        paths, compute = file_meta.parse_command(command)
+        if not paths:
+            client_sock.send('ERROR 错误的参数'.encode())
+            return
+        lines = [file_meta.stat_line(current_dir, path, self.hash_cache, compute) for path in paths]
+        client_sock.send(('OK\n' + '\n'.join(lines)).encode())
+
+    # 查找文件的方法，在当前目录下按通配符或正则表达式查找，结果是相对于当前目录的路径，目录以/结尾
+    # 响应的第一行是OK，之后每行一个路径，结果较多时分批发送，最后一行是结束标记和结果的条数
+    def find_files(self, client_sock, command, current_dir):
+        if not self.file_index:
+            client_sock.send('ERROR 没有启用文件索引'.encode())
+            return
+        base = self.file_index.relpath(current_dir)
+        if base is None:
+            client_sock.send('ERROR 当前目录不在索引范围内'.encode())
+            return
+        try:
+            pattern, regex, limit = file_index.parse_command(command)
+            results = self.file_index.find(pattern, base, regex, limit)
+        # 如果参数缺失或者正则表达式有错误，就发送一个失败的响应给客户端
+        except (ValueError, re.error):
+            client_sock.send('ERROR 错误的参数'.encode())
+            return
+        client_sock.sendall(b'OK\n')
+        count = 0
+        batch = []
+        for path in results:
+            batch.append(path)
+            if len(batch) >= file_index.BATCH_SIZE:
+                client_sock.sendall(('\n'.join(batch) + '\n').encode())
+                count += len(batch)
+                batch = []
+        count += len(batch)
+        batch.append(f'{file_index.END_MARK}{count}')
+        client_sock.sendall(('\n'.join(batch) + '\n').encode())
+
+    # 上传完成后更新文件名索引的方法
+    def index_upload(self, path):
+        if self.file_index:
+            self.file_index.add(path)
 
     # 切换当前目录并发送结果给客户端的方法
     def change_dir(self, client_sock, command, current_dir):
@@ -140,20 +406,21 @@ class FTPServer:
         if target_dir == '..':
             # 如果当前目录是磁盘的根目录，就返回一个特殊的目录，表示所有磁盘
             if current_dir.endswith(':\\'):
-                current_dir = '\\'
-            # 否则，就返回上一级目录
+                new_dir = '\\'
+            # 否则，就返回上一级目录，同时去掉Windows和当前系统的路径分隔符
             else:
-                current_dir = os.path.dirname(current_dir.rstrip('\\'))
+                new_dir = os.path.dirname(current_dir.rstrip('\\' + os.sep))
         # 否则，就拼接当前目录和目标目录，得到新的目录
         else:
-            # 如果目标目录不以\结尾，就加上\
-            if not target_dir.endswith('\\'):
-                target_dir += '\\'
-            current_dir = os.path.join(current_dir, target_dir)
-        # 如果新的目录存在，就发送一个成功的响应给客户端
-        if os.path.exists(current_dir):
+            # 如果目标目录不以路径分隔符结尾，就加上当前系统的路径分隔符（Windows上是\）
+            if not target_dir.endswith(('\\', os.sep)):
+                target_dir += os.sep
+            new_dir = os.path.join(current_dir, target_dir)
+        # 如果新的目录存在，就切换到新的目录，并发送一个成功的响应给客户端
+        if os.path.isdir(new_dir):
+            current_dir = new_dir
             response = 'OK ' + current_dir
-        # 否则，就发送一个失败的响应给客户端
+        # 否则，保持原来的目录不变，并发送一个失败的响应给客户端
         else:
             response = '目录不存在'
         # 发送响应给客户端  
@@ -162,107 +429,500 @@ class FTPServer:
         return current_dir
 
     # 发送文件给客户端的方法
-    def send_file(self, client_sock, command, current_dir):
+    def send_file(self, client_sock, command, session):
         # 把命令分割为两部分，第一部分是get，第二部分是文件名
         _, filename = command.split(' ', 1)
         # 拼接当前目录和文件名，得到文件的完整路径
-        filepath = os.path.join(current_dir, filename)
+        filepath = os.path.join(session.current_dir, filename)
         # 如果文件存在，就发送一个成功的响应给客户端，包括文件名和文件大小
-        if os.path.exists(filepath):
-            filesize = os.path.getsize(filepath)
-            response = 'OK ' + str(filesize) + ' ' + filename
+        if os.path.isfile(filepath):
+            stat = os.stat(filepath)
+            response = 'OK ' + str(stat.st_size) + ' ' + filename
             client_sock.send(response.encode())
-            # 打开文件，准备读取数据
-            with open(filepath, 'rb') as f:
-                # 初始化已发送的字节数为0
-                sent = 0
-                # 增加一个try-except语句，用于捕获异常
-                try:
-                    print(self.breakpoint)
-                    # 如果断点不为0，就从断点处开始读取数据
-                    if self.breakpoint != 0:
-                        # 移动文件指针到断点处
-                        f.seek(self.breakpoint)
-                        # 从断点处开始累加已发送的字节数
-                        sent = self.breakpoint
-                    # 循环读取数据，直到文件发送完毕
-                    while sent < filesize:
-                        # 读取数据
-                        data = f.read(BUFFER_SIZE)
-                        # 发送数据
-                        client_sock.send(data)
-                        # 累加已发送的字节数
-                        sent += len(data)
-                    # 在控制台打印发送完成的消息
-                    print(sent)
-                    print('发送完成：', filename)
-                # 如果发生异常，就发送一个异常的响应给客户端，并打印异常信息
-                except Exception as e:
-                    print('发送异常：', e)
+            self.send_file_data(client_sock, filepath, stat, session)
         # 否则，就发送一个失败的响应给客户端
         else:
             response = '文件不存在'
             client_sock.send(response.encode())
 
+    # 发送文件数据的方法，从会话的断点处开始发送，控制连接和数据连接共用
+    def send_file_data(self, client_sock, filepath, stat, session):
+        filesize = stat.st_size
+        # 打开文件，准备读取数据
+        with open(filepath, 'rb') as f:
+            # 初始化已发送的字节数为0
+            sent = 0
+            start_offset = 0
+            # 记录开始发送的时间，用于统计吞吐量
+            start_time = time.perf_counter()
+            # 增加一个属性，用于标记传输是否成功
+            ok = False
+            # 增加一个try-except语句，用于捕获异常
+            try:
+                # 如果断点不为0，就从断点处开始读取数据
+                if session.breakpoint != 0:
+                    # 移动文件指针到断点处
+                    f.seek(session.breakpoint)
+                    # 从断点处开始累加已发送的字节数
+                    sent = start_offset = session.breakpoint
+                # 在会话中记录正在进行的传输，并为它分配带宽
+                session.begin_transfer('get', filepath, sent)
+                self.bandwidth.begin_transfer(session)
+                # 大文件从共享的内存映射中发送，小文件或无法映射时按原来的方式读取
+                # 用打开的文件的信息检查缓存的映射，响应发出之后文件被修改或替换时不会用错映射，大小变了就不使用映射
+                current = os.fstat(f.fileno())
+                mapped = self.map_cache.acquire(filepath, current) if current.st_size == filesize else None
+                if mapped is not None:
+                    try:
+                        sent = mmap_cache.send_mapped(client_sock, mapped, sent,
+                                                      lambda n: self.bandwidth.throttle(session, n),
+                                                      lambda offset: setattr(session, 'transfer_offset', offset),
+                                                      lambda: session.abort_requested)
+                    finally:
+                        self.map_cache.release(mapped)
+                    f.seek(sent)
+                # 循环读取数据，直到文件发送完毕，或者客户端用abort命令中止了下载
+                while sent < filesize and not session.abort_requested:
+                    # 读取数据，文件在发送过程中变短时停止，不在原地空转
+                    data = f.read(BUFFER_SIZE)
+                    if not data:
+                        raise IOError('文件在发送过程中被截断')
+                    # 按限速等待，再发送数据
+                    self.bandwidth.throttle(session, len(data))
+                    # 发送数据，中止时要回复准确的发送位置，所以用sendall保证整块发送出去
+                    client_sock.sendall(data)
+                    # 累加已发送的字节数
+                    sent += len(data)
+                    session.transfer_offset = sent
+                # 传输完成或被中止，清除会话中的传输信息
+                session.end_transfer()
+                ok = sent >= filesize
+                if not ok:
+                    logger.info('transfer_abort', file=filepath, offset=sent, user=session.username)
+            # 如果发生异常，就记录异常信息
+            except Exception as e:
+                logger.warning('send_error', file=filepath, error=str(e))
+            # 无论传输是否成功，都要把带宽让给其他传输，通知等待中止的线程，并记录传输的汇总信息
+            finally:
+                self.bandwidth.end_transfer(session)
+                session.stop_transfer(sent)
+                duration = time.perf_counter() - start_time
+                metrics.observe_transfer('get', sent - start_offset, duration)
+                logger.transfer('get', filepath, sent - start_offset, duration, start_offset, ok, user=session.username)
+
+    # 中止另一个连接上正在进行的下载的方法，命令格式为abort 令牌，令牌是发起下载的会话的令牌
+    # 客户端取消下载时用一个新连接发送这个命令，原来的连接正在接收文件数据，不能用来发送命令
+    # 发送循环停下来后回复OK 发送结束的位置，客户端只需要接收并丢弃这个位置之前还在途中的数据，不必等整个文件发送完
+    # 多进程模式下新连接可能被分配到另一个工作进程，本进程中没有这个令牌的会话时，通过数据库把请求转给其他工作进程
+    def abort_transfer(self, client_sock, command, session, db):
+        parts = command.split(' ')
+        token = parts[1] if len(parts) > 1 else ''
+        offset = None
+        if token:
+            if any(s.token == token for s in list(self.sessions.values()) if s is not session):
+                offset = self.stop_downloads(token, session)
+            elif PREFORK_WORKERS:
+                offset = self.request_remote_abort(db, token)
+        if offset is None:
+            client_sock.send('ERROR 没有正在进行的下载'.encode())
+        else:
+            client_sock.send(f'OK {offset}'.encode())
+
+    # 中止本进程中某个令牌的所有下载的方法，包括控制连接上的下载和数据连接上的下载
+    # 返回控制连接上的下载停下来的位置，只有数据连接上的下载时返回其中一个的位置，没有正在进行的下载时返回None
+    def stop_downloads(self, token, exclude=None):
+        offset = None
+        for target in [s for s in list(self.sessions.values()) if s.token == token and s is not exclude]:
+            stopped = target.abort_transfer()
+            if stopped is not None and (offset is None or target.data_sock is None):
+                offset = stopped
+        return offset
+
+    # 把中止请求转给其他工作进程的方法，写入数据库后等待处理结果，超时或者没有正在进行的下载时返回None
+    def request_remote_abort(self, db, token):
+        db.request_abort(token, time.time())
+        deadline = time.monotonic() + ABORT_TIMEOUT
+        try:
+            while time.monotonic() < deadline:
+                offset = db.abort_result(token)
+                if offset is not None:
+                    return offset if offset >= 0 else None
+                time.sleep(ABORT_POLL_INTERVAL / 2)
+            return None
+        finally:
+            db.delete_abort(token)
+
+    # 处理其他工作进程转来的中止请求的方法，在多进程模式下由后台线程执行
+    # 只处理本进程中有会话的令牌，其他令牌留给它们所在的工作进程
+    def watch_remote_aborts(self):
+        db = db_manager.DBManager()
+        while True:
+            time.sleep(ABORT_POLL_INTERVAL)
+            try:
+                for token in db.pending_aborts():
+                    if any(s.token == token for s in list(self.sessions.values())):
+                        offset = self.stop_downloads(token)
+                        db.finish_abort(token, -1 if offset is None else offset)
+            except Exception as e:
+                logger.warning('abort_watch_error', error=str(e))
+
     # 接收文件并保存的方法
-    def receive_file(self, client_sock, command, current_dir):
-        # 把命令分割为两部分，第一部分是put，第二部分是客户端的文件路径
-        _, filename = command.split(' ', 1)
+    def receive_file(self, client_sock, command, session):
+        # 解析命令，得到客户端的文件路径和客户端计算的哈希值
+        filename, claimed = self.parse_put_command(command)
         # 用os.path.basename函数来提取出文件名
         base_filename = os.path.basename(filename)
         # 拼接当前目录和文件名，得到文件的完整路径
-        filepath = os.path.join(current_dir, base_filename)
-        print(current_dir)
-        print(base_filename)
-        print(filepath)
+        filepath = os.path.join(session.current_dir, base_filename)
+        # 如果存储中已经有相同内容的文件，就直接链接到目标位置，告诉客户端不需要发送数据
+        if self.link_stored(filepath, claimed, session):
+            client_sock.send(('EXISTS ' + filename).encode())
+            return
         # 如果文件不存在，就发送一个成功的响应给客户端，包括文件名
         # if not os.path.exists(filepath):
         response = 'OK ' + filename
         client_sock.send(response.encode())
-        # 接收客户端发送的文件大小
-        filesize = int(client_sock.recv(BUFFER_SIZE).decode())
+        self.receive_file_data(client_sock, filepath, claimed, session)
+
+    # 上传去重的方法，存储中已经有客户端声明的哈希值对应的内容时，直接链接到目标位置，返回True
+    def link_stored(self, filepath, claimed, session):
+        if not (claimed and self.content_store):
+            return False
+        if self.content_store.link_into(claimed, filepath):
+            metrics.CACHE_REQUESTS.inc(1, ('content_store', 'hit'))
+            self.map_cache.invalidate(filepath)
+            self.hash_cache.put(filepath, os.stat(filepath), claimed)
+            self.index_upload(filepath)
+            logger.info('dedup_hit', file=filepath, digest=claimed, user=session.username)
+            return True
+        metrics.CACHE_REQUESTS.inc(1, ('content_store', 'miss'))
+        return False
+
+    # 接收文件数据并保存的方法，先接收文件大小，再从会话的断点处开始接收，控制连接和数据连接共用
+    def receive_file_data(self, client_sock, filepath, claimed, session):
+        # 接收客户端发送的文件大小，客户端在文件大小后面加一个换行符，
+        # 紧跟着发送的文件数据可能和文件大小在同一次recv中到达，换行符之后的部分就是文件数据
+        header, _, leftover = client_sock.recv(BUFFER_SIZE).partition(b'\n')
+        filesize = int(header.decode())
+        # 记录开始接收的时间和断点，用于统计吞吐量
+        start_time = time.perf_counter()
+        received = start_offset = session.breakpoint
+        # 增加一个属性，用于标记传输是否成功
+        ok = False
         # 在接收文件的方法中，增加一个try-except语句，用于捕获异常
         try:
-            # 以追加模式或写入模式打开文件
-            with open(filepath, 'ab' if self.breakpoint != 0 else 'wb') as f:
-                # 从断点处开始累加已接收的字节数
-                received = self.breakpoint
-                # 循环接收数据，直到文件接收完毕
-                while received < filesize:
-                    # 接收数据
-                    data = client_sock.recv(BUFFER_SIZE)
-                    # 写入数据
-                    f.write(data)
-                    # 累加已接收的字节数
-                    received += len(data)
-            # 在控制台打印接收完成的消息
-            print('接收完成：', filename)
-        # 如果发生异常，就打印异常信息
+            # 打开上传的临时文件，接收完毕后才替换目标文件，正在下载旧文件的客户端不受影响
+            # 临时文件名带上会话的标识，其他会话同时上传同一个文件时不会互相覆盖
+            f = upload_store.open_temp(filepath, session.breakpoint, session.upload_owner())
+            try:
+                # 按文件大小预先分配磁盘空间，并按持久化策略创建刷盘对象
+                upload_store.preallocate(f, received, filesize)
+                syncer = upload_store.Syncer(f, DURABILITY, SYNC_INTERVAL)
+                # 在会话中记录正在进行的传输，并为它分配带宽
+                session.begin_transfer('put', filepath, received)
+                self.bandwidth.begin_transfer(session)
+                # 客户端提供了哈希值时，边接收边计算哈希值，续传时先补算已经接收的部分
+                digest = None
+                if claimed and self.content_store:
+                    digest = hashlib.sha256()
+                    if received:
+                        f.flush()
+                        upload_store.file_digest(f.name, received, digest)
+                # 先写入和文件大小一起到达的数据，超出文件大小的部分是客户端紧接着发送的下一条命令，留给命令循环处理
+                session.pending_input = leftover[max(filesize - received, 0):]
+                leftover = leftover[:max(filesize - received, 0)]
+                if leftover:
+                    f.write(leftover)
+                    received += len(leftover)
+                    if digest:
+                        digest.update(leftover)
+                # 用当前线程的接收缓冲区接收剩余的数据，每次接收后按限速等待，接收变慢后TCP的流量控制会让客户端放慢发送
+                def on_chunk(n):
+                    nonlocal received
+                    self.bandwidth.throttle(session, n)
+                    syncer.written(n)
+                    received += n
+                    session.transfer_offset = received
+                net_utils.recv_buffer().recv_into_file(client_sock, f, filesize - received, received, on_chunk, digest)
+                # 接收完毕，刷盘并替换目标文件，再使目标文件旧的内存映射失效
+                upload_store.commit(f, filepath, filesize, syncer)
+                self.map_cache.invalidate(filepath)
+                self.index_upload(filepath)
+                # 哈希值和客户端声明的一致时，把文件加入存储，不一致时不加入，防止错误的内容被其他用户秒传
+                if digest:
+                    if digest.hexdigest() == claimed:
+                        self.content_store.add(filepath, claimed)
+                        self.hash_cache.put(filepath, os.stat(filepath), claimed)
+                    else:
+                        logger.warning('dedup_mismatch', file=filepath, claimed=claimed, actual=digest.hexdigest())
+            finally:
+                f.close()
+            # 传输完成，清除会话中的传输信息
+            session.end_transfer()
+            ok = True
+        # 如果发生异常，就记录异常信息，再抛出给handle_client，由它保存会话并关闭连接
         except Exception as e:
-            print('接收异常：', e)
-        # 否则，就发送一个失败的响应给客户端
-        # else:
-        #     response = '文件已存在'
-        #     client_sock.send(response.encode())
+            logger.warning('receive_error', file=filepath, error=str(e))
+            raise
+        # 无论传输是否成功，都要把带宽让给其他传输，并记录传输的汇总信息
+        finally:
+            self.bandwidth.end_transfer(session)
+            duration = time.perf_counter() - start_time
+            metrics.observe_transfer('put', received - start_offset, duration)
+            logger.transfer('put', filepath, received - start_offset, duration, start_offset, ok, user=session.username)
+
+    # 通过数据连接传输文件的方法，命令格式为get -p 文件名或put -p [-h 哈希值] 文件名
+    # 打开一个临时的数据端口，响应中带上端口号和一次性密钥，传输在后台线程中进行，控制连接立即回到命令循环
+    # get -p的响应是OK 文件大小 端口号 密钥 文件名，put -p的响应是OK 端口号 密钥 文件名，去重命中时仍然回复EXISTS 文件名
+    def start_passive_transfer(self, client_sock, command, session):
+        verb, _, rest = command.split(' ', 2)
+        if verb == 'get':
+            filepath = os.path.join(session.current_dir, rest)
+            if not os.path.isfile(filepath):
+                client_sock.send('文件不存在'.encode())
+                return
+            stat = os.stat(filepath)
+            listener, port, key = data_channel.open_listener(self.server_sock.getsockname()[0])
+            client_sock.send(f'OK {stat.st_size} {port} {key} {rest}'.encode())
+            transfer = lambda sock, data_session: self.send_file_data(sock, filepath, stat, data_session)
+        else:
+            filename, claimed = self.parse_put_command('put ' + rest)
+            filepath = os.path.join(session.current_dir, os.path.basename(filename))
+            if self.link_stored(filepath, claimed, session):
+                # 和数据连接上的传输一样，断点只用于这一次上传
+                session.breakpoint = 0
+                client_sock.send(('EXISTS ' + filename).encode())
+                return
+            listener, port, key = data_channel.open_listener(self.server_sock.getsockname()[0])
+            client_sock.send(f'OK {port} {key} {filename}'.encode())
+            transfer = lambda sock, data_session: self.receive_file_passive(sock, filepath, claimed, data_session)
+        # 数据连接上的传输使用单独的会话，断点只用于这一次传输
+        data_session = session.data_session()
+        threading.Thread(target=self.run_data_transfer, args=(listener, key, transfer, data_session), daemon=True,
+                         name=f'data-{verb}-{session.id}').start()
+
+    # 通过数据连接接收文件的方法，保存好文件后在数据连接上回复OK，失败时回复ERROR和原因
+    # 数据连接在成功和失败时都会被关闭，客户端只能通过这个结果判断上传是否成功
+    def receive_file_passive(self, data_sock, filepath, claimed, session):
+        try:
+            self.receive_file_data(data_sock, filepath, claimed, session)
+        except Exception as e:
+            try:
+                data_sock.sendall(f'ERROR {e}'.encode())
+            except OSError:
+                pass
+            raise
+        data_sock.sendall(f'OK {os.path.basename(filepath)}'.encode())
+
+    # 在后台线程中执行一次数据连接上的传输的方法，等待客户端连接数据端口，传输结束后关闭数据连接
+    def run_data_transfer(self, listener, key, transfer, data_session):
+        try:
+            data_sock = data_channel.accept(listener, key)
+        except OSError as e:
+            logger.warning('data_connect_error', user=data_session.username, error=str(e))
+            return
+        # 传输期间把数据连接的会话加入会话字典，abort命令可以凭令牌找到它并关闭数据连接
+        data_session.data_sock = data_sock
+        self.sessions[data_session.id] = data_session
+        try:
+            transfer(data_sock, data_session)
+        # 传输的异常已经由传输方法记录，这里只需要关闭数据连接
+        except Exception:
+            pass
+        finally:
+            self.sessions.pop(data_session.id, None)
+            data_sock.close()
+
+    # 解析上传命令的方法，返回文件路径和哈希值，-h 哈希值选项表示客户端提供了文件内容的SHA-256哈希值
+    def parse_put_command(self, command):
+        _, filename = command.split(' ', 1)
+        if filename.startswith('-h '):
+            _, claimed, filename = filename.split(' ', 2)
+            return filename, claimed.lower()
+        return filename, ''
+
+    # 解析目录传输命令的方法，返回目录名和是否压缩，-z选项表示使用gzip压缩归档流
+    def parse_dir_command(self, command):
+        _, dirname = command.split(' ', 1)
+        compress = dirname.startswith('-z ')
+        if compress:
+            dirname = dirname[3:]
+        return dirname, compress
+
+    # 把目录打包成归档流发送给客户端的方法
+    def send_dir(self, client_sock, command, current_dir):
+        dirname, compress = self.parse_dir_command(command)
+        # 拼接当前目录和目录名，得到目录的完整路径
+        dirpath = os.path.join(current_dir, dirname)
+        # 如果目录不存在，就发送一个失败的响应给客户端
+        if not os.path.isdir(dirpath):
+            client_sock.send('目录不存在'.encode())
+            return
+        # 统计目录中所有文件的总大小，让客户端可以显示解包进度
+        total = 0
+        for root, _, files in os.walk(dirpath):
+            for file in files:
+                total += os.path.getsize(os.path.join(root, file))
+        response = 'OK ' + str(total) + ' ' + os.path.basename(dirpath.rstrip('\\/'))
+        client_sock.send(response.encode())
+        # 等待客户端确认，客户端取消时不再发送归档流，避免白白传输整个目录
+        if client_sock.recv(BUFFER_SIZE).decode() != 'READY':
+            logger.info('send_cancelled', dir=dirpath)
+            return
+        start_time = time.perf_counter()
+        try:
+            count, size = archive_stream.send_archive(client_sock, dirpath, compress)
+            logger.transfer('getdir', dirpath, size, time.perf_counter() - start_time, files=count, compress=compress)
+        # 如果发生异常，就记录异常信息
+        except Exception as e:
+            logger.warning('send_error', dir=dirpath, error=str(e))
+
+    # 接收归档流并解包到当前目录的方法，解包完毕后回复OK 文件数，失败时回复ERROR 原因
+    def receive_dir(self, client_sock, command, current_dir):
+        dirname, _ = self.parse_dir_command(command)
+        # 用os.path.basename函数来提取出目录名，解包到当前目录下的同名目录中
+        dirpath = os.path.join(current_dir, os.path.basename(dirname.rstrip('\\/')))
+        client_sock.send(('OK ' + dirname).encode())
+        start_time = time.perf_counter()
+        try:
+            # 每写好一个文件，就使它旧的内存映射失效，正在下载旧文件的传输继续使用旧的映射
+            count, size = archive_stream.receive_archive(client_sock, dirpath, on_file=self.map_cache.invalidate)
+            logger.transfer('putdir', dirpath, size, time.perf_counter() - start_time, files=count)
+        # 归档流中断时，连接上剩下的数据无法和命令区分开，抛出给handle_client，由它关闭连接
+        except ConnectionError as e:
+            logger.warning('receive_error', dir=dirpath, error=str(e))
+            raise
+        # 其他异常发生时剩下的帧已经被丢弃，记录异常信息并告诉客户端，连接可以继续使用
+        except Exception as e:
+            logger.warning('receive_error', dir=dirpath, error=str(e))
+            client_sock.send(f'ERROR {e}'.encode())
+            return
+        # 出错之前已经写好的文件也在目录中，只要目录已经创建，无论成功与否都更新文件名索引
+        finally:
+            if os.path.isdir(dirpath):
+                self.index_upload(dirpath)
+        client_sock.send(f'OK {count}'.encode())
 
     # 设置断点的方法
-    def set_breakpoint(self, client_sock, command):
-        # 获取断点的位置
-        _, self.breakpoint = command.split(' ', 1)
-        self.breakpoint = int(self.breakpoint)
+    def set_breakpoint(self, client_sock, command, session):
+        # 获取断点的位置，保存在该客户端自己的会话中
+        _, breakpoint = command.split(' ', 1)
+        session.breakpoint = int(breakpoint)
         # 发送断点给客户端
-        response = str(self.breakpoint)
+        response = str(session.breakpoint)
+        client_sock.send(response.encode())
+
+    # 查看或调整限速的方法，速率的单位是字节/秒，可以带K、M、G后缀，0表示不限速
+    # limit：查看当前限速；limit session 速率：限制自己的会话
+    # limit global 速率、limit user 用户名 速率、limit fair on|off：仅管理员可用
+    def set_rate_limit(self, client_sock, command, session):
+        parts = command.split(' ')
+        try:
+            # 如果没有参数，就发送当前的限速设置给客户端
+            if len(parts) == 1:
+                response = 'OK ' + self.bandwidth.describe()
+            # 如果是限制自己的会话，任何用户都可以设置
+            elif parts[1] == 'session':
+                self.bandwidth.set_session_rate(session, rate_limiter.parse_rate(parts[2]))
+                response = 'OK 会话限速：' + str(session.rate_limit)
+            # 其他设置会影响所有用户，只有管理员可以调整
+            elif session.username not in ADMIN_USERS:
+                response = 'ERROR 权限不足'
+            elif parts[1] == 'global':
+                self.bandwidth.set_global_rate(rate_limiter.parse_rate(parts[2]))
+                response = 'OK ' + self.bandwidth.describe()
+            elif parts[1] == 'user':
+                self.bandwidth.set_user_rate(parts[2], rate_limiter.parse_rate(parts[3]))
+                response = 'OK ' + self.bandwidth.describe()
+            elif parts[1] == 'fair':
+                self.bandwidth.set_fair_share(parts[2] == 'on')
+                response = 'OK ' + self.bandwidth.describe()
+            else:
+                response = 'ERROR 错误的参数'
+        # 如果参数缺失或者速率无法解析，就发送一个失败的响应给客户端
+        except (IndexError, ValueError):
+            response = 'ERROR 错误的参数'
+        client_sock.send(response.encode())
+
+    # 开始性能分析的方法，只有管理员可以使用
+    # profile sessions列出当前的会话；profile sample 秒数 [间隔毫秒]采样所有线程；profile session 会话编号 秒数用cProfile分析一个会话
+    def start_profile(self, client_sock, command, session):
+        parts = command.split(' ')
+        try:
+            if session.username not in ADMIN_USERS:
+                response = 'ERROR 权限不足'
+            elif parts[1] == 'sessions':
+                response = 'OK\n' + '\n'.join(f'{s.id} {s.username or "-"} {s.current_dir}' for s in list(self.sessions.values()))
+            elif parts[1] == 'sample':
+                interval = float(parts[3]) / 1000 if len(parts) > 3 else None
+                response = self.start_sampling(float(parts[2]), interval)
+            elif parts[1] == 'session':
+                session_id = int(parts[2])
+                if session_id not in self.sessions:
+                    response = 'ERROR 会话不存在'
+                else:
+                    path = os.path.join(PROFILE_DIR, f'session_{session_id}_{time.strftime("%Y%m%d_%H%M%S")}.prof')
+                    if self.session_profiler.request(session_id, float(parts[3]), path):
+                        response = 'OK ' + path
+                    else:
+                        response = 'ERROR 已有其他会话正在分析'
+            else:
+                response = 'ERROR 错误的参数'
+        # 如果参数缺失或者无法解析，就发送一个失败的响应给客户端
+        except (IndexError, ValueError):
+            response = 'ERROR 错误的参数'
         client_sock.send(response.encode())
 
+    # 开始采样所有线程的方法，profile命令和SIGUSR1信号共用，返回发给客户端的响应
+    def start_sampling(self, seconds, interval=None):
+        # 文件名中加上进程号，多进程模式下各个工作进程同时采样时不会互相覆盖
+        path = os.path.join(PROFILE_DIR, f'sample_{os.getpid()}_{time.strftime("%Y%m%d_%H%M%S")}.folded')
+        if not self.sampler.start(seconds, path, interval):
+            return 'ERROR 正在采样'
+        logger.info('profile_start', seconds=seconds, path=path)
+        return 'OK ' + path
+
+    # 重新加载配置的方法，由SIGHUP信号触发，只应用可以在运行中修改的设置，已经连接的会话和正在进行的传输不会中断
+    # 配置文件有错误时记录警告，继续使用原来的配置
+    def reload_config(self):
+        try:
+            applied, pending = server_config.reload(globals(), CONFIG_FILE, CONFIG_OVERRIDES)
+        except (OSError, ValueError, configparser.Error) as e:
+            logger.warning('config_reload_error', path=CONFIG_FILE, error=str(e))
+            return
+        # 缓冲区大小、管理员列表和持久化策略在每次使用时读取全局变量，下一条命令或下一次传输就会使用新的值
+        # 限速、日志和缓存的设置保存在对象中，只更新配置中有变化的对象，管理员用limit global等命令在运行中做的调整不会被覆盖
+        # 缓存缩小后多出的条目在下一次加入新条目时淘汰
+        if 'LOG_LEVEL' in applied:
+            ftp_logger.set_level(LOG_LEVEL)
+        if 'LOG_SAMPLE_RATE' in applied:
+            ftp_logger.set_sample_rate(LOG_SAMPLE_RATE)
+        if 'RATE_LIMIT' in applied:
+            self.bandwidth.set_global_rate(RATE_LIMIT)
+        if 'LISTING_HISTORY_SIZE' in applied:
+            self.listing_history.size = LISTING_HISTORY_SIZE
+        if 'HASH_CACHE_SIZE' in applied:
+            self.hash_cache.size = HASH_CACHE_SIZE
+        if 'MAP_CACHE_IDLE' in applied:
+            self.map_cache.max_idle = MAP_CACHE_IDLE
+        logger.info('config_reload', path=CONFIG_FILE, applied=','.join(applied))
+        if pending:
+            logger.warning('config_restart_required', settings=','.join(pending))
+
     # 验证用户的凭证，即用户名和密码的方法
-    def verify_user_credentials(self, client_sock, command, db):
+    def verify_user_credentials(self, client_sock, command, db, session):
         # 从命令中分离出用户名和密码
         username, password = command.split(' ')[1:]
-        # 调用DBManager对象的query_user方法，查询用户是否存在
+        # 调用DBManager对象的query_user方法，查询用户是否存在，并记录验证的耗时
+        start_time = time.perf_counter()
         result = db.query_user(username, password)
-        # 如果结果为True，表示用户存在，发送一个成功的响应给客户端
+        metrics.AUTH_SECONDS.observe(time.perf_counter() - start_time, ('ok' if result else 'fail',))
+        # 如果结果为True，表示用户存在，生成会话令牌并保存会话，发送一个带令牌的成功响应给客户端
         if result:
-            client_sock.send(f"OK 登录成功".encode())
+            session.username = username
+            token = session.new_token()
+            self.save_session(db, session)
+            client_sock.send(f"OK 登录成功 {token}".encode())
         # 否则，表示用户不存在，发送一个失败的响应给客户端
         else:
             client_sock.send(f"ERROR 用户名或密码错误".encode())
@@ -280,9 +940,91 @@ class FTPServer:
         else:
             client_sock.send(f"ERROR 用户名已存在".encode())
 
+    # 保存会话的方法，只有登录过的会话才有令牌，才需要保存
+    def save_session(self, db, session):
+        if not session.token:
+            return
+        try:
+            db.save_session(session.token, session.username, session.current_dir, session.transfer_direction,
+                            session.transfer_filename, session.transfer_offset, session.expires())
+        # 保存失败不影响断开连接的处理，只打印异常信息
+        except Exception as e:
+            logger.warning('session_save_error', user=session.username, error=str(e))
+
+    # 凭令牌恢复会话的方法，一次往返就恢复用户、当前目录和断点
+    # 命令格式为resume 令牌 [客户端已接收的字节数]
+    def resume_session(self, client_sock, command, db, session):
+        parts = command.split(' ')
+        token = parts[1]
+        offset = int(parts[2]) if len(parts) > 2 else 0
+        # 从数据库中查询会话
+        result = db.load_session(token, time.time())
+        # 如果会话不存在或已过期，就发送一个失败的响应给客户端
+        if not result:
+            client_sock.send("ERROR 会话已失效".encode())
+            return
+        session.username, session.current_dir, direction, filename, transfer_offset = result
+        session.token = token
+        # 上传中断时，以服务器已写入的字节数为断点；下载中断时，以客户端已收到的字节数为断点
+        session.breakpoint = transfer_offset if direction == 'put' else offset
+        # 延长会话令牌的有效期
+        self.save_session(db, session)
+        client_sock.send(f"OK {session.breakpoint} {session.current_dir}".encode())
+
+# 运行服务器的函数，安装信号处理函数、启动监控指标HTTP服务，然后开始接受连接，单进程模式和工作进程共用
+def serve(ftp_server, metrics_port):
+    # 在支持信号的系统上，收到SIGUSR1信号时采样所有线程，不需要登录管理员账号
+    if hasattr(signal, 'SIGUSR1'):
+        signal.signal(signal.SIGUSR1, lambda signum, frame: ftp_server.start_sampling(PROFILE_SECONDS))
+    # 收到SIGHUP信号时重新加载配置，在单独的线程中进行，信号处理函数打断的主线程可能正持有日志等对象的锁
+    if hasattr(signal, 'SIGHUP'):
+        signal.signal(signal.SIGHUP, lambda signum, frame: threading.Thread(target=ftp_server.reload_config, daemon=True).start())
+    # 启动监控指标HTTP服务
+    if metrics_port:
+        metrics.start_http_server(metrics_port)
+    # 启动FTP服务器
+    ftp_server.start()
+
+
+# 多进程模式下工作进程执行的函数，由监督者在子进程中调用，sock是主进程创建好的监听socket
+# settings是主进程的配置，spawn方式启动的子进程会重新导入模块，需要用它恢复主进程中修改过的全局变量
+def run_worker(index, sock, metrics_port, settings):
+    globals().update(settings)
+    db_manager.DB_NAME = DB_NAME
+    # Ctrl+C由主进程处理，工作进程等主进程终止，fork继承来的终止信号处理函数也要恢复默认
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    serve(FTPServer(sock), metrics_port)
+
+
+# 获取当前配置的函数，返回所有大写的全局变量，传给工作进程
+def current_settings():
+    return {name: value for name, value in globals().items() if name.isupper()}
+
+
+# 解析命令行参数的函数，返回解析结果，所有配置项都可以用命令行参数覆盖配置文件
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='FTP服务器，配置项的优先级依次是命令行参数、配置文件、代码中的默认值')
+    server_config.add_arguments(parser)
+    return parser.parse_args(argv)
+
+
 # 主函数
 if __name__ == '__main__':
+    # 加载配置文件和命令行参数，记录下来供SIGHUP信号重新加载时使用
+    args = parse_args()
+    CONFIG_FILE = args.config
+    CONFIG_OVERRIDES = server_config.overrides_from_args(args)
+    try:
+        server_config.load(globals(), CONFIG_FILE, CONFIG_OVERRIDES)
+    except (OSError, ValueError, configparser.Error) as e:
+        sys.exit(f'配置错误: {e}')
+    db_manager.DB_NAME = DB_NAME
+    # 多进程模式下，主进程只负责启动和监督工作进程，合并后的监控指标由主进程在METRICS_PORT上输出
+    if PREFORK_WORKERS:
+        ftp_logger.setup(level=LOG_LEVEL, rate=LOG_SAMPLE_RATE)
+        prefork.Supervisor(run_worker, PREFORK_WORKERS, HOST, PORT, LISTEN_BACKLOG, METRICS_PORT, (current_settings(),)).run()
+        sys.exit()
     # 创建一个FTP服务器对象
     ftp_server = FTPServer()
-    # 启动FTP服务器
-    ftp_server.start()
\ No newline at end of file
+    serve(ftp_server, METRICS_PORT)
@@ -0,0 +1,139 @@
+# server_config.py
+# 这是一个服务器配置模块，从INI格式的配置文件和命令行参数读取server.py中的设置，命令行参数优先于配置文件
+# 服务器收到SIGHUP信号时重新读取配置文件，只应用可以在运行中安全修改的设置（缓冲区大小、限速、缓存大小、日志级别等），已经连接的会话不会断开
+# 需要重新监听或重新打开文件的设置（地址、端口、根目录、数据库等）在重新加载时只记录下来，重启服务器后才生效
+import configparser
+import os
+import rate_limiter
+
+# 定义一些常量
+DEFAULT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'server.ini') # 默认的配置文件路径，文件不存在时使用代码中的默认值
+LOG_LEVELS = ['DEBUG', 'INFO', 'WARNING', 'ERROR'] # 可选的日志级别
+DURABILITY_MODES = ['none', 'end', 'periodic'] # 可选的上传文件持久化策略
+
+
+# 把逗号分隔的字符串转换为列表的函数，忽略空白的项
+def parse_list(text):
+    return [item.strip() for item in text.split(',') if item.strip()]
+
+
+# 转换日志级别的函数，不在可选范围内时抛出ValueError
+def parse_log_level(text):
+    level = text.strip().upper()
+    if level not in LOG_LEVELS:
+        raise ValueError(f'日志级别只能是{"、".join(LOG_LEVELS)}')
+    return level
+
+
+# 转换持久化策略的函数，不在可选范围内时抛出ValueError
+def parse_durability(text):
+    mode = text.strip().lower()
+    if mode not in DURABILITY_MODES:
+        raise ValueError(f'持久化策略只能是{"、".join(DURABILITY_MODES)}')
+    return mode
+
+
+# 转换采样率的函数，采样率在0到1之间
+def parse_sample_rate(text):
+    rate = float(text)
+    if not 0 <= rate <= 1:
+        raise ValueError('采样率需要在0到1之间')
+    return rate
+
+
+# 所有配置项，每个元素是(配置文件中的节, 配置项名, server.py中的变量名, 转换函数, 是否可以在运行中修改, 说明)
+# 命令行参数的名称由变量名得到，例如BUFFER_SIZE对应--buffer-size
+OPTIONS = [
+    ('server', 'host', 'HOST', str, False, '监听的IP地址'),
+    ('server', 'port', 'PORT', int, False, '监听的端口号'),
+    ('server', 'base_dir', 'BASE_DIR', os.path.abspath, False, 'FTP服务器的根目录'),
+    ('server', 'listen_backlog', 'LISTEN_BACKLOG', int, False, '监听队列的长度'),
+    ('server', 'prefork_workers', 'PREFORK_WORKERS', int, False, '工作进程数，0表示单进程多线程'),
+    ('server', 'metrics_port', 'METRICS_PORT', int, False, '监控指标HTTP服务的端口号，默认为0表示不启动'),
+    ('server', 'buffer_size', 'BUFFER_SIZE', int, True, '接收命令和收发数据的缓冲区大小'),
+    ('server', 'admin_users', 'ADMIN_USERS', parse_list, True, '管理员用户名，用逗号分隔'),
+    ('database', 'name', 'DB_NAME', str, False, '用户和会话数据库的文件名'),
+    ('transfer', 'rate_limit', 'RATE_LIMIT', rate_limiter.parse_rate, True, '全局带宽上限，例如512K、10M，0表示不限速'),
+    ('transfer', 'durability', 'DURABILITY', parse_durability, True, '上传文件的持久化策略，可选none、end、periodic'),
+    ('transfer', 'sync_interval', 'SYNC_INTERVAL', int, True, 'periodic策略下每接收多少字节刷盘一次'),
+    ('transfer', 'content_store_dir', 'CONTENT_STORE_DIR', str, False, '上传去重的内容寻址存储目录，为空表示不启用'),
+    ('cache', 'listing_history_size', 'LISTING_HISTORY_SIZE', int, True, 'lsv命令保存的历史列表数'),
+    ('cache', 'hash_cache_size', 'HASH_CACHE_SIZE', int, True, '哈希值缓存最多保存的条目数'),
+    ('cache', 'map_cache_idle', 'MAP_CACHE_IDLE', int, True, '没有人使用的内存映射最多保留的个数'),
+    ('cache', 'index_scan_interval', 'INDEX_SCAN_INTERVAL', int, False, '文件名索引检查目录变化的间隔秒数，0表示不建立索引'),
+    ('logging', 'level', 'LOG_LEVEL', parse_log_level, True, '日志级别，可选DEBUG、INFO、WARNING、ERROR'),
+    ('logging', 'sample_rate', 'LOG_SAMPLE_RATE', parse_sample_rate, True, '每条命令日志的采样率，0到1之间'),
+]
+
+
+# 由变量名得到命令行参数名称的函数
+def option_flag(name):
+    return '--' + name.lower().replace('_', '-')
+
+
+# 把所有配置项加入命令行参数解析器的函数，没有给出的参数为None，不会覆盖配置文件
+def add_arguments(parser):
+    parser.add_argument('-c', '--config', default=DEFAULT_PATH, help='配置文件的路径，默认是server.py所在目录下的server.ini')
+    for _, _, name, _, _, help_text in OPTIONS:
+        parser.add_argument(option_flag(name), dest=name, metavar=name, help=help_text)
+
+
+# 从解析好的命令行参数中取出给出的配置项的函数，返回一个字典，键是变量名，值是原始字符串
+def overrides_from_args(args):
+    return {name: getattr(args, name) for _, _, name, _, _, _ in OPTIONS if getattr(args, name) is not None}
+
+
+# 读取配置文件的函数，返回一个字典，键是变量名，值是原始字符串
+# 文件不存在时，required为False则返回空字典；出现未知的节或配置项时抛出ValueError，避免拼错的配置项被悄悄忽略
+def read_file(path, required=False):
+    parser = configparser.ConfigParser(interpolation=None)
+    if not parser.read(path, encoding='utf-8'):
+        if required:
+            raise FileNotFoundError(f'配置文件{path}不存在')
+        return {}
+    names = {(section, key): name for section, key, name, _, _, _ in OPTIONS}
+    values = {}
+    for section in parser.sections():
+        for key, value in parser.items(section):
+            if (section, key) not in names:
+                raise ValueError(f'配置文件{path}中有未知的配置项[{section}] {key}')
+            values[names[(section, key)]] = value
+    return values
+
+
+# 读取配置文件并合并命令行参数的函数，返回一个字典，键是变量名，值是转换好的值
+# 只要有一个配置项的值不正确就抛出ValueError，调用者可以继续使用原来的配置
+def resolve(path, overrides, required=False):
+    raw = read_file(path, required)
+    raw.update(overrides)
+    values = {}
+    for section, key, name, convert, _, _ in OPTIONS:
+        if name in raw:
+            try:
+                values[name] = convert(raw[name])
+            except ValueError as e:
+                raise ValueError(f'配置项[{section}] {key}的值{raw[name]!r}不正确: {e}')
+    return values
+
+
+# 启动时加载配置的函数，settings是server.py的全局变量字典，直接更新其中的值
+# 用户指定的配置文件不存在时报错，默认的配置文件可以不存在
+def load(settings, path, overrides):
+    settings.update(resolve(path, overrides, required=path != DEFAULT_PATH))
+
+
+# 运行中重新加载配置的函数，按启动时的配置文件和命令行参数重新读取
+# 只更新可以在运行中修改的设置，返回(已经应用的变量名列表, 需要重启才能生效的变量名列表)
+def reload(settings, path, overrides):
+    values = resolve(path, overrides, required=path != DEFAULT_PATH)
+    applied = []
+    pending = []
+    for _, _, name, _, runtime, _ in OPTIONS:
+        if name not in values or values[name] == settings.get(name):
+            continue
+        if runtime:
+            settings[name] = values[name]
+            applied.append(name)
+        else:
+            pending.append(name)
+    return applied, pending
@@ -0,0 +1,118 @@
+# session.py
+# 这是一个会话类，用于存储每个客户端连接自己的状态，包括用户名、当前目录、断点和正在进行的传输
+# 会话可以通过令牌保存到数据库中，客户端断线重连后凭令牌一次性恢复
+import hashlib
+import itertools
+import secrets
+import socket
+import threading
+import time
+
+# 定义一个常量，用于存储会话令牌的有效期，单位是秒
+SESSION_TTL = 3600
+# 定义一个常量，用于存储中止传输时等待发送循环停下来的最长秒数
+ABORT_TIMEOUT = 10
+# 定义一个常量，用于存储多进程模式下查询其他工作进程转来的中止请求的间隔秒数
+ABORT_POLL_INTERVAL = 0.2
+
+# 创建一个计数器，用于给每个会话分配一个进程内唯一的编号
+session_ids = itertools.count(1)
+
+
+# 定义一个会话类
+class Session:
+
+    # 初始化方法，接受客户端的初始目录作为参数
+    def __init__(self, current_dir):
+        # 增加一个属性，用于存储会话的编号，管理员可以用它指定要分析的会话
+        self.id = next(session_ids)
+        # 增加一个属性，用于存储已登录的用户名，为空表示还没有登录
+        self.username = ''
+        # 增加一个属性，用于存储客户端的当前目录
+        self.current_dir = current_dir
+        # 增加一个属性，用于存储断点的位置，每个会话各自独立，不再被其他客户端覆盖
+        self.breakpoint = 0
+        # 增加一个属性，用于存储会话令牌
+        self.token = ''
+        # 增加一些属性，用于存储正在进行的传输的方向（get或put）、文件路径和已传输的字节数
+        self.transfer_direction = ''
+        self.transfer_filename = ''
+        self.transfer_offset = 0
+        # 增加一个属性，用于标记是否有其他连接请求中止正在进行的下载，发送循环每发送一块检查一次
+        self.abort_requested = False
+        # 创建一个事件对象，发送循环停下来时设置，中止请求等待它，再回复发送结束的位置
+        self.transfer_stopped = threading.Event()
+        self.transfer_stopped.set()
+        self.stop_offset = 0
+        # 增加一个属性，用于存储该会话自己的限速（字节/秒），0表示不限速
+        self.rate_limit = 0
+        # 增加一个属性，用于存储数据连接的socket，只有数据连接上的传输使用的会话才有，中止时直接关闭它
+        self.data_sock = None
+        # 增加一个属性，用于存储已经收到但还没有处理的命令数据，上传小文件时，客户端紧接着发送的下一条命令可能和文件数据一起到达
+        self.pending_input = b''
+        # 增加一个属性，用于存储没有登录时上传临时文件的标识，每个会话随机生成，不同会话上传同一个文件时互不影响
+        self.upload_id = secrets.token_hex(8)
+
+    # 生成一个新的会话令牌的方法
+    def new_token(self):
+        self.token = secrets.token_hex(16)
+        return self.token
+
+    # 获取上传临时文件标识的方法，登录后由令牌得到，凭令牌恢复会话后仍然能找到上次接收了一半的临时文件
+    # 临时文件名在列目录时可以看到，所以只使用令牌的哈希值，不暴露令牌本身
+    def upload_owner(self):
+        if self.token:
+            return hashlib.sha256(self.token.encode()).hexdigest()[:16]
+        return self.upload_id
+
+    # 计算会话令牌过期时间的方法
+    def expires(self):
+        return time.time() + SESSION_TTL
+
+    # 开始一次传输的方法，记录传输的方向、文件路径和起始位置
+    def begin_transfer(self, direction, filename, offset):
+        self.transfer_direction = direction
+        self.transfer_filename = filename
+        self.transfer_offset = offset
+        self.abort_requested = False
+        self.transfer_stopped.clear()
+
+    # 创建一个数据连接上的传输使用的会话的方法，继承用户名、令牌、当前目录、断点和限速，abort命令可以凭令牌中止它
+    # 每个数据连接有自己的传输信息和中止标记，控制连接上可以同时执行其他命令和开始其他传输
+    # 断点只用于这一次传输，控制连接的断点随即清零，不会被下一次传输误用
+    def data_session(self):
+        child = Session(self.current_dir)
+        child.username = self.username
+        child.token = self.token
+        child.upload_id = self.upload_id
+        child.breakpoint = self.breakpoint
+        child.rate_limit = self.rate_limit
+        self.breakpoint = 0
+        return child
+
+    # 结束一次传输的方法，清除传输信息
+    def end_transfer(self):
+        self.transfer_direction = ''
+        self.transfer_filename = ''
+        self.transfer_offset = 0
+
+    # 发送循环停下来时调用的方法，无论传输是否完成，记录发送结束的位置，并通知等待中止的线程
+    def stop_transfer(self, offset):
+        self.stop_offset = offset
+        self.transfer_stopped.set()
+
+    # 请求中止正在进行的下载的方法，由处理abort命令的线程调用
+    # 等待发送循环停下来，返回发送结束的位置（包括断点之前的部分），没有正在进行的下载或等待超时时返回None
+    # 数据连接上的下载直接关闭数据连接，客户端不再接收时发送循环也不会阻塞在发送上
+    def abort_transfer(self, timeout=ABORT_TIMEOUT):
+        if self.transfer_direction != 'get':
+            return None
+        self.abort_requested = True
+        if self.data_sock is not None:
+            try:
+                self.data_sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+        if not self.transfer_stopped.wait(timeout):
+            return None
+        return self.stop_offset
@@ -0,0 +1,40 @@
+# conftest.py
+# 这是测试的公共配置，把项目目录加入模块搜索路径，测试可以直接导入服务器和客户端的模块
+# 还提供在本进程中启动服务器的夹具，需要和服务器通信的测试共用
+import os
+import sys
+import threading
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import db_manager
+import ftp_logger
+import server
+
+
+# 服务器根目录的夹具，测试可以在启动服务器之前往里面放文件
+@pytest.fixture
+def server_root(tmp_path):
+    root = tmp_path / 'root'
+    root.mkdir()
+    return root
+
+
+# 启动服务器的夹具，返回一个函数，每调用一次在后台线程中启动一个服务器，返回它的端口号
+# 同一个测试中启动的服务器共用根目录和数据库，可以模拟多进程模式下的多个工作进程
+@pytest.fixture
+def start_server(tmp_path, server_root, monkeypatch):
+    ftp_logger.setup(stream=open(os.devnull, 'w'))
+    monkeypatch.setattr(db_manager, 'DB_NAME', str(tmp_path / 'users.db'))
+    monkeypatch.setattr(server, 'BASE_DIR', str(server_root))
+    monkeypatch.setattr(server, 'PORT', 0)
+    monkeypatch.setattr(server, 'CONTENT_STORE_DIR', '')
+    monkeypatch.setattr(server, 'INDEX_SCAN_INTERVAL', 0)
+
+    def start(prefork=False):
+        monkeypatch.setattr(server, 'PREFORK_WORKERS', 1 if prefork else 0)
+        ftp_server = server.FTPServer()
+        threading.Thread(target=ftp_server.start, daemon=True).start()
+        return ftp_server.server_sock.getsockname()[1]
+    return start
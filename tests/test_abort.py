@@ -0,0 +1,132 @@
+# test_abort.py
+# 这是abort命令的测试，在本进程中启动服务器，检查控制连接和数据连接上的下载都能被及时中止
+# 多进程模式用两个共用数据库的服务器对象模拟两个工作进程，abort命令由没有这个会话的那个服务器收到
+import os
+import select
+import socket
+import threading
+import time
+import pytest
+import data_channel
+from ftp_session import FTPSession
+
+# 定义一些常量
+FILE_SIZE = 8 * 1024 * 1024 # 测试文件的大小
+RATE = '1M' # 下载的限速，保证中止时下载还没有完成
+
+
+# 放入测试文件的夹具，所有测试都下载这个文件
+@pytest.fixture(autouse=True)
+def big_file(server_root):
+    (server_root / 'big.bin').write_bytes(os.urandom(FILE_SIZE))
+
+
+# 注册并登录一个限速的会话的函数
+def login(port):
+    session = FTPSession('127.0.0.1', port)
+    session.register('alice', 'secret')
+    assert session.login('alice', 'secret')
+    assert session.send_command('limit session ' + RATE).startswith('OK')
+    return session
+
+
+# 用一个新连接发送abort命令的函数，返回服务器的回复
+def send_abort(port, token):
+    with socket.create_connection(('127.0.0.1', port), 15) as sock:
+        sock.recv(1024)
+        sock.send(f'abort {token}'.encode())
+        return sock.recv(1024).decode()
+
+
+# 在后台线程中接收数据的类，end是要接收到的位置，中止后改为服务器回复的位置
+class Reader(threading.Thread):
+
+    # 初始化方法，sock是接收数据的连接，received是已经接收的字节数
+    def __init__(self, sock, end, received=0):
+        super().__init__(daemon=True)
+        self.sock = sock
+        self.end = end
+        self.received = received
+        self.closed = False
+
+    # 接收数据直到end或者连接被关闭，和客户端一样先用select等待，end变小后不会在recv中多读后面的响应
+    def run(self):
+        while self.received < self.end:
+            readable, _, _ = select.select([self.sock], [], [], 0.05)
+            if not readable:
+                continue
+            try:
+                data = self.sock.recv(min(65536, self.end - self.received))
+            except OSError:
+                data = b''
+            if not data:
+                self.closed = True
+                return
+            self.received += len(data)
+
+
+# 控制连接上的下载被中止后，只需要接收到回复的位置，之后控制连接上的命令正常
+def test_abort_control_channel_download(start_server):
+    port = start_server()
+    session = login(port)
+    session.sock.send(b'get big.bin')
+    header = b''
+    while not header.endswith(b'big.bin'):
+        header += session.sock.recv(1)
+    reader = Reader(session.sock, FILE_SIZE)
+    reader.start()
+    time.sleep(0.3)
+    response = send_abort(port, session.token)
+    assert response.startswith('OK')
+    offset = int(response.split(' ')[1])
+    assert offset < FILE_SIZE
+    reader.end = offset
+    reader.join(5)
+    assert reader.received == offset
+    assert session.send_command('noop') == 'OK'
+
+
+# 数据连接上的下载被中止时，服务器关闭数据连接
+def test_abort_passive_download(start_server):
+    port = start_server()
+    session = login(port)
+    response = session.send_command(f'get {data_channel.PASSIVE_OPTION} big.bin')
+    _, data_port, key, _ = data_channel.parse_get_reply(response)
+    with data_channel.connect('127.0.0.1', data_port, key) as data_sock:
+        reader = Reader(data_sock, FILE_SIZE)
+        reader.start()
+        time.sleep(0.3)
+        assert send_abort(port, session.token).startswith('OK')
+        reader.join(5)
+        assert reader.closed
+        assert reader.received < FILE_SIZE
+    assert session.send_command('noop') == 'OK'
+
+
+# 多进程模式下abort命令被另一个工作进程收到时，通过数据库转给正在发送的工作进程
+def test_abort_across_workers(start_server):
+    owner_port = start_server(prefork=True)
+    other_port = start_server(prefork=True)
+    session = login(owner_port)
+    session.sock.send(b'get big.bin')
+    header = b''
+    while not header.endswith(b'big.bin'):
+        header += session.sock.recv(1)
+    reader = Reader(session.sock, FILE_SIZE)
+    reader.start()
+    time.sleep(0.3)
+    started = time.monotonic()
+    response = send_abort(other_port, session.token)
+    assert response.startswith('OK')
+    assert time.monotonic() - started < 2
+    reader.end = int(response.split(' ')[1])
+    reader.join(5)
+    assert reader.received == reader.end < FILE_SIZE
+    assert session.send_command('noop') == 'OK'
+
+
+# 没有正在进行的下载时回复错误
+def test_abort_without_download(start_server):
+    port = start_server()
+    session = login(port)
+    assert send_abort(port, session.token).startswith('ERROR')
@@ -0,0 +1,113 @@
+# test_archive_stream.py
+# 这是目录归档流的测试，在一对本地socket上发送和接收归档，检查解包的结果
+# 还在本进程中启动服务器，检查putdir命令的解包结果和解包失败后控制连接仍然可用
+import os
+import socket
+import threading
+import pytest
+import archive_stream
+
+
+# 在一对本地socket上把src目录发送并解包到dest目录的函数，返回接收方的结果和写好的文件列表
+def transfer(src, dest, compress=False):
+    left, right = socket.socketpair()
+    written = []
+    sender = threading.Thread(target=archive_stream.send_archive, args=(left, str(src), compress))
+    sender.start()
+    try:
+        result = archive_stream.receive_archive(right, str(dest), on_file=written.append)
+    finally:
+        sender.join()
+        left.close()
+        right.close()
+    return result, written
+
+
+# 目录中的文件和子目录原样解包，压缩和不压缩都可以
+def test_round_trip(tmp_path):
+    src = tmp_path / 'src'
+    (src / 'sub').mkdir(parents=True)
+    (src / 'a.txt').write_bytes(b'a' * 1000)
+    (src / 'sub' / 'b.bin').write_bytes(os.urandom(200000))
+    for compress in (False, True):
+        dest = tmp_path / f'dest{compress}'
+        (count, _), written = transfer(src, dest, compress)
+        assert count == 2
+        assert len(written) == 2
+        assert (dest / 'a.txt').read_bytes() == (src / 'a.txt').read_bytes()
+        assert (dest / 'sub' / 'b.bin').read_bytes() == (src / 'sub' / 'b.bin').read_bytes()
+
+
+# 覆盖已有的文件时替换为新文件，不在原文件上改写，和它共用数据的硬链接保持原来的内容，也不留下临时文件
+def test_overwrite_replaces_file(tmp_path):
+    src = tmp_path / 'src'
+    src.mkdir()
+    (src / 'a.txt').write_bytes(b'new')
+    dest = tmp_path / 'dest'
+    dest.mkdir()
+    (dest / 'a.txt').write_bytes(b'old content')
+    os.link(str(dest / 'a.txt'), str(tmp_path / 'linked'))
+    transfer(src, dest)
+    assert (dest / 'a.txt').read_bytes() == b'new'
+    assert (tmp_path / 'linked').read_bytes() == b'old content'
+    assert os.listdir(dest) == ['a.txt']
+
+
+# 解包中途出错时，先丢弃归档流剩下的帧再抛出异常，socket上紧跟着的数据不会被当作归档读掉，也不会留在socket上
+def test_error_drains_stream(tmp_path):
+    src = tmp_path / 'src'
+    src.mkdir()
+    for index in range(5):
+        (src / f'{index}.bin').write_bytes(os.urandom(100000))
+    left, right = socket.socketpair()
+
+    def send():
+        archive_stream.send_archive(left, str(src))
+        left.sendall(b'noop')
+
+    def fail(path):
+        raise OSError('磁盘已满')
+    sender = threading.Thread(target=send)
+    sender.start()
+    with left, right:
+        with pytest.raises(OSError, match='磁盘已满'):
+            archive_stream.receive_archive(right, str(tmp_path / 'dest'), on_file=fail)
+        sender.join()
+        assert right.recv(1024) == b'noop'
+
+
+# 服务器解包失败时回复ERROR，客户端读到错误，之后控制连接上的命令正常
+def test_putdir_failure_keeps_session(start_server, server_root, tmp_path):
+    src = tmp_path / 'src'
+    (src / 'sub').mkdir(parents=True)
+    (src / 'a.txt').write_bytes(b'a')
+    (src / 'sub' / 'b.bin').write_bytes(os.urandom(200000))
+    # 服务器上已经有一个和子目录同名的文件，解包到子目录时失败
+    (server_root / 'src').mkdir()
+    (server_root / 'src' / 'sub').write_bytes(b'not a directory')
+    with socket.create_connection(('127.0.0.1', start_server())) as sock:
+        sock.recv(1024)
+        sock.send(f'putdir {src}'.encode())
+        assert sock.recv(1024).decode().startswith('OK')
+        archive_stream.send_archive(sock, str(src))
+        with pytest.raises(IOError, match='ERROR'):
+            archive_stream.read_status(sock)
+        sock.send(b'noop')
+        assert sock.recv(1024) == b'OK'
+    # 出错之前解包好的文件保留下来
+    assert (server_root / 'src' / 'a.txt').read_bytes() == b'a'
+
+
+# 服务器解包成功时回复OK和文件数
+def test_putdir_status(start_server, server_root, tmp_path):
+    src = tmp_path / 'src'
+    (src / 'sub').mkdir(parents=True)
+    (src / 'a.txt').write_bytes(b'a')
+    (src / 'sub' / 'b.bin').write_bytes(b'b')
+    with socket.create_connection(('127.0.0.1', start_server())) as sock:
+        sock.recv(1024)
+        sock.send(f'putdir {src}'.encode())
+        assert sock.recv(1024).decode().startswith('OK')
+        archive_stream.send_archive(sock, str(src))
+        assert archive_stream.read_status(sock) == 'OK 2'
+    assert (server_root / 'src' / 'sub' / 'b.bin').read_bytes() == b'b'
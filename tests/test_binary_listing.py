@@ -0,0 +1,60 @@
+# test_binary_listing.py
+# 这是二进制目录列表模块的测试，检查编码后再解码能得到原来的列表，以及不完整的数据和带状态行的响应的处理
+import os
+import pytest
+import binary_listing
+from binary_listing import DIR, DRIVE, FILE
+
+# 定义一个常量，用于存储测试使用的条目，名称中有空格、换行符和中文
+ENTRIES = [(DIR, 0, 1700000000, 'sub dir'), (FILE, 2 ** 40, 1700000001, 'line\nbreak.txt'), (FILE, 0, 0, '文件.bin')]
+
+
+# 编码后再解码，得到原来的目录、条目和被删除的条目
+@pytest.mark.parametrize('entries, removed', [(ENTRIES, []), (ENTRIES[:1], ENTRIES[1:]), ([], []), ([], ENTRIES)])
+def test_round_trip(entries, removed):
+    data = binary_listing.encode('/home/用户', entries, removed)
+    assert binary_listing.decode(data) == ('/home/用户', entries, removed)
+
+
+# Windows的磁盘列表也能编码
+def test_round_trip_drives():
+    entries = [(DRIVE, 0, 0, 'C:\\'), (DRIVE, 0, 0, 'D:\\')]
+    assert binary_listing.decode(binary_listing.encode('\\', entries)) == ('\\', entries, [])
+
+
+# 扫描目录得到的条目编码后再解码不变
+def test_scan_round_trip(tmp_path):
+    (tmp_path / 'a dir').mkdir()
+    (tmp_path / 'data.bin').write_bytes(b'x' * 1234)
+    entries = sorted(binary_listing.scan(str(tmp_path)), key=lambda entry: entry[3])
+    assert [(kind, size, name) for kind, size, _, name in entries] == [(DIR, 0, 'a dir'), (FILE, 1234, 'data.bin')]
+    assert binary_listing.decode(binary_listing.encode(str(tmp_path), entries))[1] == entries
+
+
+# 不完整的数据不能解码，is_complete在收到最后一个字节之前都返回False
+def test_incomplete_data():
+    data = binary_listing.encode('/', ENTRIES)
+    for size in range(len(data)):
+        assert not binary_listing.is_complete(data[:size])
+    assert binary_listing.is_complete(data)
+    with pytest.raises(ValueError):
+        binary_listing.decode(data[:-1])
+    with pytest.raises(ValueError):
+        binary_listing.decode(b'not a listing')
+
+
+# lsv -b的响应是一行文本状态加上一个二进制列表，可以取出目录和判断是否接收完整
+def test_response_with_status_line():
+    data = b'FULL 3\n' + binary_listing.encode('/pub', ENTRIES)
+    assert binary_listing.response_directory(data) == '/pub'
+    assert binary_listing.is_response_complete(data)
+    assert not binary_listing.is_response_complete(data[:-1])
+    assert binary_listing.is_response_complete('错误的路径'.encode())
+    assert binary_listing.describe(data) == f'FULL 3 /pub：3个条目（{len(data)}字节）'
+
+
+# 文件名中不是UTF-8的字节不会导致编码或解码出错
+def test_undecodable_name():
+    name = os.fsdecode(b'bad\xff')
+    directory, entries, _ = binary_listing.decode(binary_listing.encode('/', [(FILE, 1, 2, name)]))
+    assert directory == '/' and entries[0][:3] == (FILE, 1, 2)
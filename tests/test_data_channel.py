@@ -0,0 +1,34 @@
+# test_data_channel.py
+# 这是数据连接传输的测试，在本进程中启动服务器，检查上传的结果由服务器明确回复，保存失败时客户端能知道
+import asyncio
+import pytest
+import async_client
+from ftp_session import FTPSession
+
+
+# 上传成功时文件内容正确，客户端返回发送的字节数
+def test_passive_put(start_server, server_root, tmp_path):
+    local = tmp_path / 'upload.bin'
+    local.write_bytes(b'data' * 10000)
+    session = FTPSession('127.0.0.1', start_server())
+    assert session.put(str(local), passive=True) == 40000
+    assert (server_root / 'upload.bin').read_bytes() == local.read_bytes()
+
+
+# 服务器保存文件失败时（目标是一个目录），同步和异步客户端都抛出IOError，而不是报告上传完成
+def test_passive_put_failure(start_server, server_root, tmp_path):
+    (server_root / 'upload.bin').mkdir()
+    local = tmp_path / 'upload.bin'
+    local.write_bytes(b'data' * 10000)
+    port = start_server()
+    session = FTPSession('127.0.0.1', port)
+    with pytest.raises(IOError, match='ERROR'):
+        session.put(str(local), passive=True)
+    assert session.noop()
+
+    async def run():
+        async with await async_client.AsyncFTPSession.connect('127.0.0.1', port) as session:
+            with pytest.raises(IOError, match='ERROR'):
+                await session.put(str(local), passive=True)
+    asyncio.run(run())
+    assert (server_root / 'upload.bin').is_dir()
@@ -0,0 +1,65 @@
+# test_file_index.py
+# 这是文件名索引的测试，检查按通配符和正则表达式查找，上传后新增的文件不需要重新生成整个字符串就能查到
+import os
+import pytest
+import file_index
+
+
+# 建立索引的夹具，在临时目录中创建几个文件和子目录，完成第一次检查，不启动后台线程
+@pytest.fixture
+def index(tmp_path):
+    (tmp_path / 'src' / 'lib').mkdir(parents=True)
+    (tmp_path / 'a.txt').write_text('a')
+    (tmp_path / 'src' / 'main.py').write_text('m')
+    (tmp_path / 'src' / 'lib' / 'util.py').write_text('u')
+    index = file_index.FileIndex(str(tmp_path))
+    index.scan()
+    index.rebuild()
+    index.ready.set()
+    return index
+
+
+# 通配符只匹配文件名，带/时匹配相对路径，**可以匹配多级目录，从子目录查找时返回相对于子目录的路径
+def test_glob(index):
+    assert sorted(index.find('*.py')) == ['src/lib/util.py', 'src/main.py']
+    assert list(index.find('src/*.py')) == ['src/main.py']
+    assert list(index.find('src/**/util.py')) == ['src/lib/util.py']
+    assert sorted(index.find('*.py', base='src')) == ['lib/util.py', 'main.py']
+
+
+# 上传的文件加入索引后立即可以查到，查询不会重新生成所有路径的字符串
+def test_added_file_without_rebuild(index, tmp_path):
+    blob = index.blob
+    (tmp_path / 'src' / 'new.py').write_text('n')
+    index.add(str(tmp_path / 'src' / 'new.py'))
+    (tmp_path / 'up' / 'deep').mkdir(parents=True)
+    (tmp_path / 'up' / 'deep' / 'x.py').write_text('x')
+    index.add(str(tmp_path / 'up'))
+    assert sorted(index.find('*.py')) == ['src/lib/util.py', 'src/main.py', 'src/new.py', 'up/deep/x.py']
+    assert sorted(index.find('*.py', base='src')) == ['lib/util.py', 'main.py', 'new.py']
+    assert list(index.find('up', regex=True)) == ['up/', 'up/deep/', 'up/deep/x.py']
+    assert index.blob is blob
+    # 后台线程合并新增的路径之后结果不变，也不会重复
+    index.rebuild()
+    assert not index.added
+    assert sorted(index.find('*.py')) == ['src/lib/util.py', 'src/main.py', 'src/new.py', 'up/deep/x.py']
+
+
+# 删除的文件和目录在下一次检查并重新生成之后不再出现
+def test_removed_paths(index, tmp_path):
+    os.remove(tmp_path / 'src' / 'lib' / 'util.py')
+    os.rmdir(tmp_path / 'src' / 'lib')
+    index.scan()
+    assert index.dirty
+    index.rebuild()
+    assert sorted(index.find('*.py')) == ['src/main.py']
+    assert list(index.find('lib')) == []
+
+
+# 正则表达式太长时报错，超过时间上限时停止查找
+def test_regex_limits(index, monkeypatch):
+    assert list(index.find(r'main\.py$', regex=True)) == ['src/main.py']
+    with pytest.raises(ValueError):
+        index.find('a' * (file_index.MAX_REGEX_LENGTH + 1), regex=True)
+    monkeypatch.setattr(file_index, 'REGEX_TIMEOUT', 0)
+    assert list(index.find(r'\.py$', regex=True)) == []
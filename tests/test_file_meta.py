@@ -0,0 +1,38 @@
+# test_file_meta.py
+# 这是stat和mstat命令的测试，在本进程中启动服务器，检查一次查询很多路径时不会被截断
+import asyncio
+import async_client
+from ftp_session import FTPSession
+
+# 定义一个常量，用于存储测试的路径数，所有路径加起来远大于服务器一次接收命令的缓冲区
+PATH_COUNT = 200
+
+
+# 创建很多个文件名较长的文件的函数，返回它们的名称
+def make_files(root):
+    names = [f'{index:04d}-a-fairly-long-file-name-for-mstat.txt' for index in range(PATH_COUNT)]
+    for index, name in enumerate(names):
+        (root / name).write_bytes(b'x' * index)
+    return names
+
+
+# mstat命令超过1KB时返回所有路径的结果，之后连接上的命令仍然正常
+def test_mstat_larger_than_buffer(start_server, server_root):
+    names = make_files(server_root)
+    session = FTPSession('127.0.0.1', start_server())
+    results = session.mstat(names)
+    assert [(meta['path'], meta['size']) for meta in results] == [(name, index) for index, name in enumerate(names)]
+    assert session.noop()
+
+
+# 异步客户端的命令都用流水线协议发送，mstat同样不会被截断
+def test_async_mstat_larger_than_buffer(start_server, server_root):
+    names = make_files(server_root)
+    port = start_server()
+
+    async def run():
+        async with await async_client.AsyncFTPSession.connect('127.0.0.1', port) as session:
+            results = await session.mstat(names)
+            assert [meta['path'] for meta in results] == names
+            assert await session.send_command('noop') == 'OK'
+    asyncio.run(run())
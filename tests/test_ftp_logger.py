@@ -0,0 +1,22 @@
+# test_ftp_logger.py
+# 这是结构化日志模块的测试，检查命令日志中不会出现密码和会话令牌
+import pytest
+import ftp_logger
+
+
+# 替换日志对象的info方法，收集记录的字段，返回收集到的列表
+@pytest.fixture
+def records(monkeypatch):
+    logged = []
+    monkeypatch.setattr(ftp_logger, 'sample_rate', 1.0)
+    monkeypatch.setattr(ftp_logger.StructuredLogger, 'info', lambda self, event, **fields: logged.append(fields))
+    return logged
+
+
+# 登录和注册只记录用户名，resume和abort只记录命令名，其他命令原样记录
+@pytest.mark.parametrize('command, logged', [('login alice secret', 'login alice'), ('register bob hunter2', 'register bob'),
+                                             ('resume 0123abcd 42', 'resume'), ('abort 0123abcd', 'abort'),
+                                             ('cd docs', 'cd docs')])
+def test_command_redaction(records, command, logged):
+    ftp_logger.get_logger('test').command(command, client='127.0.0.1')
+    assert records == [{'verb': command.split(' ')[0], 'command': logged, 'client': '127.0.0.1'}]
@@ -0,0 +1,69 @@
+# test_mmap_cache.py
+# 这是内存映射缓存的测试，检查映射的复用、文件变化后的失效和发送循环的结束条件
+import os
+import socket
+import mmap_cache
+
+
+# 打开文件并取得映射的函数，和服务器一样用打开的文件的信息获取映射
+def acquire(cache, path):
+    with open(path, 'rb') as f:
+        return cache.acquire(str(path), os.fstat(f.fileno()))
+
+
+# 同一个文件没有变化时复用同一个映射
+def test_acquire_reuses_mapping(tmp_path):
+    path = tmp_path / 'a.bin'
+    path.write_bytes(b'x' * mmap_cache.MIN_SIZE)
+    cache = mmap_cache.MapCache()
+    first = acquire(cache, path)
+    cache.release(first)
+    second = acquire(cache, path)
+    assert first is second
+    cache.release(second)
+    cache.clear()
+
+
+# 文件被替换后，即使大小相同也使用新的映射
+def test_replaced_file_gets_new_mapping(tmp_path):
+    path = tmp_path / 'a.bin'
+    path.write_bytes(b'x' * mmap_cache.MIN_SIZE)
+    cache = mmap_cache.MapCache()
+    first = acquire(cache, path)
+    cache.release(first)
+    (tmp_path / 'b.bin').write_bytes(b'y' * mmap_cache.MIN_SIZE)
+    os.replace(str(tmp_path / 'b.bin'), str(path))
+    second = acquire(cache, path)
+    assert second is not first
+    assert bytes(second.view[:1]) == b'y'
+    cache.release(second)
+    cache.clear()
+
+
+# 调用者取得的文件信息和打开时的文件不一致时不使用映射
+def test_stale_stat_returns_none(tmp_path):
+    path = tmp_path / 'a.bin'
+    path.write_bytes(b'x' * mmap_cache.MIN_SIZE)
+    stat = os.stat(str(path))
+    path.write_bytes(b'x' * (mmap_cache.MIN_SIZE * 2))
+    assert mmap_cache.MapCache().acquire(str(path), stat) is None
+
+
+# 映射比记录的大小短时发送到映射的末尾就返回，不会空转
+def test_send_mapped_stops_at_end_of_view(tmp_path):
+    path = tmp_path / 'a.bin'
+    path.write_bytes(b'x' * mmap_cache.MIN_SIZE)
+    cache = mmap_cache.MapCache()
+    mapped = acquire(cache, path)
+    left, right = socket.socketpair()
+    # 接收方最后才读取，先把缓冲区的容量调大，避免发送阻塞
+    right.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 20)
+    left.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 1 << 20)
+    try:
+        mapped.size = len(mapped.view) + 10
+        assert mmap_cache.send_mapped(left, mapped, 0) == len(mapped.view)
+    finally:
+        left.close()
+        right.close()
+        cache.release(mapped)
+        cache.clear()
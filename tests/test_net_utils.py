@@ -0,0 +1,63 @@
+# test_net_utils.py
+# 这是网络工具模块的测试，检查接收文件数据时的字节数限制和按位置写入
+import hashlib
+import socket
+import pytest
+import net_utils
+
+
+# 只接收指定的字节数，对端紧接着发送的命令留在socket中
+def test_recv_into_file_stops_at_count(tmp_path):
+    left, right = socket.socketpair()
+    try:
+        left.sendall(b'0123456789' + b'ls')
+        with open(tmp_path / 'a.bin', 'wb') as f:
+            assert net_utils.RecvBuffer(4).recv_into_file(right, f, 10) == 10
+        assert (tmp_path / 'a.bin').read_bytes() == b'0123456789'
+        assert right.recv(100) == b'ls'
+    finally:
+        left.close()
+        right.close()
+
+
+# 续传时按断点的位置写入，已有文件在断点之后的内容被覆盖，而不是追加到文件末尾
+def test_resume_writes_at_position(tmp_path):
+    path = tmp_path / 'a.bin'
+    path.write_bytes(b'abcdXXXXXX')
+    left, right = socket.socketpair()
+    try:
+        left.sendall(b'efgh')
+        with net_utils.open_download(str(path), 4) as f:
+            net_utils.recv_buffer().recv_into_file(right, f, 4, 4)
+        assert path.read_bytes() == b'abcdefghXX'
+    finally:
+        left.close()
+        right.close()
+
+
+# 回调函数收到每次接收的字节数，哈希对象收到全部数据
+def test_recv_into_file_callbacks(tmp_path):
+    left, right = socket.socketpair()
+    chunks = []
+    digest = hashlib.sha256()
+    try:
+        left.sendall(b'x' * 100)
+        with open(tmp_path / 'a.bin', 'wb') as f:
+            net_utils.RecvBuffer(32).recv_into_file(right, f, 100, None, chunks.append, digest)
+        assert sum(chunks) == 100
+        assert digest.hexdigest() == hashlib.sha256(b'x' * 100).hexdigest()
+    finally:
+        left.close()
+        right.close()
+
+
+# 对端提前关闭连接时抛出异常
+def test_recv_into_file_raises_on_eof(tmp_path):
+    left, right = socket.socketpair()
+    left.sendall(b'abc')
+    left.close()
+    try:
+        with open(tmp_path / 'a.bin', 'wb') as f, pytest.raises(ConnectionError):
+            net_utils.recv_buffer().recv_into_file(right, f, 10)
+    finally:
+        right.close()
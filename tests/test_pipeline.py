@@ -0,0 +1,88 @@
+# test_pipeline.py
+# 这是流水线协议模块的测试，检查请求的编码和解析、响应的分帧，以及响应被拆成多次接收或不按顺序到达时的处理
+# 还在本进程中启动服务器，检查流水线中的只读命令在正确的目录中执行
+import socket
+import threading
+import pytest
+import pipeline
+from ftp_session import FTPSession
+
+
+# 建立一对TCP连接的函数，Pipeline要关闭Nagle算法，不能使用socketpair得到的Unix域socket
+def tcp_pair():
+    with socket.create_server(('127.0.0.1', 0)) as listener:
+        client = socket.create_connection(listener.getsockname())
+        server, _ = listener.accept()
+    return server, client
+
+
+# 编码后的请求逐行解析，能得到原来的编号和命令，命令中的空格不受影响
+def test_encode_and_parse_requests():
+    commands = ['cd a b', 'ls', 'stat x\ty']
+    ids, data = pipeline.encode_requests(commands, first_id=7)
+    assert ids == ['7', '8', '9']
+    lines = data.split(b'\n')
+    assert lines[-1] == b''
+    assert [pipeline.parse_request(line) for line in lines[:-1]] == list(zip(ids, commands))
+
+
+# 响应按“#编号 长度\n”加内容分帧，内容中的换行符和#不会被当作下一条响应的开头
+def test_read_responses_out_of_order():
+    left, right = socket.socketpair()
+    with left, right:
+        left.sendall(pipeline.frame('2', b'#1 3\nfake') + pipeline.frame('1', b'') + pipeline.frame('3', 'OK 完成'.encode()))
+        assert pipeline.read_responses(right, 3) == {'2': b'#1 3\nfake', '1': b'', '3': 'OK 完成'.encode()}
+
+
+# 响应头和内容被拆成很多次发送时也能完整读出
+def test_read_responses_split_across_packets():
+    body = bytes(range(256)) * 1000
+    data = pipeline.frame('1', body) + pipeline.frame('2', b'OK')
+    left, right = socket.socketpair()
+    with left, right:
+        def send():
+            for start in range(0, len(data), 1000):
+                left.sendall(data[start:start + 1000])
+        thread = threading.Thread(target=send)
+        thread.start()
+        assert pipeline.read_responses(right, 2) == {'1': body, '2': b'OK'}
+        thread.join()
+
+
+# 响应没有接收完连接就断开时抛出ConnectionError
+@pytest.mark.parametrize('data', [b'', b'#1 1', b'#1 10\nshort'])
+def test_read_responses_connection_closed(data):
+    left, right = socket.socketpair()
+    with right:
+        left.sendall(data)
+        left.close()
+        with pytest.raises(ConnectionError):
+            pipeline.read_responses(right, 1)
+
+
+# 执行命令时抛出的异常作为ERROR响应发送，后台执行的命令完成后带着自己的编号返回
+def test_pipeline_run_and_submit():
+    left, right = tcp_pair()
+    with left, right:
+        pipe = pipeline.Pipeline(left)
+
+        def fail(sock):
+            raise ValueError('坏的参数')
+        pipe.run('1', fail)
+        pipe.submit('2', lambda sock: sock.send(b'OK'))
+        pipe.wait()
+        pipe.close()
+        assert pipeline.read_responses(right, 2) == {'1': 'ERROR 坏的参数'.encode(), '2': b'OK'}
+
+
+# 流水线中穿插cd和只读命令时，每条只读命令都在提交时的当前目录中执行
+def test_read_only_commands_use_directory_at_submit(start_server, server_root):
+    (server_root / 'sub').mkdir()
+    (server_root / 'sub' / 'inner.txt').write_text('x')
+    (server_root / 'top.txt').write_text('y')
+    session = FTPSession('127.0.0.1', start_server())
+    responses = session.pipeline(['ls', 'cd sub', 'ls', 'stat inner.txt', 'cd ..', 'ls', 'stat top.txt'])
+    assert 'top.txt' in responses[0] and 'inner.txt' not in responses[0]
+    assert 'inner.txt' in responses[2] and 'top.txt' not in responses[2]
+    assert responses[3].startswith('OK') and responses[6].startswith('OK')
+    assert 'top.txt' in responses[5] and 'inner.txt' not in responses[5]
@@ -0,0 +1,50 @@
+# test_profiler.py
+# 这是会话分析器的测试，检查分析的开始、结束和不能同时分析多个会话时的处理
+import os
+import ftp_logger
+import profiler
+
+
+# 代替会话对象的类，会话分析器只用到编号
+class FakeSession:
+    def __init__(self, session_id):
+        self.id = session_id
+
+
+# 会话在下一条命令前开始分析，到时间后结束并写出统计文件
+def test_profile_session(tmp_path):
+    session_profiler = profiler.SessionProfiler()
+    path = str(tmp_path / 'a.prof')
+    session = FakeSession(1)
+    assert session_profiler.request(1, 0, path)
+    session_profiler.check(session)
+    assert 1 in session_profiler.active
+    session_profiler.check(session)
+    assert not session_profiler.active
+    assert os.path.exists(path)
+
+
+# 不能同时分析多个会话时，拒绝第二个会话的请求
+def test_reject_second_session(tmp_path, monkeypatch):
+    monkeypatch.setattr(profiler, 'CONCURRENT_PROFILES', False)
+    session_profiler = profiler.SessionProfiler()
+    assert session_profiler.request(1, 10, str(tmp_path / 'a.prof'))
+    assert not session_profiler.request(2, 10, str(tmp_path / 'b.prof'))
+    session_profiler.check(FakeSession(1))
+    assert not session_profiler.request(2, 10, str(tmp_path / 'b.prof'))
+    session_profiler.stop(FakeSession(1))
+    assert session_profiler.request(2, 10, str(tmp_path / 'b.prof'))
+
+
+# 启用cProfile失败时不抛出异常，会话可以继续处理命令
+def test_enable_failure_is_reported(tmp_path, monkeypatch):
+    ftp_logger.setup(stream=open(os.devnull, 'w'))
+
+    class BusyProfile:
+        def enable(self):
+            raise ValueError('Another profiling tool is already active')
+    monkeypatch.setattr(profiler.cProfile, 'Profile', BusyProfile)
+    session_profiler = profiler.SessionProfiler()
+    session_profiler.request(1, 10, str(tmp_path / 'a.prof'))
+    session_profiler.check(FakeSession(1))
+    assert not session_profiler.active
@@ -0,0 +1,58 @@
+# test_rate_limiter.py
+# 这是带宽限速模块的测试，用一个手动推进的时钟代替time.monotonic，检查令牌桶的补充、透支和突发上限
+import types
+import pytest
+import rate_limiter
+
+# 定义一个常量，用于存储测试使用的速率
+RATE = 1000
+
+
+# 手动推进的时钟的夹具，返回一个列表，修改其中的值就是推进时间
+@pytest.fixture
+def clock(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(rate_limiter, 'time', types.SimpleNamespace(monotonic=lambda: now[0]))
+    return now
+
+
+# 带单位的速率按1024进位转换，0表示不限速
+@pytest.mark.parametrize('text, rate', [('0', 0), ('100', 100), ('512K', 512 * 1024), (' 2m ', 2 * 1024 * 1024),
+                                        ('1.5G', 3 * 1024 * 1024 * 1024 // 2)])
+def test_parse_rate(text, rate):
+    assert rate_limiter.parse_rate(text) == rate
+
+
+# 不限速时不需要等待
+def test_unlimited_bucket(clock):
+    bucket = rate_limiter.TokenBucket(0)
+    assert bucket.reserve(10 ** 9) == 0
+
+
+# 新建的桶是空的，透支的部分按速率换算成等待时间，时间推进后按流逝的时间补充令牌
+def test_overdraft_is_repaid_by_refill(clock):
+    bucket = rate_limiter.TokenBucket(RATE)
+    assert bucket.reserve(RATE) == pytest.approx(1.0)
+    clock[0] += 1.0
+    assert bucket.reserve(RATE // 2) == pytest.approx(0.5)
+    clock[0] += 0.5
+    assert bucket.reserve(0) == 0
+
+
+# 空闲很久之后最多只能突发桶的容量，超出的部分仍然要等待
+def test_refill_is_capped_at_capacity(clock):
+    bucket = rate_limiter.TokenBucket(RATE)
+    clock[0] += 60
+    assert bucket.reserve(RATE * rate_limiter.BURST_TIME) == 0
+    assert bucket.reserve(RATE) == pytest.approx(1.0)
+
+
+# 修改速率后令牌不超过新的容量，之后按新的速率补充
+def test_set_rate(clock):
+    bucket = rate_limiter.TokenBucket(RATE * 10)
+    clock[0] += 60
+    bucket.set_rate(RATE)
+    assert bucket.reserve(RATE * rate_limiter.BURST_TIME) == 0
+    assert bucket.reserve(RATE) == pytest.approx(1.0)
+    clock[0] += 1.0
+    assert bucket.reserve(0) == 0
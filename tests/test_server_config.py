@@ -0,0 +1,87 @@
+# test_server_config.py
+# 这是服务器配置模块的测试，检查配置文件的解析、命令行参数的覆盖和运行中的重新加载
+import argparse
+import os
+import pytest
+import ftp_logger
+import server
+import server_config
+
+
+# 写一个配置文件的函数，返回它的路径
+def write_config(tmp_path, text):
+    path = tmp_path / 'server.ini'
+    path.write_text(text, encoding='utf-8')
+    return str(path)
+
+
+# 配置文件中的值按默认值的类型转换，带单位的速率和逗号分隔的列表也能解析
+def test_parse_file(tmp_path):
+    path = write_config(tmp_path, '[server]\nport = 2121\nadmin_users = root, ops\n'
+                                  '[transfer]\nrate_limit = 2M\n[logging]\nlevel = debug\nsample_rate = 0.5\n')
+    values = server_config.resolve(path, {})
+    assert values == {'PORT': 2121, 'ADMIN_USERS': ['root', 'ops'], 'RATE_LIMIT': 2 * 1024 * 1024,
+                      'LOG_LEVEL': 'DEBUG', 'LOG_SAMPLE_RATE': 0.5}
+
+
+# 命令行参数优先于配置文件
+def test_command_line_overrides_file(tmp_path):
+    path = write_config(tmp_path, '[server]\nport = 2121\nbuffer_size = 4096\n')
+    parser = argparse.ArgumentParser()
+    server_config.add_arguments(parser)
+    args = parser.parse_args(['-c', path, '--port', '3000'])
+    values = server_config.resolve(args.config, server_config.overrides_from_args(args))
+    assert values == {'PORT': 3000, 'BUFFER_SIZE': 4096}
+
+
+# 拼错的配置项和不正确的值都会报错
+@pytest.mark.parametrize('text', ['[server]\nprot = 1\n', '[logging]\nlevel = loud\n', '[server]\nport = abc\n',
+                                  '[logging]\nsample_rate = 2\n'])
+def test_invalid_config(tmp_path, text):
+    with pytest.raises(ValueError):
+        server_config.resolve(write_config(tmp_path, text), {})
+
+
+# 默认的配置文件可以不存在，用户指定的配置文件不存在时报错
+def test_missing_file(tmp_path):
+    assert server_config.resolve(str(tmp_path / 'none.ini'), {}) == {}
+    with pytest.raises(FileNotFoundError):
+        server_config.load({}, str(tmp_path / 'none.ini'), {})
+
+
+# 重新加载时只应用可以在运行中修改的设置，其他变化的设置需要重启
+def test_reload(tmp_path):
+    path = write_config(tmp_path, '[server]\nport = 2121\nbuffer_size = 4096\n')
+    settings = {'PORT': 8888, 'BUFFER_SIZE': 1024, 'RATE_LIMIT': 0}
+    server_config.load(settings, path, {})
+    assert settings['PORT'] == 2121
+    write_config(tmp_path, '[server]\nport = 2222\nbuffer_size = 8192\n[transfer]\nrate_limit = 0\n')
+    applied, pending = server_config.reload(settings, path, {})
+    assert applied == ['BUFFER_SIZE']
+    assert pending == ['PORT']
+    assert settings['PORT'] == 2121
+    assert settings['BUFFER_SIZE'] == 8192
+
+
+# 服务器重新加载配置时，没有变化的限速不会覆盖管理员在运行中设置的全局限速
+def test_server_reload_keeps_runtime_limit(tmp_path, monkeypatch):
+    ftp_logger.setup(stream=open(os.devnull, 'w'))
+    monkeypatch.setattr(server, 'PORT', 0)
+    monkeypatch.setattr(server, 'CONTENT_STORE_DIR', '')
+    monkeypatch.setattr(server, 'INDEX_SCAN_INTERVAL', 0)
+    monkeypatch.setattr(server, 'RATE_LIMIT', 0)
+    monkeypatch.setattr(server, 'HASH_CACHE_SIZE', server.HASH_CACHE_SIZE)
+    path = write_config(tmp_path, '[transfer]\nrate_limit = 0\n[cache]\nhash_cache_size = 50\n')
+    monkeypatch.setattr(server, 'CONFIG_FILE', path)
+    monkeypatch.setattr(server, 'CONFIG_OVERRIDES', {})
+    ftp_server = server.FTPServer()
+    try:
+        ftp_server.bandwidth.set_global_rate(5000)
+        ftp_server.reload_config()
+        assert ftp_server.bandwidth.global_bucket.rate == 5000
+        assert ftp_server.hash_cache.size == 50
+        write_config(tmp_path, '[transfer]\nrate_limit = 1K\n[cache]\nhash_cache_size = 50\n')
+        ftp_server.reload_config()
+        assert ftp_server.bandwidth.global_bucket.rate == 1024
+    finally:
+        ftp_server.server_sock.close()
@@ -0,0 +1,109 @@
+# test_upload_store.py
+# 这是上传存储模块的测试，检查临时文件、提交和内容寻址存储的去重
+import hashlib
+import os
+import upload_store
+
+
+# 把内容写成一个上传完成的文件并加入存储的函数，返回哈希值
+def upload(store, filepath, data):
+    f = upload_store.open_temp(filepath, 0)
+    f.write(data)
+    upload_store.commit(f, filepath, len(data), upload_store.Syncer(f, 'none'))
+    digest = hashlib.sha256(data).hexdigest()
+    store.add(filepath, digest)
+    return digest
+
+
+# 同一个内容重复去重上传到同一个文件时，不留下临时文件，存储中的内容也不变
+def test_link_into_is_idempotent(tmp_path):
+    store = upload_store.ContentStore(str(tmp_path / 'store'))
+    filepath = str(tmp_path / 'x.bin')
+    digest = upload(store, filepath, b'A' * 100)
+    os.remove(filepath)
+    assert store.link_into(digest, filepath)
+    assert store.link_into(digest, filepath)
+    assert not os.path.lexists(upload_store.temp_path(filepath))
+    assert sorted(os.listdir(tmp_path)) == ['store', 'x.bin']
+
+
+# 去重上传之后再普通上传同名文件，不会改掉存储中共用的数据
+def test_plain_upload_after_dedup_keeps_store(tmp_path):
+    store = upload_store.ContentStore(str(tmp_path / 'store'))
+    filepath = str(tmp_path / 'x.bin')
+    digest = upload(store, filepath, b'A' * 100)
+    store.link_into(digest, filepath)
+    store.link_into(digest, filepath)
+    f = upload_store.open_temp(filepath, 0)
+    f.write(b'B' * 50)
+    upload_store.commit(f, filepath, 50, upload_store.Syncer(f, 'none'))
+    with open(store.object_path(digest), 'rb') as f:
+        assert f.read() == b'A' * 100
+    with open(filepath, 'rb') as f:
+        assert f.read() == b'B' * 50
+
+
+# 在去重得到的文件上续传时，先复制一份，不在共用的数据上追加
+def test_resume_on_linked_file_copies(tmp_path):
+    store = upload_store.ContentStore(str(tmp_path / 'store'))
+    filepath = str(tmp_path / 'x.bin')
+    digest = upload(store, filepath, b'A' * 100)
+    f = upload_store.open_temp(filepath, 100)
+    f.write(b'C' * 10)
+    upload_store.commit(f, filepath, 110, upload_store.Syncer(f, 'none'))
+    with open(store.object_path(digest), 'rb') as f:
+        assert f.read() == b'A' * 100
+    with open(filepath, 'rb') as f:
+        assert f.read() == b'A' * 100 + b'C' * 10
+
+
+# 临时文件和其他文件共用数据时，重新开始上传会创建新的临时文件，不截断共用的数据
+def test_open_temp_detaches_shared_part(tmp_path):
+    filepath = str(tmp_path / 'x.bin')
+    other = tmp_path / 'other'
+    other.write_bytes(b'keep')
+    os.link(str(other), upload_store.temp_path(filepath))
+    f = upload_store.open_temp(filepath, 0)
+    f.write(b'new')
+    f.close()
+    assert other.read_bytes() == b'keep'
+
+
+# 哈希值格式不正确时不去重，防止拼出存储目录之外的路径
+def test_link_into_rejects_invalid_digest(tmp_path):
+    store = upload_store.ContentStore(str(tmp_path / 'store'))
+    assert not store.link_into('../../etc/passwd', str(tmp_path / 'x'))
+
+
+# 两个会话同时上传同一个文件时各自写自己的临时文件，后提交的内容成为目标文件，先提交的不会因为临时文件被删掉而失败
+def test_concurrent_uploads_use_separate_temp_files(tmp_path):
+    filepath = str(tmp_path / 'x.bin')
+    first = upload_store.open_temp(filepath, 0, 'a')
+    first.write(b'A' * 100)
+    second = upload_store.open_temp(filepath, 0, 'b')
+    second.write(b'B' * 50)
+    upload_store.commit(first, filepath, 100, upload_store.Syncer(first, 'none'))
+    with open(filepath, 'rb') as f:
+        assert f.read() == b'A' * 100
+    upload_store.commit(second, filepath, 50, upload_store.Syncer(second, 'none'))
+    with open(filepath, 'rb') as f:
+        assert f.read() == b'B' * 50
+    assert os.listdir(tmp_path) == ['x.bin']
+
+
+# 同一个标识续传时找到上次接收了一半的临时文件，其他标识的临时文件不受影响
+def test_resume_finds_own_temp_file(tmp_path):
+    filepath = str(tmp_path / 'x.bin')
+    f = upload_store.open_temp(filepath, 0, 'a')
+    f.write(b'A' * 10)
+    f.close()
+    other = upload_store.open_temp(filepath, 0, 'b')
+    other.write(b'B' * 10)
+    other.close()
+    f = upload_store.open_temp(filepath, 10, 'a')
+    f.write(b'C' * 10)
+    upload_store.commit(f, filepath, 20, upload_store.Syncer(f, 'none'))
+    with open(filepath, 'rb') as f:
+        assert f.read() == b'A' * 10 + b'C' * 10
+    with open(upload_store.temp_path(filepath, 'b'), 'rb') as f:
+        assert f.read() == b'B' * 10
@@ -0,0 +1,97 @@
+# throughput_graph.py
+# 这是一个吞吐量曲线控件，放在客户端的状态栏中，代替原来的进度条
+# 控件定时读取传输统计中正在进行的传输，画出它的吞吐量时间线，并在上面显示进度、当前速度和停顿次数
+# 传输线程只更新记录，不发送信号，界面按自己的节奏刷新，传输很快时也不会因为信号太多而卡顿
+from PySide6.QtCore import Qt, QTimer, QPointF, QSize
+from PySide6.QtGui import QPainter, QPolygonF, QColor, QPen
+from PySide6.QtWidgets import QWidget, QSizePolicy
+
+# 定义一些常量
+REFRESH_INTERVAL = 200 # 刷新的间隔毫秒数
+MAX_POINTS = 300 # 曲线最多显示的采样点数，更早的采样点不再显示
+LINE_COLOR = QColor(0, 120, 215) # 曲线的颜色
+FILL_COLOR = QColor(0, 120, 215, 60) # 曲线下方填充的颜色
+PROGRESS_COLOR = QColor(0, 120, 215, 30) # 进度背景的颜色
+
+
+# 把字节/秒转换为带单位的字符串的函数
+def format_rate(rate):
+    for unit in ['B', 'KB', 'MB']:
+        if rate < 1024:
+            return f'{rate:.1f}{unit}/s'
+        rate /= 1024
+    return f'{rate:.1f}GB/s'
+
+
+# 定义一个吞吐量曲线类，继承自QWidget
+class ThroughputGraph(QWidget):
+
+    # 初始化方法，stats是客户端的传输统计对象
+    def __init__(self, stats=None, parent=None):
+        super().__init__(parent)
+        self.stats = stats
+        # 没有传输记录的操作（例如目录传输中的进度）用setValue设置进度
+        self.value = 0
+        self.setSizePolicy(QSizePolicy.Expanding, QSizePolicy.Fixed)
+        self.setMinimumWidth(120)
+        # 创建一个定时器，定时刷新控件
+        self.timer = QTimer(self)
+        self.timer.timeout.connect(self.refresh)
+        self.timer.start(REFRESH_INTERVAL)
+        # 增加一个属性，用于记录上一次刷新时是否有正在进行的传输，传输结束后再刷新一次，显示最终的结果
+        self.was_active = False
+
+    # 建议的尺寸
+    def sizeHint(self):
+        return QSize(240, 20)
+
+    # 设置进度的槽函数，和QProgressBar的setValue方法相同，可以直接连接进度信号
+    def setValue(self, value):
+        self.value = value
+        self.update()
+
+    # 定时器调用的方法，有正在进行的传输时才重画
+    def refresh(self):
+        record = self.stats.current if self.stats else None
+        active = record is not None and record.active
+        if active or self.was_active:
+            self.update()
+        self.was_active = active
+
+    # 画出控件的方法
+    def paintEvent(self, event):
+        painter = QPainter(self)
+        painter.setRenderHint(QPainter.Antialiasing)
+        rect = self.rect().adjusted(0, 0, -1, -1)
+        painter.setPen(self.palette().mid().color())
+        painter.drawRect(rect)
+        record = self.stats.current if self.stats else None
+        percent = record.percent if record is not None and record.size else self.value
+        # 先画出进度背景
+        if percent:
+            painter.fillRect(1, 1, int((rect.width() - 1) * percent / 100), rect.height() - 1, PROGRESS_COLOR)
+        text = f'{percent}%'
+        if record is not None:
+            points = record.timeline[-MAX_POINTS:]
+            # 采样点超过一个时画出曲线，纵轴按最大速度缩放，横轴均匀分布
+            if len(points) > 1:
+                peak = max(rate for _, rate in points) or 1
+                step = (rect.width() - 2) / (len(points) - 1)
+                bottom = rect.bottom()
+                height = rect.height() - 2
+                polygon = QPolygonF([QPointF(1 + i * step, bottom - rate / peak * height) for i, (_, rate) in enumerate(points)])
+                area = QPolygonF(polygon)
+                area.append(QPointF(1 + (len(points) - 1) * step, bottom))
+                area.append(QPointF(1, bottom))
+                painter.setPen(Qt.NoPen)
+                painter.setBrush(FILL_COLOR)
+                painter.drawPolygon(area)
+                painter.setPen(QPen(LINE_COLOR, 1))
+                painter.drawPolyline(polygon)
+            rate = record.current_throughput if record.active else record.throughput
+            text += f'  {format_rate(rate)}'
+            if record.stalls:
+                text += f'  停顿{len(record.stalls)}次'
+        painter.setPen(self.palette().windowText().color())
+        painter.drawText(rect, Qt.AlignCenter, text)
+        painter.end()
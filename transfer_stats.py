@@ -0,0 +1,183 @@
+# transfer_stats.py
+# 这是一个传输统计模块，每次上传或下载生成一条结构化的记录，包括字节数、用时、续传的起点、吞吐量的时间线和停顿
+# 会话统计汇总所有记录，可以导出为CSV或JSON文件；客户端的状态栏读取正在进行的传输的时间线，画出实时的吞吐量曲线
+# 记录在传输线程中更新，界面线程只读取，每个数据块只做几次加法，采样和停顿检测按时间间隔进行，不会拖慢传输循环
+import csv
+import json
+import threading
+import time
+
+# 定义一些常量
+SAMPLE_INTERVAL = 0.2 # 吞吐量时间线的采样间隔秒数
+STALL_TIME = 1.0 # 超过这么多秒没有收到或发出数据，就记为一次停顿
+MAX_RECORDS = 1000 # 会话统计最多保存的记录数，超过时丢弃最早的记录，汇总值不受影响
+MIN_DURATION = 0.01 # 计算吞吐量时用时的下限秒数，避免很小的文件得到无穷大的速度
+CSV_FIELDS = ['kind', 'name', 'started', 'size', 'offset', 'bytes', 'duration', 'throughput', 'stalls', 'stall_time', 'ok', 'error'] # 导出CSV的列
+
+
+# 定义一个传输记录类
+class TransferRecord:
+
+    # 初始化方法，kind是get、put、getdir或putdir，size是整个文件的大小（未知时为0），offset是续传的起点
+    def __init__(self, kind, name, size=0, offset=0):
+        self.kind = kind
+        self.name = name
+        self.size = size
+        self.offset = offset
+        # 本次传输的字节数，不包括续传之前已经传输的部分
+        self.bytes = 0
+        self.started = time.time()
+        self.start_time = time.perf_counter()
+        self.duration = 0.0
+        # 吞吐量的时间线，每个元素是(距开始的秒数, 这一段的字节/秒)
+        self.timeline = []
+        # 停顿的列表，每个元素是(距开始的秒数, 停顿的秒数)
+        self.stalls = []
+        self.ok = None
+        self.error = ''
+        # 上一次采样和上一次收到数据的时间，以及上一次采样时的字节数
+        self.sample_time = self.start_time
+        self.sample_bytes = 0
+        self.last_data = self.start_time
+
+    # 累加传输的字节数的方法，每传输一个数据块调用一次
+    def add(self, n):
+        now = time.perf_counter()
+        if now - self.last_data >= STALL_TIME:
+            self.stalls.append((round(self.last_data - self.start_time, 3), round(now - self.last_data, 3)))
+        self.last_data = now
+        self.bytes += n
+        if now - self.sample_time >= SAMPLE_INTERVAL:
+            self.sample(now)
+
+    # 在时间线上增加一个采样点的方法
+    def sample(self, now):
+        elapsed = now - self.sample_time
+        if elapsed > 0:
+            self.timeline.append((round(now - self.start_time, 3), (self.bytes - self.sample_bytes) / elapsed))
+        self.sample_time = now
+        self.sample_bytes = self.bytes
+
+    # 结束传输的方法，ok表示是否成功，error是失败的原因
+    def finish(self, ok, error=''):
+        now = time.perf_counter()
+        # 最后一个数据块之后一直没有数据，也算作一次停顿
+        if now - self.last_data >= STALL_TIME:
+            self.stalls.append((round(self.last_data - self.start_time, 3), round(now - self.last_data, 3)))
+        self.sample(now)
+        self.duration = now - self.start_time
+        self.ok = ok
+        self.error = str(error)
+
+    # 是否正在进行的属性
+    @property
+    def active(self):
+        return self.ok is None
+
+    # 已经用去的秒数的属性，正在进行的传输按当前时间计算
+    @property
+    def elapsed(self):
+        return time.perf_counter() - self.start_time if self.active else self.duration
+
+    # 平均吞吐量的属性，单位是字节/秒
+    @property
+    def throughput(self):
+        return self.bytes / max(self.elapsed, MIN_DURATION)
+
+    # 最近一段时间的吞吐量的属性，时间线还没有采样点时使用平均吞吐量
+    @property
+    def current_throughput(self):
+        return self.timeline[-1][1] if self.timeline else self.throughput
+
+    # 传输进度的属性，是0到100的整数，文件大小未知时为0
+    @property
+    def percent(self):
+        if not self.size:
+            return 0
+        return min(100, int((self.offset + self.bytes) / self.size * 100))
+
+    # 停顿的总秒数的属性
+    @property
+    def stall_time(self):
+        return sum(duration for _, duration in self.stalls)
+
+    # 转换为字典的方法，用于导出，timeline为False时不包括时间线和停顿的明细
+    def to_dict(self, timeline=True):
+        result = {
+            'kind': self.kind, 'name': self.name,
+            'started': time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(self.started)),
+            'size': self.size, 'offset': self.offset, 'bytes': self.bytes,
+            'duration': round(self.elapsed, 3), 'throughput': round(self.throughput, 1),
+            'stalls': len(self.stalls), 'stall_time': round(self.stall_time, 3),
+            'ok': self.ok, 'error': self.error,
+        }
+        if timeline:
+            result['timeline'] = [[t, round(rate, 1)] for t, rate in self.timeline]
+            result['stall_list'] = [list(stall) for stall in self.stalls]
+        return result
+
+
+# 定义一个会话统计类，保存一个客户端会话中所有的传输记录，并按传输类型汇总
+class TransferStats:
+
+    # 初始化方法
+    def __init__(self, max_records=MAX_RECORDS):
+        self.max_records = max_records
+        self.lock = threading.Lock()
+        self.records = []
+        # 按传输类型汇总的数据，键是传输类型，值是一个字典
+        self.totals = {}
+        # 正在进行的传输，界面从这里读取实时的吞吐量
+        self.current = None
+
+    # 开始一次传输的方法，返回传输记录
+    def start(self, kind, name, size=0, offset=0):
+        record = TransferRecord(kind, name, size, offset)
+        with self.lock:
+            self.current = record
+        return record
+
+    # 结束一次传输的方法，把记录加入统计
+    def finish(self, record, ok, error=''):
+        record.finish(ok, error)
+        with self.lock:
+            self.records.append(record)
+            del self.records[:-self.max_records]
+            total = self.totals.setdefault(record.kind, {'count': 0, 'failed': 0, 'bytes': 0, 'duration': 0.0, 'stalls': 0})
+            total['count'] += 1
+            total['failed'] += 0 if ok else 1
+            total['bytes'] += record.bytes
+            total['duration'] += record.duration
+            total['stalls'] += len(record.stalls)
+        return record
+
+    # 生成汇总信息的方法，返回一个字典，键是传输类型，值包括次数、失败次数、字节数、总用时、平均吞吐量和停顿次数
+    def summary(self):
+        with self.lock:
+            result = {}
+            for kind, total in self.totals.items():
+                result[kind] = dict(total, throughput=round(total['bytes'] / max(total['duration'], MIN_DURATION), 1))
+            return result
+
+    # 导出为JSON文件的方法，包括汇总信息和每条记录的时间线
+    def export_json(self, path):
+        with self.lock:
+            records = [record.to_dict() for record in self.records]
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({'summary': self.summary(), 'transfers': records}, f, ensure_ascii=False, indent=2)
+
+    # 导出为CSV文件的方法，每条记录一行，不包括时间线
+    def export_csv(self, path):
+        with self.lock:
+            records = [record.to_dict(timeline=False) for record in self.records]
+        with open(path, 'w', encoding='utf-8', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=CSV_FIELDS)
+            writer.writeheader()
+            writer.writerows(records)
+
+    # 按文件扩展名导出的方法，.csv导出为CSV，其他导出为JSON
+    def export(self, path):
+        if path.lower().endswith('.csv'):
+            self.export_csv(path)
+        else:
+            self.export_json(path)
@@ -0,0 +1,200 @@
+# upload_store.py
+# 这是一个上传文件的存储模块，负责把上传的数据安全地写入磁盘
+# 上传的数据先写入同目录下的临时文件，接收完毕后再用os.replace替换目标文件，中途断开不会留下写了一半的目标文件
+# 开始接收前按文件大小预先分配磁盘空间，减少文件系统的碎片和元数据更新
+# 持久化策略决定什么时候把数据刷到磁盘：none不主动刷盘，end在接收完毕后刷盘一次，periodic每接收一定字节数刷盘一次
+# 内容寻址存储按SHA-256哈希值保存上传过的文件，相同内容再次上传时直接硬链接到目标位置，不需要重新传输
+import hashlib
+import os
+import re
+import secrets
+import shutil
+
+# 定义一些常量
+DURABILITY_MODES = ('none', 'end', 'periodic') # 支持的持久化策略
+SYNC_INTERVAL = 8 * 1024 * 1024 # periodic策略下每接收多少字节刷盘一次
+HASH_BLOCK_SIZE = 1024 * 1024 # 计算文件哈希值时每次读取的字节数
+
+# 定义一个正则表达式，用于检查哈希值的格式，SHA-256的十六进制表示是64个字符
+DIGEST_PATTERN = re.compile(r'[0-9a-f]{64}')
+
+
+# 获取上传临时文件路径的函数，临时文件和目标文件在同一目录下，保证os.replace是原子操作
+# owner是上传者的标识，不同会话同时上传同一个文件时各自写自己的临时文件，不会删掉或替换别人写了一半的数据
+# 同一个会话的标识不变，断点续传时可以找到上次接收了一半的临时文件
+def temp_path(filepath, owner=''):
+    directory, name = os.path.split(filepath)
+    return os.path.join(directory, '.' + name + ('.' + owner if owner else '') + '.part')
+
+
+# 计算文件SHA-256哈希值的函数，size不为None时只计算前size字节，用于断点续传时补算已接收部分的哈希值
+def file_digest(path, size=None, digest=None):
+    digest = digest or hashlib.sha256()
+    with open(path, 'rb') as f:
+        remaining = size
+        while remaining is None or remaining > 0:
+            data = f.read(HASH_BLOCK_SIZE if remaining is None else min(HASH_BLOCK_SIZE, remaining))
+            if not data:
+                break
+            digest.update(data)
+            if remaining is not None:
+                remaining -= len(data)
+    return digest
+
+
+# 让临时文件不再和其他文件共用数据的函数，临时文件有多个硬链接时，在它上面写入会改掉内容寻址存储或目标文件的内容
+# keep为True时先复制一份再替换，保留已经接收的数据，否则直接删除
+def detach_temp(path, keep):
+    if not os.path.exists(path) or os.stat(path).st_nlink <= 1:
+        return
+    if keep:
+        shutil.copyfile(path, path + '.tmp')
+        os.replace(path + '.tmp', path)
+    else:
+        os.remove(path)
+
+
+# 打开上传临时文件的函数，offset为0时创建新的临时文件，否则打开上次的临时文件，从offset处继续写入
+# 临时文件总是只有一个硬链接，写入时不会影响其他文件；owner是上传者的标识，见temp_path
+def open_temp(filepath, offset, owner=''):
+    path = temp_path(filepath, owner)
+    detach_temp(path, keep=bool(offset))
+    if offset:
+        # 没有临时文件但目标文件存在时，说明是在已有文件的基础上续传，把目标文件移动为临时文件
+        # 目标文件有多个硬链接时，说明它和内容寻址存储共用数据，只能复制，不能在原文件上追加
+        if not os.path.exists(path) and os.path.exists(filepath):
+            if os.stat(filepath).st_nlink > 1:
+                shutil.copyfile(filepath, path)
+            else:
+                os.replace(filepath, path)
+        f = open(path, 'r+b' if os.path.exists(path) else 'wb')
+        f.seek(offset)
+    else:
+        # 删除上次留下的临时文件再创建，不在已有的文件上截断
+        if os.path.lexists(path):
+            os.remove(path)
+        f = open(path, 'wb')
+    return f
+
+
+# 预先分配磁盘空间的函数，系统不支持时忽略，预分配失败不影响上传
+def preallocate(f, offset, size):
+    if size > offset and hasattr(os, 'posix_fallocate'):
+        try:
+            os.posix_fallocate(f.fileno(), offset, size - offset)
+        except OSError:
+            pass
+
+
+# 提交上传的函数，把临时文件截断到文件大小并替换目标文件
+def commit(f, filepath, size, syncer):
+    f.truncate(size)
+    syncer.finish()
+    f.close()
+    os.replace(f.name, filepath)
+    # 需要持久化时，目录项的修改也要刷到磁盘，否则断电后替换可能丢失
+    if syncer.mode != 'none':
+        sync_dir(os.path.dirname(filepath))
+
+
+# 把目录刷到磁盘的函数，Windows不支持打开目录，直接忽略
+def sync_dir(path):
+    if os.name == 'nt':
+        return
+    fd = os.open(path or '.', os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+# 定义一个刷盘类，每次上传创建一个，按持久化策略决定什么时候刷盘
+class Syncer:
+
+    # 初始化方法，接受文件对象、持久化策略和刷盘间隔作为参数
+    def __init__(self, f, mode='end', interval=SYNC_INTERVAL):
+        if mode not in DURABILITY_MODES:
+            raise ValueError(f'不支持的持久化策略：{mode}')
+        self.f = f
+        self.mode = mode
+        self.interval = interval
+        # 增加一个属性，用于存储上次刷盘后写入的字节数
+        self.pending = 0
+
+    # 写入数据后调用的方法，periodic策略下累计写入的字节数达到间隔时只刷数据，不刷元数据
+    def written(self, n):
+        if self.mode != 'periodic':
+            return
+        self.pending += n
+        if self.pending >= self.interval:
+            self.sync(data_only=True)
+
+    # 接收完毕后调用的方法，end和periodic策略下把数据和元数据都刷到磁盘
+    def finish(self):
+        if self.mode != 'none':
+            self.sync()
+
+    # 刷盘的方法，没有fdatasync的系统上使用fsync
+    def sync(self, data_only=False):
+        self.f.flush()
+        if data_only and hasattr(os, 'fdatasync'):
+            os.fdatasync(self.f.fileno())
+        else:
+            os.fsync(self.f.fileno())
+        self.pending = 0
+
+
+# 定义一个内容寻址存储类，每个文件按哈希值保存为root/前两位/第三四位/哈希值
+class ContentStore:
+
+    # 初始化方法，接受存储的根目录作为参数，根目录应该和FTP根目录在同一个文件系统上，才能使用硬链接
+    def __init__(self, root):
+        self.root = root
+
+    # 检查哈希值格式是否正确的方法，防止客户端用哈希值拼出存储目录之外的路径
+    @staticmethod
+    def valid(digest):
+        return bool(digest) and DIGEST_PATTERN.fullmatch(digest) is not None
+
+    # 获取某个哈希值对应的存储路径的方法
+    def object_path(self, digest):
+        return os.path.join(self.root, digest[:2], digest[2:4], digest)
+
+    # 把已有的内容放到目标位置的方法，返回一个布尔值，表示存储中是否有这个内容
+    # 先在一个名字唯一的临时文件的位置创建硬链接，再替换目标文件，不支持硬链接时复制一份
+    # 目标文件已经是这个内容的硬链接时什么都不做，否则os.replace在同一个文件的两个链接之间不会做任何事，临时文件会留下来
+    def link_into(self, digest, filepath):
+        if not self.valid(digest):
+            return False
+        source = self.object_path(digest)
+        if not os.path.isfile(source):
+            return False
+        if os.path.exists(filepath) and os.path.samefile(source, filepath):
+            return True
+        path = temp_path(filepath, secrets.token_hex(8))
+        try:
+            os.link(source, path)
+        except OSError:
+            shutil.copyfile(source, path)
+        os.replace(path, filepath)
+        # 替换后临时文件还在时，说明它和目标文件是同一个文件，删除多余的链接
+        if os.path.lexists(path):
+            os.remove(path)
+        return True
+
+    # 把上传完成的文件加入存储的方法，存储中已有相同内容时什么都不做
+    def add(self, filepath, digest):
+        if not self.valid(digest):
+            return
+        target = self.object_path(digest)
+        if os.path.exists(target):
+            return
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        try:
+            os.link(filepath, target)
+        except FileExistsError:
+            pass
+        # 跨文件系统或者不支持硬链接时，先复制到临时文件，再改名，避免其他线程看到复制了一半的文件
+        except OSError:
+            shutil.copyfile(filepath, target + '.tmp')
+            os.replace(target + '.tmp', target)